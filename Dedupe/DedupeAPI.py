@@ -23,16 +23,31 @@ TODO: add documentation on usage here
 
 """
 
+import re
 import csv
 import json
+import time
+import zlib
+import zipfile
 import uuid
+import hashlib
 import logging
+from StringIO import StringIO
 
-from google.appengine.api import namespace_manager, taskqueue
+from google.appengine.api import namespace_manager, mail, taskqueue
 import cloudstorage as gcs
 import webapp2
 
 from config import *
+from records import LineReader
+from dwca import DarwinCoreArchive
+from gcsio import GZIP_WBITS, gunzip
+from DedupeSync import DedupeSync
+from DedupeTask import success_email
+from models import JobProgress
+from cache import cache_key, find_result
+from engine import find_id_field, parse_partial_fields
+from engine import find_default_fields, needs_default_fields
 
 LAST_UPDATED = ''
 REPORT_VERSION = ''
@@ -43,12 +58,25 @@ class DedupeApi(webapp2.RequestHandler):
 Instance attributes:
 
 - action: Type of action to perform on the file
+- archive: whether the upload is a Darwin Core Archive
+- archive_member: name of the core file in the archive
+- archive_size: uncompressed size of the core file
+- cache: whether to reuse the results of an identical earlier request
+- cache_key: key of the results in the result cache (see cache.py), if cached
+- cached_result: CachedResult of an identical earlier request, if its results
+                 are reused
 - cityLatLong: Coordinates of the city of the request
-- col: position of the "recordedBy" field in the file
-- content_type: Content-Type header of the request
+- col: position of the "recordedBy" field in the file, or None
+- collection: id of the collection to check the records against, if any
+- compress: whether to gzip-compress the result file
+- content_encoding: Content-Encoding header of the request
+- content_type: Content-Type header of the request (of the core file, for
+                archives)
 - country: Code of the country of the request
-- dat: position of the "eventDate" field in the file
+- dat: position of the "eventDate" field in the file, or None
+- data_offset: position of the first record in the (decompressed) stored file
 - delimiter: field delimiter, accordint to content_type variable
+- digest: SHA-256 hash of the body, for the result cache
 - duplicate_ids: list of values of the "id" field in duplicate records,
                  for strict duplicates
 - duplicate_order: position of the original-duplicate pair of records,
@@ -65,19 +93,29 @@ Instance attributes:
 - idx: position of the id_field
 - is_dupe: keep track of whether the current record is not a duplicate (0),
            is a strict duplicate (1) or a partial duplicate (2)
-- loc: position of the "locality" field in the file
+- lines: line-reader object over the peek buffer
+- loc: position of the "locality" field in the file, or None
 - partial_duplicate_ids: list of values of the "id" field in duplicate records,
                          for partial duplicates
 - partial_duplicates: number of partial duplicates found
 - partial_duplicates_order: position of the original-duplicate pair of records
                             for partial duplicates
+- partial_fields: JSON list of (position, normalizer) pairs of the partial
+                  duplicate key fields, if given
+- peek: first bytes of the body, holding the header line
+- performance: whether to add stage times and remote calls to the report
 - previous_namespace: Default namespace
+- quotechar: quote character of the file, or "" if fields are never quoted
 - reader: csv-reader object
+- report_url: full URL of the full report, for reused results
 - records: number of records processed, also position indicator
 - report: final report to be delivered to the user
 - request_namespace: Namespace for the current request
-- sci: position of the "scientificName" field in the file
+- sci: position of the "scientificName" field in the file, or None
+- shards: number of shards to split the file in (1 means no split)
 - strict_duplicates: number of strict duplicates found
+- sync: whether to parse the file while the request waits
+- upload_time: seconds spent storing the upload in GCS
 - user_agent: User-Agent header of the request
 - warnings: list conaining all warnings generated during the process
 """
@@ -116,8 +154,255 @@ Instance attributes:
         self._err(405, err_message, err_explain)
         return
 
+    def task_params(self):
+        """Parameters of the de-duplication task."""
+        params = {
+            "latlon": self.cityLatLong,
+            "country": self.country,
+            "user_agent": self.user_agent,
+            "email": self.email,
+            "request_namespace": self.request_namespace,
+            "previous_namesapce": self.previous_namespace,
+            "content_type": self.content_type,
+            "delimiter": self.delimiter,
+            "quotechar": self.quotechar,
+            "extension": self.extension,
+            "action": self.action,
+            "duplicates": self.duplicates,
+            "file_path": self.file_path,
+            "file_name": self.file_name,
+            "headers": json.dumps(self.headers),
+            "loc": self.loc,
+            "sci": self.sci,
+            "dat": self.dat,
+            "col": self.col,
+            "id_field": self.id_field,
+            "partial_fields": self.partial_fields or "",
+            "shards": self.shards,
+            "compression": "zip" if self.archive else
+                           "gzip" if self.content_encoding == "gzip" else "",
+            "archive_member": self.archive_member if self.archive else "",
+            "archive_size": self.archive_size if self.archive else 0,
+            "compress": "true" if self.compress else "false",
+            "data_offset": self.data_offset,
+            "performance": "true" if self.performance else "false",
+            "upload_time": self.upload_time,
+            "cache_key": self.cache_key or "",
+            "collection": self.collection or ""
+        }
+        return params
+
+    def dedupe_sync(self, body):
+        """Parse the upload while the request waits. The task handler writes
+the report and the result file in the response."""
+        # The body is already decompressed, past the header line
+        self.data_offset = 0
+        params = self.task_params()
+        params["compression"] = ""
+        logging.info("Parsing %s bytes synchronously" % len(body))
+        request = webapp2.Request.blank(TASKURL, POST=params)
+        DedupeSync(request, self.response, body).post()
+
+    def reuse_cached(self):
+        """Look up the results of an identical earlier request, once the whole
+upload is hashed, and copy their files to the folder of this request. Return
+whether they can be reused."""
+        # Only options given before the body are known yet
+        self.cache_key = cache_key(self.digest.hexdigest(), {
+            "content_type": self.content_type,
+            "action": self.action,
+            "duplicates": self.duplicates,
+            "id_field": self.request.get("id", None),
+            "partial_fields": self.request.get("partial_fields", None),
+            "compress": self.compress
+        })
+        try:
+            result = find_result(self.cache_key)
+            if result is None:
+                return False
+            # The files of the earlier request may be gone already
+            self.file_url = None
+            if result.file_url is not None:
+                self.file_url = self.copy_result_file(result.file_url)
+            self.report_url = self.copy_result_file(result.report_url)
+        except Exception, e:
+            logging.error("Could not reuse cached results: %s" % e)
+            return False
+        self.cached_result = result
+        return True
+
+    def copy_result_file(self, url):
+        """Copy a result file of an earlier request, given by its URL, to the
+folder of this request. Return the URL of the copy."""
+        prefix = "https://storage.googleapis.com"
+        name = "%s/%s" % (self.file_path, url.rsplit("/", 1)[1])
+        gcs.copy2(url[len(prefix):], name)
+        return prefix + name
+
+    def reuse_result(self, result):
+        """Send the results of an identical earlier request by email, and
+return them, instead of running the job again."""
+        logging.info("Reusing the results of request %s" %
+                     result.request_namespace)
+
+        # Send the summary of the report, with links to the copied files
+        report = json.loads(result.report)
+        report["email"] = self.email
+        if self.action != "report":
+            report["file_url"] = self.file_url
+        report["report_url"] = self.report_url
+        mail.send_mail(sender=EMAIL_SENDER, to=self.email,
+                       subject=EMAIL_SUCCESS_SUBJECT,
+                       body=success_email(self.action, self.file_url,
+                                          self.report_url, report))
+
+        # Build response
+        msg = "This file was de-duplicated recently with the same options."
+        msg += " The results have been sent to your email address"
+        resp = {
+            "status": "success",
+            "message": msg,
+            "email": self.email,
+            "cached": True,
+            "report": report,
+            "request_namespace": result.request_namespace,
+            "status_url": "%s/api/v0/dedupe/%s" % (self.request.host_url,
+                                                   result.request_namespace)
+        }
+        self.response.headers['Content-Type'] = "application/json"
+        self.response.write(json.dumps(resp)+"\n")
+        return
+
+    def sniff_headers(self):
+        """Read the header line from the first bytes of the body. Return False
+if it could not be read."""
+        self.peek = self.file.read(PEEK_SIZE)
+        if self.content_encoding == "gzip":
+            try:
+                d = zlib.decompressobj(GZIP_WBITS)
+                text = d.decompress(self.peek, PEEK_SIZE)
+            except zlib.error:
+                err_explain = "The body of the request could not be" \
+                              " decompressed. Please check the" \
+                              " 'Content-Encoding' header"
+                self._err(400, "Wrong 'Content-Encoding' header", err_explain)
+                return False
+        else:
+            text = self.peek
+        self.lines = LineReader(StringIO(text))
+        self.reader = csv.reader(self.lines, delimiter=self.delimiter)
+        self.headers = self.reader.next()
+        self.headers_lower = [x.lower() for x in self.headers]
+
+        # Check if the whole header line was read
+        if self.lines.tell() == len(text) and \
+                not text.endswith("\n") and len(text) == PEEK_SIZE:
+            err_explain = "The header line should not be longer than %s" \
+                          " bytes" % PEEK_SIZE
+            self._err(400, "Header line too long", err_explain)
+            return False
+        return True
+
+    def store_upload(self):
+        """Copy the body of the request to GCS, in chunks."""
+        if self.archive:
+            # Archives are stored as they come, and read from GCS
+            content_type = "application/zip"
+            start = 0
+        elif self.content_encoding == "gzip":
+            # Compressed bodies are stored as they come, header line included
+            self.file_name += ".gz"
+            content_type = "application/gzip"
+            self.data_offset = self.lines.tell()
+            start = 0
+        else:
+            content_type = self.content_type
+            self.data_offset = 0
+            start = self.lines.tell()
+        started = time.time()
+        # The whole body is hashed on the way, for the result cache
+        self.digest = hashlib.sha256(self.peek)
+        try:
+            f = gcs.open(self.file_name, 'w', content_type=content_type)
+            logging.info("File %s created" % self.file_name)
+            # Copy the body (past the header line if not compressed) in chunks
+            f.write(self.peek[start:])
+            while True:
+                chunk = self.file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.digest.update(chunk)
+                f.write(chunk)
+            # Uploads whose results are reused are left unfinished, so they
+            # are never stored
+            if self.cache and self.reuse_cached():
+                logging.info("Results found in the cache, upload dropped")
+            else:
+                logging.info("Successfully wrote file to GCS")
+                f.close()
+                logging.info("File closed")
+        except Exception, e:
+            logging.error("Something went wrong opening the file:\n"
+                          "f: %s\nerror: %s" % (self.file_name, e))
+            # Only whole uploads can be looked up in the result cache
+            self.cache = False
+            self.cache_key = None
+        self.upload_time = time.time() - started
+
+    def open_archive(self):
+        """Store a Darwin Core Archive in GCS, and read the description of its
+core file from meta.xml. Return False if the archive is not valid."""
+        if self.content_encoding == "gzip":
+            err_explain = "Zip archives can't be gzip-encoded. Please send" \
+                          " the archive as it is"
+            self._err(400, "Wrong 'Content-Encoding' header", err_explain)
+            return False
+        if self.sync:
+            err_explain = "Archives are always parsed in the background"
+            self._err(400, "Wrong 'sync' parameter", err_explain)
+            return False
+
+        self.peek = ""
+        self.file_name = "%s/orig.zip" % self.file_path
+        self.store_upload()
+        if self.cached_result is not None:
+            return True
+
+        # Skip the header lines of the core file, decompressed on the fly
+        try:
+            archive = DarwinCoreArchive(gcs.open(self.file_name))
+            self.lines = LineReader(archive.open())
+            for i in range(archive.ignore_header_lines):
+                next(self.lines, None)
+        except (zipfile.BadZipfile, ValueError, KeyError, SyntaxError), e:
+            err_explain = "The archive could not be read: %s" % e
+            self._err(400, "Wrong Darwin Core Archive", err_explain)
+            return False
+        logging.info("Core file of the archive: %s" % archive.core)
+
+        # Headers, delimiter and quote character come from meta.xml
+        self.archive_member = archive.core
+        self.archive_size = archive.size
+        self.data_offset = self.lines.tell()
+        self.delimiter = archive.delimiter
+        self.quotechar = archive.quotechar
+        self.headers = archive.headers
+        self.headers_lower = [x.lower() for x in self.headers]
+
+        # The result file is a plain text file
+        if self.delimiter == ",":
+            self.content_type = "text/csv"
+            self.extension = "csv"
+        else:
+            self.content_type = "text/tab-separated-values"
+            self.extension = "txt"
+        return True
+
     def post(self):
 
+        # Initialize warnings
+        self.warnings = []
+
         # Check email exists in parameters
         self.email = self.request.get("email", None)
         if self.email is None:
@@ -144,6 +429,10 @@ Instance attributes:
         elif self.content_type == "text/tab-separated-values":
             self.delimiter = "\t"
             self.extension = "txt"
+        elif self.content_type in ARCHIVE_TYPES:
+            # Set from meta.xml once the archive is stored
+            self.delimiter = None
+            self.extension = None
         else:
             err_explain = "The value of 'Content-Type' is not among the" \
                           " accepted values for this header. Should be one" \
@@ -151,6 +440,35 @@ Instance attributes:
             self._err(400, "Wrong 'Content-Type' header", err_explain)
             return
 
+        self.archive = self.content_type in ARCHIVE_TYPES
+
+        # Plain text files are quoted with '"', archives tell in meta.xml
+        self.quotechar = '"'
+
+        # Determine compression via 'Content-Encoding'
+        self.content_encoding = self.request.headers.get('Content-Encoding',
+                                                         'identity')
+        if self.content_encoding not in ALLOWED_ENCODINGS:
+            err_explain = "The value of 'Content-Encoding' is not among the" \
+                          " accepted values for this header. Should be one" \
+                          " of: %s" % ", ".join(ALLOWED_ENCODINGS)
+            self._err(400, "Wrong 'Content-Encoding' header", err_explain)
+            return
+        logging.info("Content-Encoding: %s" % self.content_encoding)
+
+        # Determine result file compression (same as upload by default)
+        self.compress = self.request.get("compress", None)
+        if self.compress is None:
+            self.compress = self.content_encoding == "gzip"
+        elif self.compress in ["true", "false"]:
+            self.compress = self.compress == "true"
+        else:
+            err_explain = "Value of 'compress' parameter %s is not valid."
+            err_explain += " Should be one of: true, false"
+            err_explain = err_explain % self.compress
+            self._err(400, "Wrong 'compress' parameter", err_explain)
+            return
+
         # Determine action ("flag" by default)
         self.action = self.request.get("action", "flag")
         if self.action not in ALLOWED_ACTIONS:
@@ -172,14 +490,98 @@ Instance attributes:
             return
         logging.info("Looking for %s duplicates" % self.duplicates)
 
+        # Determine number of shards (from file size, by default)
+        self.shards = self.request.get("shards", None)
+        if self.shards is None:
+            size = self.request.content_length or 0
+            self.shards = min(MAX_SHARDS, 1 + size // SHARD_SIZE)
+        else:
+            try:
+                self.shards = int(self.shards)
+                assert 1 <= self.shards <= MAX_SHARDS
+            except (ValueError, AssertionError):
+                err_explain = "Value of 'shards' parameter %s is not valid."
+                err_explain += " Should be a number between 1 and %s"
+                err_explain = err_explain % (self.shards, MAX_SHARDS)
+                self._err(400, "Wrong number of shards", err_explain)
+                return
+        logging.info("Using %s shards" % self.shards)
+
+        # Determine whether to parse the file while the request waits (for
+        # small uploads, by default)
+        self.sync = self.request.get("sync", None)
+        small = self.request.content_length is not None and \
+            self.request.content_length <= SYNC_MAX_SIZE
+        if self.sync not in [None, "true", "false"]:
+            err_explain = "Value of 'sync' parameter %s is not valid."
+            err_explain += " Should be one of: true, false"
+            err_explain = err_explain % self.sync
+            self._err(400, "Wrong 'sync' parameter", err_explain)
+            return
+        elif self.sync == "true" and not small:
+            err_explain = "Only uploads of up to %s bytes can be parsed" \
+                          " synchronously" % SYNC_MAX_SIZE
+            self._err(400, "File too large", err_explain)
+            return
+        if self.sync is None:
+            # Archives are read from GCS
+            self.sync = small and not self.archive
+        else:
+            self.sync = self.sync == "true"
+
+        # Determine whether to add a performance section to the report
+        self.performance = self.request.get("performance", "false")
+        if self.performance not in ["true", "false"]:
+            err_explain = "Value of 'performance' parameter %s is not valid."
+            err_explain += " Should be one of: true, false"
+            err_explain = err_explain % self.performance
+            self._err(400, "Wrong 'performance' parameter", err_explain)
+            return
+        self.performance = self.performance == "true"
+        self.upload_time = 0
+
+        # Determine whether to reuse the results of identical requests
+        self.cache = self.request.get("cache", "true")
+        if self.cache not in ["true", "false"]:
+            err_explain = "Value of 'cache' parameter %s is not valid."
+            err_explain += " Should be one of: true, false"
+            err_explain = err_explain % self.cache
+            self._err(400, "Wrong 'cache' parameter", err_explain)
+            return
+        self.cache = self.cache == "true"
+        self.cache_key = None
+        self.cached_result = None
+
+        # Determine the collection to check the records against, if any
+        self.collection = self.request.get("collection", None)
+        if self.collection is not None:
+            if not re.match(COLLECTION_PATTERN, self.collection):
+                err_explain = "Value of 'collection' parameter %s is not" \
+                              " valid. Should have up to 64 letters, digits," \
+                              " dots, dashes or underscores" % self.collection
+                self._err(400, "Wrong 'collection' parameter", err_explain)
+                return
+            # Records are checked against the collection in file order, in a
+            # single task, and results change with every upload
+            self.shards = 1
+            self.cache = False
+            logging.info("Checking against collection %s" % self.collection)
+
         # Get content from request body
         self.body_file = self.request.body_file
         self.file = self.body_file.file
+        self.file_path = "/".join(["", BUCKET, self.request_namespace])
 
-        # Sniff headers
-        self.reader = csv.reader(self.file, delimiter=self.delimiter)
-        self.headers = self.reader.next()
-        self.headers_lower = [x.lower() for x in self.headers]
+        # Darwin Core Archives are stored first: the file to parse and its
+        # fields are described in meta.xml, inside the zip
+        if self.archive:
+            if not self.open_archive():
+                return
+            if self.cached_result is not None:
+                self.reuse_result(self.cached_result)
+                return
+        elif not self.sniff_headers():
+            return
 
         # Check if proper field delimiter
         if len(self.headers) == 1:
@@ -189,70 +591,100 @@ Instance attributes:
             return
 
         # Get positions for partial duplicates
-        self.loc = self.headers_lower.index(LOC.lower())
-        self.sci = self.headers_lower.index(SCI.lower())
-        self.col = self.headers_lower.index(COL.lower())
-        self.dat = self.headers_lower.index(DAT.lower())
+        positions = find_default_fields(self.headers)
+        self.loc, self.sci, self.col, self.dat = positions
+
+        # Check "partial_fields" parameter, as field:normalizer items
+        self.partial_fields = self.request.get("partial_fields", None)
+        if self.partial_fields is not None:
+            try:
+                fields = parse_partial_fields(self.partial_fields,
+                                              self.headers)
+            except ValueError, e:
+                self._err(400, "Wrong 'partial_fields' parameter", str(e))
+                return
+            self.partial_fields = json.dumps(fields)
+            logging.info("Partial duplicate fields: %s" % self.partial_fields)
+
+        # The default fields are only required where they are used
+        if self.duplicates == "all":
+            duplicates = ALL_DUPLICATES
+        else:
+            duplicates = [self.duplicates]
+        if None in positions and \
+                needs_default_fields(duplicates, self.partial_fields):
+            err_explain = "The file should have %s, %s, %s and %s fields" \
+                          " to find %s duplicates" % (LOC, SCI, COL, DAT,
+                                                      self.duplicates)
+            if "fuzzy" not in duplicates and "locality" not in duplicates:
+                err_explain += ", or a 'partial_fields' parameter"
+            self._err(400, "Missing fields", err_explain)
+            return
 
         # Check "id" parameter
         self.id_field = self.request.get("id", None)
         # If not given
         if self.id_field is None:
-            # Find "id" field
-            if 'id' in self.headers_lower:
-                self.id_field = 'id'
-            # Otherwise find "occurrenceid" field
-            elif 'occurrenceid' in self.headers_lower:
-                self.id_field = 'occurrenceid'
+            # Find "id" or "occurrenceid" field
+            self.id_field = find_id_field(self.headers)
             # Otherwise, show warning and don't show "id"-related info
-            else:
+            if self.id_field is None:
                 warning_msg = "No 'id' field could be determined"
                 self.warnings.append(warning_msg)
                 logging.warning(warning_msg)
-                self.id_field = None
         # Otherwise, check if field exists in headers
         elif self.id_field.lower() not in self.headers_lower:
             self._err(400, "Couldn't find field '%s'" % self.id_field)
             return
 
-        # Store original file in GCS
-        self.file_path = "/".join(["", BUCKET, self.request_namespace])
-        self.file_name = "%s/orig.%s" % (self.file_path, self.extension)
-        try:
-            f = gcs.open(self.file_name, 'w', content_type=self.content_type)
-            logging.info("File %s created" % self.file_name)
-            f.write(self.file.read())
-            logging.info("Successfully wrote file to GCS")
-            f.close()
-            logging.info("File closed")
-        except Exception, e:
-            logging.error("Something went wrong opening the file:\n"
-                          "f: %s\nerror: %s" % (self.file_name, e))
+        if not self.archive:
+            self.file_name = "%s/orig.%s" % (self.file_path, self.extension)
+
+        # Parse small uploads right away
+        if self.sync:
+            # The whole body is kept in the peek buffer, in case it has to be
+            # stored in GCS after all
+            self.peek += self.file.read()
+            if self.content_encoding == "gzip":
+                try:
+                    text = gunzip(self.peek, SYNC_MAX_SIZE)
+                except zlib.error:
+                    err_explain = "The body of the request could not be" \
+                                  " decompressed. Please check the" \
+                                  " 'Content-Encoding' header"
+                    self._err(400, "Wrong 'Content-Encoding' header",
+                              err_explain)
+                    return
+            else:
+                text = self.peek
+            if text is not None:
+                self.dedupe_sync(text[self.lines.tell():])
+                return
+            logging.info("Upload too large once decompressed, enqueueing")
+
+        # Store original file in GCS (archives are stored already), unless
+        # the results of an identical request are still available
+        if not self.archive:
+            self.store_upload()
+            if self.cached_result is not None:
+                self.reuse_result(self.cached_result)
+                return
+
+        # Show the request as queued in the status endpoint, before the task
+        # can start and report its own progress
+        JobProgress(id="split" if self.shards > 1 else "dedupe",
+                    namespace=self.request_namespace, status="queued").put()
 
         # Launch async task with parameters
-        params = {
-            "latlon": self.cityLatLong,
-            "country": self.country,
-            "user_agent": self.user_agent,
-            "email": self.email,
-            "request_namespace": self.request_namespace,
-            "previous_namesapce": self.previous_namespace,
-            "content_type": self.content_type,
-            "delimiter": self.delimiter,
-            "extension": self.extension,
-            "action": self.action,
-            "duplicates": self.duplicates,
-            "file_path": self.file_path,
-            "file_name": self.file_name,
-            "headers": json.dumps(self.headers),
-            "loc": self.loc,
-            "sci": self.sci,
-            "dat": self.dat,
-            "col": self.col,
-            "id_field": self.id_field
-        }
+        params = self.task_params()
+
+        # Large files are split in shards, parsed in parallel
+        if self.shards > 1:
+            url = SPLITURL
+        else:
+            url = TASKURL
         taskqueue.add(
-                url=TASKURL,
+                url=url,
                 params=params
             )
 
@@ -262,7 +694,10 @@ Instance attributes:
         resp = {
             "status": "success",
             "message": msg,
-            "email": self.email
+            "email": self.email,
+            "request_namespace": self.request_namespace,
+            "status_url": "%s/api/v0/dedupe/%s" % (self.request.host_url,
+                                                   self.request_namespace)
         }
         self.response.headers['Content-Type'] = "application/json"
         self.response.write(json.dumps(resp)+"\n")
@@ -0,0 +1,363 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Sharded de-duplication.
+
+Large files are processed in three stages:
+
+- split: the original file is split in N shard files under the request
+  namespace. Records are assigned to shards by their partial duplicate key
+  (or their strict duplicate key, if only strict duplicates are checked, or
+  their fuzzy duplicate block or locality duplicate group, if those are
+  checked), so all the potential duplicates of a record fall in the same
+  shard. Each record
+  is prefixed with its position in the original file.
+- shard: N worker tasks look for duplicates in their shards in parallel, as
+  report-only jobs, and store their results in GCS.
+- merge: the results of all shards are gathered in a single report and, for
+  flag and remove actions, the original file is parsed again to build the
+  single result file, in the original record order.
+
+"""
+
+import csv
+import json
+import time
+import struct
+import logging
+
+from google.appengine.api import namespace_manager, taskqueue
+from google.appengine.ext import ndb
+import cloudstorage as gcs
+
+from config import *
+from models import ShardJob
+from DedupeTask import DedupeTask, add_task, compose
+from fuzzy import FuzzyIndex
+from gcsio import BufferedWriter
+from locality import LocalityIndex
+from normalize import normalize_text, normalize_date
+from pairs import DuplicatePairs
+
+
+def shard_path(file_path, shard):
+    """Path of the GCS objects of a given shard."""
+    return "%s/shard.%04d" % (file_path, shard)
+
+
+@ndb.transactional
+def shard_done(job_id, shard, params):
+    """Mark a shard as done, and launch the merge stage if it was the last
+one. Safe to call more than once for the same shard."""
+    job = ShardJob.get_by_id(job_id)
+    if shard in job.done:
+        return
+    job.done.append(shard)
+    job.put()
+    if len(job.done) == job.shards:
+        taskqueue.add(url=MERGEURL, params=params, transactional=True)
+        logging.info("All %s shards done, merge enqueued" % job.shards)
+
+
+class DedupeSplit(DedupeTask):
+    """
+Split the original file in shards and launch a worker task for each one.
+Shard files are written in parts, one per checkpoint, so the split can stop
+before the deadline and resume in a new task like DedupeTask.
+
+Instance attributes (besides those of DedupeTask):
+
+- files: buffered writers for the current part of each shard file
+- shards: number of shards
+- writers: csv-writer objects, one per shard
+"""
+
+    def raw_records(self):
+        # Records are written back with their position, parse them fully
+        return False
+
+    def projected_columns(self):
+        return None
+
+    def progress_id(self):
+        return "split"
+
+    def shard_of(self, row):
+        """Shard a record belongs to."""
+        block = None
+        if "fuzzy" in self.duplicates:
+            block = FuzzyIndex.block_key(normalize_text(row[self.sci]),
+                                         normalize_date(row[self.dat]))
+        if block is None and "locality" in self.duplicates:
+            block = LocalityIndex.group_key(row[self.sci], row[self.dat])
+        if block is not None:
+            key = self.partial_fingerprint.data(block)
+        elif "partial" in self.duplicates:
+            key = self.partial_key(row)
+        else:
+            key = self.strict_key(row)
+        return struct.unpack("<Q", key[:8])[0] % self.shards
+
+    def read_params(self):
+        super(DedupeSplit, self).read_params()
+        self.shards = int(self.request.get("shards"))
+
+    def writes_output(self):
+        # Records are written to the shard files
+        return True
+
+    def stores(self):
+        # Records are not checked, no keys to keep across runs
+        return []
+
+    def shard_part(self, shard, part):
+        """Name of the GCS object for the given part of a shard file."""
+        return "%s/orig.%s.%04d" % (shard_path(self.file_path, shard),
+                                    self.extension, part)
+
+    def open_output(self):
+        self.open_part()
+
+    def open_part(self):
+        """Open a new part of each shard file in GCS."""
+        self.files = []
+        self.writers = []
+        for shard in range(self.shards):
+            name = self.shard_part(shard, self.checkpoints)
+            # Shards share the write buffer, written on this same thread
+            f = BufferedWriter(gcs.open(name, 'w',
+                                        content_type=self.content_type),
+                               WRITE_BUFFER_SIZE // self.shards,
+                               background=False)
+            self.files.append(f)
+            self.writers.append(csv.writer(f, delimiter=self.delimiter))
+
+    def close_part(self):
+        """Close the current part of each shard file."""
+        for f in self.files:
+            f.close()
+            self.count_rpcs("gcs_write", f.blocks)
+
+    def parse_window(self, window):
+        """Write each record, with its position, in its shard."""
+        started = time.time()
+        for records, row in window:
+            self.writers[self.shard_of(row)].writerow([records] + row)
+        self.timed("write", started)
+
+    def finish(self):
+        """Compose the shard files and launch a worker task for each one."""
+        try:
+            self.close_part()
+            for shard in range(self.shards):
+                parts = [self.shard_part(shard, i)
+                         for i in range(self.checkpoints + 1)]
+                name = "%s/orig.%s" % (shard_path(self.file_path, shard),
+                                       self.extension)
+                compose(parts, name, self.content_type)
+        except Exception, e:
+            self._err(500, "Could not write shard files", e)
+            return
+        logging.info("Split %s records in %s shards" %
+                     (self.records, self.shards))
+
+        # A retry of the split finds the job created already, and the shard
+        # tasks enqueued under the same names
+        ShardJob.get_or_insert(self.request_namespace, shards=self.shards)
+        params = dict((k, self.request.get(k))
+                      for k in self.request.arguments() if k != "checkpoint")
+        for shard in range(self.shards):
+            params["shard"] = shard
+            add_task(self.task_name("shard.%04d" % shard, 0), SHARDURL,
+                     params)
+        self.save_progress("done")
+
+        # Return to default namespace
+        namespace_manager.set_namespace(self.previous_namespace)
+
+        # Build response
+        resp = {
+            "status": "split",
+            "records": self.records,
+            "shards": self.shards
+        }
+        self.response.headers['Content-Type'] = "application/json"
+        self.response.write(json.dumps(resp)+"\n")
+        return
+
+
+class DedupeShardTask(DedupeTask):
+    """
+Look for duplicates in a single shard. Runs as a report-only DedupeTask on the
+shard file, with record positions taken from the first field of each row.
+
+Instance attributes (besides those of DedupeTask):
+
+- shard: index of the shard
+"""
+
+    def read_params(self):
+        super(DedupeShardTask, self).read_params()
+        self.shard = int(self.request.get("shard"))
+
+        # Each shard has its own path for checkpoints and results
+        self.file_path = shard_path(self.file_path, self.shard)
+        self.file_name = "%s/orig.%s" % (self.file_path, self.extension)
+        self.action = "report"
+
+        # Shard files are written uncompressed, with no header line, by
+        # csv-writers quoting with '"'
+        self.compression = None
+        self.data_offset = 0
+        self.quotechar = '"'
+
+        # The upload is timed once, by the merge stage
+        self.upload_time = 0
+
+    def raw_records(self):
+        # Records carry their position in the first field, parse them fully
+        return False
+
+    def projected_columns(self):
+        return None
+
+    def progress_id(self):
+        return "shard.%04d" % self.shard
+
+    def rows(self):
+        # Records of the shard are counted for progress, and referred to by
+        # their position in the original file
+        for row in self.reader:
+            self.records += 1
+            yield int(row.pop(0)), row
+
+    def finish(self):
+        """Store the results of the shard and tell the merge stage."""
+        f = gcs.open("%s/report.json" % self.file_path, 'w',
+                     content_type="application/json")
+        f.write(json.dumps(self.state()))
+        f.close()
+        logging.info("Shard %s done" % self.shard)
+        self.save_progress("done")
+
+        # Launch merge if this was the last shard, with the original params
+        params = dict((k, self.request.get(k))
+                      for k in self.request.arguments()
+                      if k not in ["shard", "checkpoint"])
+        shard_done(self.request_namespace, self.shard, params)
+
+        # Return to default namespace
+        namespace_manager.set_namespace(self.previous_namespace)
+
+        # Build response
+        resp = {
+            "status": "shard done",
+            "shard": self.shard,
+            "strict_duplicates": self.strict_duplicates,
+            "partial_duplicates": self.partial_duplicates,
+            "fuzzy_duplicates": self.fuzzy_duplicates,
+            "locality_duplicates": self.locality_duplicates
+        }
+        self.response.headers['Content-Type'] = "application/json"
+        self.response.write(json.dumps(resp)+"\n")
+        return
+
+
+class DedupeMergeTask(DedupeTask):
+    """
+Gather the results of all shards. For flag and remove actions, parse the
+original file again to build the result file, with the duplicate status taken
+from the shard results instead of checking the records.
+
+Instance attributes (besides those of DedupeTask):
+
+- shard_records: number of records of all shards, also position of the last
+                 record in the original file
+- shard_status: (is_dupe, dupe_ref) of each duplicate record, by position
+- shards: number of shards
+"""
+
+    def progress_id(self):
+        return "merge"
+
+    def init_report(self):
+        super(DedupeMergeTask, self).init_report()
+        self.shards = int(self.request.get("shards"))
+        self.shard_records = 0
+
+        # Add up the results of all shards
+        for shard in range(self.shards):
+            f = gcs.open("%s/report.json" % shard_path(self.file_path, shard))
+            state = json.loads(f.read())
+            f.close()
+            self.shard_records += state["records"]
+            self.warnings += state["warnings"]
+            self.strict_duplicates += state["strict_duplicates"]
+            self.duplicate_order.update(
+                DuplicatePairs.load(state["duplicate_order"]))
+            self.partial_duplicates += state["partial_duplicates"]
+            self.partial_duplicates_order.update(
+                DuplicatePairs.load(state["partial_duplicates_order"]))
+            self.fuzzy_duplicates += state["fuzzy_duplicates"]
+            self.fuzzy_duplicates_order.update(
+                DuplicatePairs.load(state["fuzzy_duplicates_order"]))
+            self.locality_duplicates += state["locality_duplicates"]
+            self.locality_duplicates_order.update(
+                DuplicatePairs.load(state["locality_duplicates_order"]))
+            # Shards run at the same time: their times add up to more than
+            # the time the job took
+            for stage, seconds in state.get("timings", {}).iteritems():
+                self.add_time(stage, seconds)
+            for service, calls in state.get("rpcs", {}).iteritems():
+                self.count_rpcs(service, calls)
+
+        # Status of duplicate records, by position in the original file
+        self.shard_status = {}
+        for dupe, records in self.duplicate_order:
+            self.shard_status[records] = (STRICT_DUPE, dupe)
+        for pdupe, records in self.partial_duplicates_order:
+            self.shard_status[records] = (PARTIAL_DUPE, pdupe)
+        for fdupe, records, score in self.fuzzy_duplicates_order:
+            self.shard_status[records] = (FUZZY_DUPE, fdupe)
+        for ldupe, records, score in self.locality_duplicates_order:
+            self.shard_status[records] = (LOCALITY_DUPE, ldupe)
+
+    def open_reader(self):
+        # Report-only jobs don't need to parse the original file again
+        if self.action == "report":
+            self.file = None
+            return
+        super(DedupeMergeTask, self).open_reader()
+
+    def close_reader(self):
+        if self.file is not None:
+            super(DedupeMergeTask, self).close_reader()
+
+    def bytes_read(self):
+        if self.file is None:
+            return self.file_size
+        return super(DedupeMergeTask, self).bytes_read()
+
+    def rows(self):
+        if self.file is None:
+            self.records = self.shard_records
+            return iter([])
+        return super(DedupeMergeTask, self).rows()
+
+    def parse_window(self, window):
+        for records, row in window:
+            self.is_dupe, self.dupe_ref = self.shard_status.get(
+                records, (NO_DUPE, None))
+            self.handle_row(row, records)
@@ -0,0 +1,118 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Status API.
+
+Shows the progress of a de-duplication request, from the progress entities
+stored by its tasks in the request namespace (see DedupeTask.save_progress).
+
+Usage:
+    Send a GET request to /api/v0/dedupe/<request_namespace>, the namespace
+    being the one returned by the de-duplication request.
+
+"""
+
+import json
+import logging
+from datetime import datetime
+
+import webapp2
+
+from config import *
+from models import JobProgress
+
+COUNTERS = ["records", "bytes_read", "file_size", "rows_per_second",
+            "strict_duplicates", "partial_duplicates", "fuzzy_duplicates",
+            "locality_duplicates"]
+
+
+def job_status(progress):
+    """Build the status of a job from the progress entities of its tasks.
+Sharded jobs show the progress of all shards added up until the merge stage
+starts."""
+    tasks = dict((x.key.id(), x) for x in progress)
+    shards = [v for k, v in tasks.iteritems() if k.startswith("shard.")]
+    if "merge" in tasks:
+        stage, current = "merge", [tasks["merge"]]
+    elif shards:
+        stage, current = "shards", shards
+    elif "split" in tasks:
+        stage, current = "split", [tasks["split"]]
+    else:
+        stage, current = "dedupe", progress
+
+    status = {
+        "stage": stage,
+        "updated_at": max(x.updated_at for x in progress).isoformat()
+    }
+    for counter in COUNTERS:
+        status[counter] = sum(getattr(x, counter) or 0 for x in current)
+    # Shards run at the same time
+    status["seconds"] = max(x.seconds or 0 for x in current)
+
+    # Overall status: error if any task failed, done when the last stage is
+    # done, queued until the first task starts
+    statuses = set(x.status for x in current)
+    errors = [x for x in progress if x.status == "error"]
+    if errors:
+        status["status"] = "error"
+        status["error"] = errors[0].error
+    elif statuses == set(["done"]) and stage in ["dedupe", "merge"]:
+        status["status"] = "done"
+    elif statuses == set(["queued"]):
+        status["status"] = "queued"
+    else:
+        status["status"] = "running"
+        idle = datetime.now() - max(x.updated_at for x in progress)
+        status["stalled"] = idle.total_seconds() > STALLED_AFTER
+
+    # Share of the stage done, and estimated seconds left at the same pace
+    if status["file_size"] and status["status"] == "running":
+        done = min(float(status["bytes_read"]) / status["file_size"], 1.0)
+        status["progress"] = round(done, 4)
+        if done > 0:
+            status["eta_seconds"] = int(status["seconds"] * (1 - done) / done)
+    return status
+
+
+class DedupeStatus(webapp2.RequestHandler):
+    """Show the progress of a de-duplication request."""
+
+    def _err(self, err_code=500, err_message="", err_explain=""):
+        self.error(err_code)
+        resp = {
+            "status": "error",
+            "error": err_message,
+            "message": err_explain
+        }
+        logging.error(err_message)
+        logging.error(err_explain)
+        self.response.headers['Content-Type'] = "application/json"
+        self.response.write(json.dumps(resp)+"\n")
+        return
+
+    def get(self, request_namespace):
+        progress = JobProgress.query(namespace=request_namespace).fetch()
+        if not progress:
+            err_explain = "There is no de-duplication request with id %s" % \
+                request_namespace
+            self._err(404, "Request not found", err_explain)
+            return
+
+        resp = job_status(progress)
+        resp["request_namespace"] = request_namespace
+        self.response.headers['Content-Type'] = "application/json"
+        self.response.write(json.dumps(resp)+"\n")
+        return
@@ -0,0 +1,118 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Synchronous de-duplication.
+
+Small uploads (up to SYNC_MAX_SIZE bytes) are de-duplicated by the API handler
+itself, while the request waits. The upload is parsed from memory: nothing is
+stored in GCS, no task is enqueued and no email is sent. The response holds the
+report and, for flag and remove actions, the result file.
+
+"""
+
+import csv
+import json
+import logging
+from StringIO import StringIO
+
+from google.appengine.api import namespace_manager
+
+from config import *
+from DedupeTask import DedupeTask
+
+
+class DedupeSync(DedupeTask):
+    """
+Parse an upload held in memory, with the same parameters as a queued task.
+
+Instance attributes (besides those of DedupeTask):
+
+- body: uncompressed content of the upload, past the header line
+"""
+
+    # The full report goes in the response
+    detailed_report = True
+    # Nothing is checkpointed
+    track_added = False
+
+    def __init__(self, request, response, body):
+        super(DedupeSync, self).__init__(request, response)
+        self.body = body
+        self.f = None
+
+    def read_params(self):
+        super(DedupeSync, self).read_params()
+        # The result file goes in the JSON response, as text
+        self.compress = False
+
+    def original_size(self):
+        return len(self.body)
+
+    def load_checkpoint(self):
+        # Small uploads are parsed in a single run
+        pass
+
+    def save_checkpoint(self):
+        # Small uploads are parsed in a single run
+        pass
+
+    def save_progress(self, status="running"):
+        # The request waits for the results, no need to show progress
+        pass
+
+    def hand_over(self):
+        # The request waits for the results, no task can take over
+        self._err(500, "Could not parse the upload in time",
+                  "Stopped at record %s" % self.records)
+
+    def open_original(self):
+        self.file = StringIO(self.body)
+
+    def close_reader(self):
+        self.file.close()
+        self.flush_collection()
+        self.count_store_rpcs()
+
+    def open_part(self):
+        # The result file is a single part, kept in memory
+        if self.f is not None:
+            return
+        self.f = StringIO()
+        self.writer = csv.writer(self.f, delimiter=self.delimiter)
+        self.f.write(str(self.delimiter.join(self.headers)))
+        self.f.write("\n")
+
+    def finish(self):
+        """Build the report and log the request. The report and the result
+file are returned in the response."""
+        self.build_report()
+        self.report["status"] = "success"
+        if self.action != "report":
+            self.report["file"] = self.f.getvalue()
+            self.f.close()
+
+        # Return to default namespace
+        namespace_manager.set_namespace(self.previous_namespace)
+
+        # Add entry to log
+        self.log_success()
+        logging.info("Synchronous de-duplication done: %s records" %
+                     self.records)
+
+        # Build response
+        resp = self.report
+        self.response.headers['Content-Type'] = "application/json"
+        self.response.write(json.dumps(resp)+"\n")
+        return
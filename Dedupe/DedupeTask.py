@@ -28,16 +28,21 @@ Usage:
 import os
 import csv
 import json
-import hashlib
+import time
 import logging
-from StringIO import StringIO
 from datetime import datetime
 
-from google.appengine.api import namespace_manager, memcache, mail, taskqueue
+from google.appengine.api import namespace_manager, mail, taskqueue
 import cloudstorage as gcs
 import webapp2
 
 from config import *
+from engine import Deduper, STAGES, default_partial_fields
+from records import LineReader
+from gcsio import PrefetchReader, BufferedWriter
+from dwca import open_member
+from models import JobProgress
+from cache import store_result
 
 LAST_UPDATED = '2016-08-05T13:15:56+CEST'
 API_VERSION = 'search 2016-08-05T13:15:56+CEST'
@@ -49,51 +54,107 @@ else:
     QUEUE_NAME = 'apitracker'
 
 
-class DedupeTask(webapp2.RequestHandler):
+def add_task(name, url, params):
+    """Enqueue a task, unless a task with the same name was enqueued already.
+Retries of the enqueuing task use the same name, so the task runs only once.
+Return whether the task was enqueued."""
+    try:
+        taskqueue.add(name=name, url=url, params=params)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        logging.info("Task %s was already enqueued" % name)
+        return False
+    return True
+
+
+def position_param(value):
+    """Position of a field from a task parameter, or None if the field is
+missing from the file."""
+    if value in [None, "", "None"]:
+        return None
+    return int(value)
+
+
+def compose(parts, name, content_type):
+    """Compose GCS objects, given by full name, into a single object, and
+delete them."""
+    if len(parts) == 1:
+        gcs.copy2(parts[0], name)
+    else:
+        # GCS composes at most 32 objects in each call
+        prefix = "/%s/" % BUCKET
+        pending = [x[len(prefix):] for x in parts]
+        sources = []
+        while len(pending) > 0:
+            n = 32 - len(sources)
+            gcs.compose(sources + pending[:n], name,
+                        content_type=content_type)
+            pending = pending[n:]
+            sources = [name[len(prefix):]]
+    for part in parts:
+        gcs.delete(part)
+
+
+def success_email(action, file_url, report_url, report):
+    """Body of the email sent when a job is done, with links to the result
+file (if any) and the full report, and the summary of the report."""
+    # Build explanation note for email
+    action_description = ""
+    if action == "flag":
+        action_description = ACTION_FLAG
+    elif action == "remove":
+        action_description = ACTION_REMOVE
+
+    # Links to the result file, if any, and the full report
+    links = "Full report: %s" % report_url
+    if action != "report":
+        links = "Result file: %s\n%s" % (file_url, links)
+
+    return EMAIL_SUCCESS_BODY.format(
+        links,
+        action_description,
+        json.dumps(report, sort_keys=True, indent=4))
+
+
+class DedupeTask(Deduper, webapp2.RequestHandler):
     """
-Instance attributes:
-
-- action: Type of action to perform on the file
+Instance attributes (besides those of Deduper):
+
+- archive_member: name of the core file in the zip, for Darwin Core Archives
+- archive_size: uncompressed size of the core file, for Darwin Core Archives
+- cache_key: key of the results in the result cache, if they are cached
+- checkpoint_name: full name of the GCS object holding the task progress
+- checkpointed: time of the last checkpoint
+- checkpoints: number of checkpoints saved so far, also index of the current
+               part of the result file
 - cityLatLong: Coordinates of the city of the request
-- col: position of the "recordedBy" field in the file
+- compress: whether the result file is gzip-compressed
+- compression: compression of the original file (None, "gzip", or "zip" for
+               Darwin Core Archives)
 - content_type: Content-Type header of the request
 - country: Code of the country of the request
-- dat: position of the "eventDate" field in the file
-- delimiter: field delimiter, accordint to content_type variable
-- dupe_ref: position of the original record (for flagging)
-- duplicate_ids: list of values of the "id" field in duplicate records,
-                 for strict duplicates
-- duplicate_order: position of the original-duplicate pair of records,
-                 for strict duplicates
-- duplicates: List with types of duplicates to find (strict, partial, all...)
+- data_offset: position of the first record in the (decompressed) original
+               file, past the header line if it was kept
 - email: email address to send notifications to
 - extension: file extension (.txt for tab-delimited, .csv for comma-separated)
+- f: buffered writer for the current part of the result file
 - file: file-object sent by the user in the POST body
 - file_name: full name of the Google Cloud Storage object (bucket + file path)
 - file_url: full URL to allow external access to the Google Cloud Storage file
-- headers: field names of the sent file
-- headers_lower: lowercase version of self.headers
-- id_field: field used as "id" for the record
-- idx: position of the id_field
-- is_dupe: keep track of whether the current record is not a duplicate (0),
-           is a strict duplicate (1) or a partial duplicate (2)
-- loc: position of the "locality" field in the file
-- partial_duplicate_ids: list of values of the "id" field in duplicate records,
-                         for partial duplicates
-- partial_duplicates: number of partial duplicates found
-- partial_duplicates_order: position of the original-duplicate pair of records
-                            for partial duplicates
+- offset: position in the original file of the first record to parse
 - previous_namespace: Default namespace
-- reader: csv-reader object
-- records: number of records processed, also position indicator
-- report: final report to be delivered to the user
-- request_namespace: Namespace for the current request
-- sci: position of the "scientificName" field in the file
-- strict_duplicates: number of strict duplicates found
+- progress_records: number of records processed at the last progress write
+- progressed: time of the last progress write
+- report_url: full URL to allow external access to the full report in GCS
+- upload_time: seconds spent storing the upload in GCS
 - user_agent: User-Agent header of the request
-- warnings: list conaining all warnings generated during the process
 """
 
+    # The response and the email hold a summary of the report, the full
+    # report is stored in GCS
+    detailed_report = False
+    # What the stores add is dumped at each checkpoint
+    track_added = True
+
     def _err(self, err_code=500, err_message="", err_explain=""):
         """Return a custom error message along with the error code."""
         self.error(err_code)
@@ -107,6 +168,14 @@ Instance attributes:
         self.response.headers['Content-Type'] = "application/json"
         self.response.write(json.dumps(resp)+"\n")
 
+        # Show the error in the status endpoint
+        try:
+            JobProgress(id=self.progress_id(),
+                        namespace=self.request_namespace, status="error",
+                        error=err_message).put()
+        except Exception, e:
+            logging.error("Could not store the task progress: %s" % e)
+
         # Send email to admin with details
         mail.send_mail(
             sender=EMAIL_SENDER,
@@ -148,9 +217,12 @@ Sorry for the inconvenience, and thanks for your understanding.
             user_agent=self.user_agent, warnings=self.warnings,
             error=err_message, email=self.email, action=self.action,
             duplicates=self.duplicates,
-            loc=self.headers[self.loc], sci=self.headers[self.sci],
-            dat=self.headers[self.dat], col=self.headers[self.col],
+            loc=self.field_name(self.loc), sci=self.field_name(self.sci),
+            dat=self.field_name(self.dat), col=self.field_name(self.col),
             id_field=self.id_field, namespace=self.request_namespace,
+            collection=self.collection,
+            partial_fields=["%s:%s" % (self.headers[x], n)
+                            for x, n in self.partial_fields],
             content_type=self.content_type, file_size=self.file_size
         )
         taskqueue.add(
@@ -169,17 +241,9 @@ Sorry for the inconvenience, and thanks for your understanding.
             # Assign email subject
             subject = EMAIL_SUCCESS_SUBJECT
 
-            # Build explanation note for email
-            if self.action == "flag":
-                action_description = ACTION_FLAG
-            elif self.action == "remove":
-                action_description = ACTION_REMOVE
-
             # Create email body
-            body = EMAIL_SUCCESS_BODY.format(
-                self.file_url,
-                action_description,
-                json.dumps(self.report, sort_keys=True, indent=4))
+            body = success_email(self.action, self.file_url, self.report_url,
+                                 self.report)
 
         else:
             subject = EMAIL_ERROR_SUBJECT
@@ -192,86 +256,194 @@ Sorry for the inconvenience, and thanks for your understanding.
 
         return
 
-    def check_strict_dupes(self, row):
-        """Check if the provided record is a strict duplicate of a previous
-one."""
-        # Calculate md5 hash
-        k = hashlib.md5(str(row)).hexdigest()
-        # Check if hash exists in memcache
-        dupe = memcache.get(k, namespace=self.request_namespace)
-        # If exists, STRICT_DUPE
-        if dupe is not None:
-            self.is_dupe = STRICT_DUPE
-            self.strict_duplicates += 1
-            self.dupe_ref = dupe
-            self.duplicate_order.add((dupe, self.records))
-            if self.id_field is not None:
-                self.duplicate_ids.add(row[self.idx])
-            return 1
-        # Otherwise, store key in memcache
-        else:
-            memcache.set(k, self.records, namespace=self.request_namespace)
-            return 0
-
-    def check_partial_dupes(self, row):
-        """Check if the provided record is a partial duplicate of a previous
-one."""
-        # Build id string
-        pk = "|".join([row[self.loc], row[self.sci],
-                       row[self.col], row[self.dat]])
-        # Check if key exists in memcache
-        pdupe = memcache.get(pk, namespace=self.request_namespace)
-        # If exists, PARTIAL_DUPE
-        if pdupe is not None:
-            self.is_dupe = PARTIAL_DUPE
-            self.partial_duplicates += 1
-            self.dupe_ref = pdupe
-            self.partial_duplicates_order.add((pdupe, self.records))
-            if self.id_field is not None:
-                self.partial_duplicate_ids.add(row[self.idx])
-            return 1
-        # Otherwise, store key in memcache
-        else:
-            memcache.set(pk, self.records,
-                         namespace=self.request_namespace)
-            return 0
-
-    def handle_row(self, row):
-        """Handle row according to check result and action type:
-- No duplicate and action is remove or flag: write row
-- Duplicate and action is remove: skip writing row
-- Duplicate and action is flag: update record and write row
-"""
+    def part_name(self, part):
+        """Name of the GCS object for the given part of the result file."""
+        return "%s.%04d" % (self.file_name, part)
 
-        # If action is remove and is duplicate, or action is report, omit write
-        if (self.action == "remove" and self.is_dupe != NO_DUPE) \
-                or self.action == "report":
-            pass
+    def seen_name(self, kind, checkpoint):
+        """Name of the GCS object holding the keys added to a seen-key store
+before a checkpoint, and after the previous one."""
+        return "%s/seen.%s.%04d" % (self.file_path, kind, checkpoint)
 
-        # Otherwise, write row
-        else:
-            # If action is flag, add three flag fields to row
-            if self.action == "flag":
-                row.append(bool(self.is_dupe))
-                row.append(self.is_dupe if self.is_dupe > 0 else None)
-                row.append(self.dupe_ref)
-
-            try:  # Workaround to handle proper conversion
-                si = StringIO()
-                cw = csv.writer(si, delimiter=self.delimiter)
-                cw.writerow(row)
-                self.f.write(si.getvalue())
+    def writes_output(self):
+        """Whether the task writes its output in parts, closed at every
+checkpoint. Only flag and remove actions have a result file."""
+        return self.action != "report"
+
+    def open_output(self):
+        """Create the result file in GCS, if any."""
+        if not self.writes_output():
+            return
+        self.file_name = "%s/modif.%s" % (self.file_path, self.extension)
+        if self.compress:
+            self.file_name += ".gz"
+        if self.action == "flag":
+            self.headers += ["isDuplicate", "duplicateType", "duplicateOf"]
+        self.open_part()
+
+    def result_type(self):
+        """Content-Type of the result file and its parts."""
+        # Compressed parts are gzip members, still valid once composed
+        if self.compress:
+            return "application/gzip"
+        return self.content_type
+
+    def open_part(self):
+        """Open a new part of the result file in GCS. Headers go in the first
+part."""
+        try:
+            self.f = BufferedWriter(gcs.open(self.part_name(self.checkpoints),
+                                             'w',
+                                             content_type=self.result_type()),
+                                    compress=self.compress)
+            self.writer = csv.writer(self.f, delimiter=self.delimiter)
+            logging.info("Created GCS file in %s" %
+                         self.part_name(self.checkpoints))
+        except Exception, e:
+            self._err(500, "Could not open result file", e)
+
+        # Write headers
+        if self.checkpoints == 0:
+            try:
+                self.f.write(str(self.delimiter.join(self.headers)))
+                self.f.write("\n")
+                logging.info("Successfully wrote headers in file")
             except Exception, e:
-                logging.warning("Something went wrong writing a row\n"
-                                "f: %s\nrow: %s\nerror: %s" %
-                                (self.file_name, row, e))
-                self.warnings.append("Could not write record %s in new file" %
-                                     self.records)
+                self._err(500, "Could not write headers in result file", e)
 
-    def post(self):
-        """Main function. Parse the file for duplicates."""
+    def close_part(self):
+        """Close the current part of the result file, and log the write
+throughput."""
+        self.f.close()
+        logging.info("Write throughput: %s" % self.f.stats())
+        self.count_rpcs("gcs_write", self.f.blocks)
+
+    def compose_parts(self):
+        """Compose all the parts of the result file into the final file."""
+        parts = [self.part_name(i) for i in range(self.checkpoints + 1)]
+        compose(parts, self.file_name, self.result_type())
+
+    def save_checkpoint(self):
+        """Store the progress of the task in GCS: position in the original
+file, counters, duplicate pairs and the seen keys added since the previous
+checkpoint. The current part of the result file is closed, so the output
+written so far is kept."""
+        started = time.time()
+        if self.writes_output():
+            self.close_part()
+        self.checkpoints += 1
+
+        # The keys added to the collection are counted once stored
+        self.flush_collection()
+
+        # Dump new seen keys first, the checkpoint is only valid once written
+        for store in self.stores():
+            f = gcs.open(self.seen_name(store.kind, self.checkpoints), 'w')
+            store.dump(f)
+            f.close()
+
+        # Only the time spent so far gets in the checkpoint
+        started = self.timed("checkpoint", started)
+        state = self.state()
+        state["offset"] = self.reader_offset()
+        state["checkpoints"] = self.checkpoints
+
+        f = gcs.open(self.checkpoint_name, 'w',
+                     content_type="application/json")
+        f.write(json.dumps(state))
+        f.close()
+        self.checkpointed = self.timed("checkpoint", started)
+        logging.info("Checkpoint %s saved at record %s" %
+                     (self.checkpoints, self.records))
+
+    def load_checkpoint(self):
+        """Restore the progress saved by a previous run of the task, if
+any."""
+        try:
+            f = gcs.open(self.checkpoint_name)
+        except gcs.NotFoundError:
+            return
+        state = json.loads(f.read())
+        f.close()
+
+        self.offset = state["offset"]
+        self.checkpoints = state["checkpoints"]
+        self.load_state(state)
+
+        # Seen keys are replayed in the order they were added
+        for checkpoint in range(1, self.checkpoints + 1):
+            for store in self.stores():
+                f = gcs.open(self.seen_name(store.kind, checkpoint))
+                store.load(f)
+                f.close()
+        logging.info("Resuming from checkpoint %s at record %s" %
+                     (self.checkpoints, self.records))
+
+    def progress_id(self):
+        """Id of the progress entity of the task."""
+        return "dedupe"
+
+    def bytes_read(self):
+        """Bytes of the original file parsed so far. For compressed files,
+bytes fetched from GCS so far, prefetched buffers included."""
+        if self.compression == "gzip":
+            return self.file.fetched
+        return self.reader_offset()
+
+    def save_progress(self, status="running"):
+        """Store the progress of the task, for the status endpoint. A single
+datastore write, at most every PROGRESS_INTERVAL seconds while parsing.
+Running tasks show the current throughput, finished ones the overall one."""
+        now = time.time()
+        if status == "running":
+            rate = (self.records - self.progress_records) / \
+                max(now - self.progressed, 0.001)
+        else:
+            rate = self.records / max(self.elapsed(), 0.001)
+        JobProgress(
+            id=self.progress_id(), namespace=self.request_namespace,
+            status=status, records=self.records,
+            bytes_read=self.bytes_read(), file_size=self.file_size,
+            seconds=round(self.elapsed(), 3), rows_per_second=int(rate),
+            strict_duplicates=self.strict_duplicates,
+            partial_duplicates=self.partial_duplicates,
+            fuzzy_duplicates=self.fuzzy_duplicates,
+            locality_duplicates=self.locality_duplicates
+        ).put()
+        self.progressed = now
+        self.progress_records = self.records
+
+    def task_name(self, *suffix):
+        """Name of a task of this request, made of the request namespace and
+the given suffix. Task names can't have dots."""
+        name = "-".join([self.request_namespace] + [str(x) for x in suffix])
+        return name.replace(".", "-")
+
+    def requeue(self):
+        """Enqueue a new task to continue from the last checkpoint. The task
+is named after the checkpoint, so it is enqueued only once even if this task
+is retried."""
+        params = dict((k, self.request.get(k))
+                      for k in self.request.arguments())
+        params["checkpoint"] = self.checkpoints
+        name = self.task_name(self.progress_id(), self.checkpoints)
+        if add_task(name, self.request.path, params):
+            logging.info("Task re-enqueued at record %s" % self.records)
+
+    def hand_over(self):
+        """Leave the rest of the file to a new task, resuming from the last
+checkpoint."""
+        self.requeue()
+        namespace_manager.set_namespace(self.previous_namespace)
+        resp = {
+            "status": "checkpoint",
+            "records": self.records
+        }
+        self.response.headers['Content-Type'] = "application/json"
+        self.response.write(json.dumps(resp)+"\n")
 
-        # Initialize variables from request
+    def read_params(self):
+        """Initialize variables from request."""
         self.latlon = self.request.get("latlon", None)
         self.country = self.request.get("country", None)
         self.user_agent = self.request.get("user_agent", None)
@@ -281,6 +453,8 @@ one."""
         self.previous_namespace = self.request.get("previous_namespace", None)
         self.content_type = self.request.get("content_type", None)
         self.delimiter = str(self.request.get("delimiter", None))
+        # Empty for files whose fields are never quoted
+        self.quotechar = str(self.request.get("quotechar", '"'))
         self.extension = self.request.get("extension", None)
         self.action = self.request.get("action", None)
         self.duplicates = self.request.get("duplicates", None)
@@ -288,11 +462,30 @@ one."""
         self.file_name = str(self.request.get("file_name", None))
         self.headers = json.loads(self.request.get("headers", None))
         self.headers_lower = [x.lower() for x in self.headers]
-        self.loc = int(self.request.get("loc", None))
-        self.sci = int(self.request.get("sci", None))
-        self.dat = int(self.request.get("dat", None))
-        self.col = int(self.request.get("col", None))
+        # Missing default fields arrive as "None" through the task queue
+        self.loc = position_param(self.request.get("loc", None))
+        self.sci = position_param(self.request.get("sci", None))
+        self.dat = position_param(self.request.get("dat", None))
+        self.col = position_param(self.request.get("col", None))
+        # Missing "id" fields arrive as "None" through the task queue
         self.id_field = self.request.get("id_field", None)
+        if self.id_field in ["", "None"]:
+            self.id_field = None
+        self.partial_fields = self.request.get("partial_fields", None)
+        if self.partial_fields:
+            self.partial_fields = json.loads(self.partial_fields)
+        else:
+            self.partial_fields = default_partial_fields(
+                [self.loc, self.sci, self.col, self.dat])
+        self.compression = self.request.get("compression", None) or None
+        self.archive_member = self.request.get("archive_member", None)
+        self.archive_size = int(self.request.get("archive_size", None) or 0)
+        self.compress = self.request.get("compress", None) == "true"
+        self.data_offset = int(self.request.get("data_offset", None) or 0)
+        self.performance = self.request.get("performance", None) == "true"
+        self.upload_time = float(self.request.get("upload_time", None) or 0)
+        self.cache_key = self.request.get("cache_key", None) or None
+        self.collection = self.request.get("collection", None) or None
 
         # Switch to request namespace
         namespace_manager.set_namespace(self.request_namespace)
@@ -300,164 +493,256 @@ one."""
 
         # Transform "all" in list of elements for duplicate types
         if self.duplicates == "all":
-            self.duplicates = [x for x in ALLOWED_DUPLICATES if x is not "all"]
-
-        # Store file size for logging
-        self.file_size = gcs.stat(self.file_name).st_size
-        logging.info("File size: %s" % self.file_size)
-
-        # Get file from GCS
+            self.duplicates = ALL_DUPLICATES
+        else:
+            self.duplicates = [self.duplicates]
+
+    def original_size(self):
+        """Size of the original file, for logging. For archives, size of the
+core file once decompressed, as read by the API from the archive."""
+        if self.compression == "zip":
+            return self.archive_size
+        return gcs.stat(self.file_name).st_size
+
+    def open_original(self):
+        """Open the original file in GCS, at the current offset. The file is
+opened and read in large buffers on a background thread (see gcsio.py)."""
+        def opener():
+            f = gcs.open(self.file_name, read_buffer_size=READ_BUFFER_SIZE)
+            if self.compression == "zip":
+                # Core file of a Darwin Core Archive, decompressed from the zip
+                return open_member(f, self.archive_member)
+            if self.compression is None:
+                f.seek(self.offset)
+            return f
+
+        self.file = PrefetchReader(opener,
+                                   decompress=self.compression == "gzip")
+        if self.compression is not None:
+            # Compressed files can't seek, skip decompressed bytes instead
+            if self.offset > self.data_offset:
+                logging.warning("Decompressing %s bytes to resume" %
+                                self.offset)
+            skip = self.offset
+            while skip > 0:
+                data = self.file.read(min(skip, READ_BUFFER_SIZE))
+                if not data:
+                    break
+                skip -= len(data)
+
+    def open_reader(self):
+        """Open the original file, skipping records parsed in previous runs,
+and the record reader over it."""
+        self.open_original()
+        self.open_records(LineReader(self.file, self.offset))
+
+    def close_reader(self):
+        """Stop reading the file, and log the read throughput."""
+        self.file.close()
+        logging.info("Read throughput: %s" % self.file.stats())
+
+        # Time spent waiting for GCS was taken as parsing time
+        self.add_time("read", self.file.wait)
+        self.add_time("parse", -self.file.wait)
+        self.count_rpcs("gcs_read", self.file.reads)
+        self.flush_collection()
+        self.count_store_rpcs()
+
+    def build_report(self):
+        super(DedupeTask, self).build_report()
+        self.report["email"] = self.email
+
+    def store_report(self):
+        """Write the full report to GCS, next to the result file, in JSON
+Lines (see Deduper.write_report)."""
+        report_name = "%s/report.jsonl" % self.file_path
+        f = BufferedWriter(gcs.open(report_name, 'w',
+                                    content_type="application/x-ndjson"))
+        self.write_report(f)
+        f.close()
+        self.count_rpcs("gcs_write", f.blocks)
+        self.report_url = "https://storage.googleapis.com%s" % report_name
+        logging.info("Full report stored in %s" % report_name)
+
+    def cache_result(self):
+        """Store the results in the result cache, with the summary of the
+report but not the details of this request."""
+        report = dict((k, v) for k, v in self.report.iteritems()
+                      if k not in ["email", "file_url", "report_url",
+                                   "performance"])
         try:
-            self.file = gcs.open(self.file_name)
+            store_result(self.cache_key, self.request_namespace, report,
+                         self.file_url, self.report_url)
+            logging.info("Results cached with key %s" % self.cache_key)
         except Exception, e:
-            self._err(500, "Could not open uploaded file", e)
-            return
-        self.reader = csv.reader(self.file, delimiter=self.delimiter)
-
-        # Initialize warnings
-        self.warnings = []
-
-        # Initialize report values
-        self.records = 0
-        self.strict_duplicates = 0
-        self.duplicate_order = set()
-        self.partial_duplicates = 0
-        self.partial_duplicates_order = set()
-
-        # Calculating "id" field position, if exists
-        if self.id_field is not None:
-            self.idx = self.headers_lower.index(self.id_field.lower())
-            logging.info("Using %s as 'id' field" % self.id_field)
-            logging.info("'id' field in position %s" % self.idx)
-            self.duplicate_ids = set()
-            self.partial_duplicate_ids = set()
-
-        # Create response file in GCS
-        if self.action != "report":
-            self.file_name = "/".join(["", BUCKET, self.request_namespace])
-            self.file_name = "%s/modif.%s" % (self.file_path, self.extension)
-
-            # Open file
-            try:
-                self.f = gcs.open(self.file_name, 'w',
-                                  content_type=self.content_type)
-                logging.info("Created GCS file in %s" % self.file_name)
-            except Exception, e:
-                self._err(500, "Could not open result file", e)
+            logging.error("Could not cache the results: %s" % e)
 
-            # Write headers
-            if self.action == "flag":
-                self.headers += ["isDuplicate", "duplicateType", "duplicateOf"]
-            try:
-                self.f.write(str(self.delimiter.join(self.headers)))
-                self.f.write("\n")
-                logging.info("Successfully wrote headers in file")
-            except Exception, e:
-                self._err(500, "Could not write headers in result file", e)
-
-        # Parse records
-        for row in self.reader:
-            self.records += 1
-            self.is_dupe = NO_DUPE
-            self.dupe_ref = None
-
-            # Check for strict duplicates
-            if "strict" in self.duplicates and self.is_dupe == NO_DUPE:
-                self.check_strict_dupes(row)
-
-            # Check for partial duplicates
-            if "partial" in self.duplicates and self.is_dupe == NO_DUPE:
-                self.check_partial_dupes(row)
-
-            ##
-            # TODO: More type of duplicates will be added here
-            ##
+    def log_success(self):
+        """Enqueue the log entry of a successful request."""
+        params = dict(
+            latlon=self.latlon, country=self.country, status="success",
+            user_agent=self.user_agent, warnings=self.warnings, error=None,
+            email=self.email, action=self.action, duplicates=self.duplicates,
+            loc=self.field_name(self.loc), sci=self.field_name(self.sci),
+            dat=self.field_name(self.dat), col=self.field_name(self.col),
+            id_field=self.id_field, namespace=self.request_namespace,
+            collection=self.collection,
+            partial_fields=["%s:%s" % (self.headers[x], n)
+                            for x, n in self.partial_fields],
+            content_type=self.content_type, file_size=self.file_size,
+            records=self.records, fields=len(self.headers),
+            strict_duplicates=self.strict_duplicates, api_version=API_VERSION,
+            partial_duplicates=self.partial_duplicates,
+            fuzzy_duplicates=self.fuzzy_duplicates,
+            locality_duplicates=self.locality_duplicates
+        )
 
-            # Handle row according to check result and action type
-            self.handle_row(row)
+        # Time spent in each stage, throughput and remote calls
+        performance = self.performance_report()
+        params["seconds"] = performance["seconds"]
+        params["rows_per_second"] = performance["rows_per_second"]
+        for stage in STAGES:
+            params["%s_time" % stage] = performance["stages"].get(stage, 0.0)
+        for service in ["memcache", "gcs_read", "gcs_write"]:
+            params["%s_rpcs" % service] = self.rpcs.get(service, 0)
+        taskqueue.add(
+            url='/service/v0/log',
+            payload=json.dumps(params),
+            queue_name=QUEUE_NAME
+        )
+        logging.info("Logging enqueued")
 
+    def finish(self):
+        """Close the result file, build the report, notify the user and log
+the request."""
         # Close file when finished parsing records
+        started = time.time()
+        self.file_url = None
         if self.action != "report":
             try:
-                self.f.close()
+                self.close_part()
+                self.compose_parts()
                 self.file_url = "https://storage.googleapis.com%s" %\
                                 self.file_name
                 logging.info("Successfully created file %s" % self.file_name)
             except Exception, e:
                 self._err(500, "Could not close result file", e)
+            started = self.timed("write", started)
 
-        # TODO: Update report
-        #   - Make concise report for email and longer as attachment
-
-        # Build report skeleton
-        self.report = {
-            "email": self.email,
-            "records": self.records,
-            "fields": len(self.headers),
-        }
-
-        # Add warning info
-        if len(self.warnings) > 0:
-            self.report['warnings'] = self.warnings
-
-        # Build strict_duplicates
-        sd = {
-            "count": self.strict_duplicates
-        }
-
-        if self.strict_duplicates > 0:
-            sd["index_pairs"] = list(self.duplicate_order)
-            if self.id_field is not None:
-                sd["ids"] = list(self.duplicate_ids)
-
-        # Add duplicates to report
-        self.report["strict_duplicates"] = sd
-
-        # Build partial_duplicates
-        pd = {
-            "count": self.partial_duplicates
-        }
-
-        if self.partial_duplicates > 0:
-            pd["index_pairs"] = list(self.partial_duplicates_order)
-            if self.id_field is not None:
-                pd["ids"] = list(self.partial_duplicate_ids)
-
-        # Add partial duplicates to report
-        self.report["partial_duplicates"] = pd
+        # Build the summary, and store the full report
+        self.build_report()
+        try:
+            self.store_report()
+        except Exception, e:
+            self._err(500, "Could not store the report", e)
+            return
+        started = self.timed("report", started)
 
-        # Add file URL to response
+        # Add file and report URLs to response
         if self.action != "report":
             self.report["file_url"] = self.file_url
+        self.report["report_url"] = self.report_url
 
         # Send notification to user
         self.send_email_notification("success")
+        self.timed("notify", started)
+        self.save_progress("done")
 
         # Return to default namespace
         namespace_manager.set_namespace(self.previous_namespace)
 
         # Add entry to log
-        params = dict(
-            latlon=self.latlon, country=self.country, status="success",
-            user_agent=self.user_agent, warnings=self.warnings, error=None,
-            email=self.email, action=self.action, duplicates=self.duplicates,
-            loc=self.headers[self.loc], sci=self.headers[self.sci],
-            dat=self.headers[self.dat], col=self.headers[self.col],
-            id_field=self.id_field, namespace=self.request_namespace,
-            content_type=self.content_type, file_size=self.file_size,
-            records=self.records, fields=len(self.headers),
-            strict_duplicates=self.strict_duplicates, api_version=API_VERSION,
-            partial_duplicates=self.partial_duplicates
-        )
-        taskqueue.add(
-            url='/service/v0/log',
-            payload=json.dumps(params),
-            queue_name=QUEUE_NAME
-        )
-        logging.info("Logging enqueued")
+        self.log_success()
+
+        # Keep the results for identical requests
+        if self.cache_key is not None:
+            self.cache_result()
 
         # Build response
         resp = self.report
         self.response.headers['Content-Type'] = "application/json"
         self.response.write(json.dumps(resp)+"\n")
         return
+
+    def post(self):
+        """Main function. Parse the file for duplicates."""
+
+        # Keep track of time, to stop before reaching the deadline
+        self.started = time.time()
+        self.checkpointed = self.started
+
+        # Initialize variables from request
+        self.read_params()
+
+        # Store file size for logging
+        self.file_size = self.original_size()
+        logging.info("File size: %s" % self.file_size)
+
+        # Initialize warnings, report values and seen-key stores
+        self.init_report()
+        self.add_time("upload", self.upload_time)
+
+        # Resume from the last checkpoint, if any
+        self.offset = self.data_offset
+        self.checkpoints = 0
+        self.checkpoint_name = "%s/checkpoint.%s.json" % (self.file_path,
+                                                           self.progress_id())
+        self.load_checkpoint()
+
+        # A retried task that saved checkpoints before failing: the task
+        # resuming from the last one goes on, enqueued once by its name
+        if self.checkpoints > int(self.request.get("checkpoint", None) or 0):
+            logging.info("Checkpoint %s was saved by a previous run" %
+                         self.checkpoints)
+            self.hand_over()
+            return
+
+        # Get file from GCS, skipping records parsed in previous runs
+        try:
+            self.open_reader()
+        except Exception, e:
+            self._err(500, "Could not open uploaded file", e)
+            return
+        self.progressed = self.started
+        self.progress_records = self.records
+        self.save_progress()
+
+        # Create response file in GCS
+        self.open_output()
+
+        # Parse records, in windows of WINDOW_SIZE records
+        window = []
+        started = time.time()
+        for records, row in self.rows():
+            window.append((records, row))
+            if len(window) == WINDOW_SIZE:
+                self.timed("parse", started)
+                self.parse_window(window)
+                window = []
+
+                # Stop before the deadline, and continue in a new task. The
+                # reader is closed first, to save its stats in the checkpoint
+                if time.time() - self.started > TASK_DEADLINE:
+                    self.close_reader()
+                    self.save_checkpoint()
+                    self.save_progress()
+                    self.hand_over()
+                    return
+
+                # Save progress regularly
+                if time.time() - self.checkpointed > CHECKPOINT_INTERVAL:
+                    self.save_checkpoint()
+                    if self.writes_output():
+                        self.open_part()
+
+                # Show progress regularly
+                if time.time() - self.progressed > PROGRESS_INTERVAL:
+                    self.save_progress()
+                started = time.time()
+        self.timed("parse", started)
+        if len(window) > 0:
+            self.parse_window(window)
+        self.close_reader()
+
+        # Build report, notify user and log request
+        self.finish()
@@ -0,0 +1,73 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Result cache.
+
+The same files are often sent again (nightly re-exports, scripted retries).
+Identical uploads with the same options give the same results, so finished
+jobs store the links to their result file and full report, and the summary of
+the report, keyed by a hash of the upload and the options (see cache_key).
+Later requests with the same key reuse them instead of running the job again.
+
+Result files are deleted by the bucket lifecycle (see sh/lifecycle.json) a day
+after they are written, so entries older than RESULT_CACHE_TTL seconds are
+ignored. Reused files are copied to the folder of the new request, so their
+links last as long as those of a new job. Uploads whose results are reused
+are never stored.
+
+"""
+
+import json
+import hashlib
+from datetime import datetime, timedelta
+
+# The Datastore is only available in App Engine
+try:
+    from models import CachedResult
+except ImportError:
+    CachedResult = None
+
+from config import *
+
+# Request options the results depend on
+CACHE_OPTIONS = ["content_type", "action", "duplicates", "id_field",
+                 "partial_fields", "compress"]
+
+
+def cache_key(digest, options):
+    """Key of the results of an upload, from the hex digest of its body and a
+dictionary with the CACHE_OPTIONS of the request."""
+    values = [digest] + [options.get(x) for x in CACHE_OPTIONS]
+    return hashlib.sha256(json.dumps(values)).hexdigest()
+
+
+def find_result(key):
+    """Return the CachedResult of a key, or None if there is none or its
+files may have been deleted already."""
+    result = CachedResult.get_by_id(key, namespace="")
+    if result is None:
+        return None
+    if datetime.now() - result.created_at > \
+            timedelta(seconds=RESULT_CACHE_TTL):
+        return None
+    return result
+
+
+def store_result(key, request_namespace, report, file_url, report_url):
+    """Store the results of a finished job. report is the summary of the
+report, without the details of the request."""
+    CachedResult(id=key, namespace="", request_namespace=request_namespace,
+                 report=json.dumps(report), file_url=file_url,
+                 report_url=report_url).put()
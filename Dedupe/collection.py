@@ -0,0 +1,123 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Collection indexes.
+
+Duplicates are looked for inside a single upload. Collections published in
+increments can also be checked against all the records sent before, with the
+"collection" parameter: the strict and partial keys of the records of each
+upload are kept in a persistent index in the Datastore, in a namespace of
+their own for each collection, and records of later uploads with the same keys
+are duplicates of the earlier ones.
+
+Each key is stored once, with the upload (request namespace), position and id
+of the first record seen with it. Keys are looked up by name, in batches of
+COLLECTION_BATCH_SIZE keys, and new keys are stored without waiting for the
+result, so checking an upload takes about the same time whatever the size of
+the index. New keys are stored in transactions that skip the keys stored
+meanwhile, so concurrent uploads of a collection never overwrite each other.
+
+"""
+
+# The Datastore is only available in App Engine
+try:
+    from google.appengine.ext import ndb
+    from models import CollectionKey
+except ImportError:
+    ndb = None
+
+from config import *
+
+
+def collection_namespace(collection):
+    """Datastore namespace of the index of a collection."""
+    return "collection.%s" % collection
+
+
+class CollectionIndex(object):
+    """
+Persistent index of the keys of a type of duplicate in a collection.
+
+Instance attributes:
+
+- added: number of keys added to the index so far, once stored
+- algorithm: fingerprint algorithm of the keys (see fingerprint.py)
+- dataset: request namespace of the current upload
+- kind: type of duplicate the keys belong to (strict or partial)
+- namespace: Datastore namespace of the collection
+- pending: futures of the stores not finished yet
+- rpcs: number of remote calls made so far
+"""
+
+    def __init__(self, collection, kind, dataset, algorithm):
+        self.namespace = collection_namespace(collection)
+        self.kind = kind
+        self.dataset = dataset
+        self.algorithm = algorithm
+        self.added = 0
+        self.pending = []
+        self.rpcs = 0
+
+    def _key(self, key):
+        # Keys of different types or algorithms never collide
+        name = "%s:%s:%s" % (self.kind, self.algorithm, key.encode('hex'))
+        return ndb.Key(CollectionKey, name, namespace=self.namespace)
+
+    def check_multi(self, items):
+        """Check a window of (key, records, record_id) items of records new
+to the current upload. Return the list of CollectionKey entities of the
+earlier records seen with each key (None for new keys). New keys are stored
+along with the position and id of the current record."""
+        keys = [self._key(key) for key, records, record_id in items]
+        found = []
+        for i in xrange(0, len(keys), COLLECTION_BATCH_SIZE):
+            found += ndb.get_multi(keys[i:i + COLLECTION_BATCH_SIZE])
+            self.rpcs += 1
+
+        earlier = []
+        new = []
+        for k, (key, records, record_id), entity in zip(keys, items, found):
+            if entity is None:
+                new.append(CollectionKey(key=k, dataset=self.dataset,
+                                         record=records, record_id=record_id))
+            # Key stored by an interrupted run of the same upload, after its
+            # last checkpoint: not counted yet
+            elif entity.dataset == self.dataset:
+                entity = None
+                self.added += 1
+            earlier.append(entity)
+
+        for i in xrange(0, len(new), COLLECTION_TRANSACTION_SIZE):
+            batch = new[i:i + COLLECTION_TRANSACTION_SIZE]
+            self.pending.append(ndb.transaction_async(
+                lambda batch=batch: self._insert(batch), xg=True))
+            self.rpcs += 1
+        return earlier
+
+    def _insert(self, entities):
+        # Keys stored since they were looked up are kept as they are
+        found = ndb.get_multi([x.key for x in entities])
+        new = [x for x, entity in zip(entities, found) if entity is None]
+        ndb.put_multi(new)
+        return len(new)
+
+    def flush(self):
+        """Wait for the pending stores to finish, and count the keys they
+added. Raise the error of the first store that failed, so the task is retried
+and its keys are not lost."""
+        pending = self.pending
+        self.pending = []
+        for future in pending:
+            self.added += future.get_result()
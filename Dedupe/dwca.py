@@ -0,0 +1,147 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Darwin Core Archives.
+
+A Darwin Core Archive (DwC-A) is a zip file with a core data file, optional
+extension files, and a meta.xml file describing them. Only the core file is
+de-duplicated. Its delimiter, quote character, header lines and the term of
+each column are read from meta.xml, and columns are named after the local name
+of their term ("locality" for http://rs.tdwg.org/dwc/terms/locality), so the
+fields for partial duplicates are found as in plain text files. Records are
+read as bytes, split by newlines, so only UTF-8 (or ASCII) core files ending
+lines in "\n" or "\r\n" can be de-duplicated.
+
+The core file is decompressed on the fly as it is read from the zip: neither
+the archive nor the core file are unpacked, in memory or on disk. Zip files
+keep their table of contents at the end, so the archive must be seekable (GCS
+files are).
+
+"""
+
+import zipfile
+from xml.etree import ElementTree
+
+META = "meta.xml"
+
+# Default values of the attributes of the core file in meta.xml
+DEFAULT_DELIMITER = ","
+DEFAULT_QUOTECHAR = '"'
+DEFAULT_LINE_TERMINATOR = "\n"
+DEFAULT_ENCODING = "UTF-8"
+DEFAULT_HEADER_LINES = 0
+
+# Line terminators and encodings (lowercase) of the core files that can be read
+LINE_TERMINATORS = ["\n", "\r\n"]
+ENCODINGS = ["utf-8", "utf8", "ascii", "us-ascii"]
+
+
+def local_name(name):
+    """Name of a tag or term without its namespace."""
+    return name.rsplit("}", 1)[-1].rstrip("/").rsplit("/", 1)[-1]
+
+
+def unescape(value):
+    """Delimiters in meta.xml are written with backslash escapes."""
+    return value.replace("\\t", "\t").replace("\\n", "\n").replace("\\r", "\r")
+
+
+def open_member(f, name):
+    """Open a file of a zip archive for reading, decompressed on the fly. f is
+a seekable file-like object of the archive."""
+    return zipfile.ZipFile(f).open(name)
+
+
+class DarwinCoreArchive(object):
+    """
+Core file of a Darwin Core Archive, as described in its meta.xml. Raise
+ValueError if the archive has no valid description of its core file.
+
+Instance attributes:
+
+- core: name of the core file in the zip
+- delimiter: field delimiter of the core file
+- headers: field names of the core file, by column
+- ignore_header_lines: number of header lines at the start of the core file
+- quotechar: quote character of the core file, or "" if fields are never
+             quoted
+- size: uncompressed size of the core file
+- zip: zipfile.ZipFile object of the archive
+"""
+
+    def __init__(self, f):
+        self.zip = zipfile.ZipFile(f)
+        names = self.zip.namelist()
+
+        # meta.xml is at the root of the archive, or of its only folder
+        metas = sorted([x for x in names if x.split("/")[-1] == META],
+                       key=len)
+        if not metas:
+            raise ValueError("The archive has no %s file" % META)
+        root = ElementTree.fromstring(self.zip.read(metas[0]))
+        core = [x for x in root if local_name(x.tag) == "core"]
+        if not core:
+            raise ValueError("%s does not describe a core file" % META)
+        core = core[0]
+
+        self.delimiter = unescape(core.get("fieldsTerminatedBy",
+                                           DEFAULT_DELIMITER))
+        if len(self.delimiter) != 1:
+            raise ValueError("The delimiter of the core file should be a"
+                             " single character")
+        # Tab-delimited archives usually have no quote character at all
+        self.quotechar = unescape(core.get("fieldsEnclosedBy",
+                                           DEFAULT_QUOTECHAR))
+        if len(self.quotechar) > 1:
+            raise ValueError("The quote character of the core file should be"
+                             " a single character, or none")
+        if unescape(core.get("linesTerminatedBy", DEFAULT_LINE_TERMINATOR)) \
+                not in LINE_TERMINATORS:
+            raise ValueError("Lines of the core file should end in \\n or"
+                             " \\r\\n")
+        if core.get("encoding", DEFAULT_ENCODING).lower() not in ENCODINGS:
+            raise ValueError("The core file should be encoded in UTF-8")
+        self.ignore_header_lines = int(core.get("ignoreHeaderLines",
+                                                DEFAULT_HEADER_LINES))
+
+        # Location of the core file, and term of each column. Columns with no
+        # term but the record id are named "id"
+        location = None
+        columns = {}
+        for element in core.iter():
+            tag = local_name(element.tag)
+            if tag == "location" and location is None:
+                location = (element.text or "").strip()
+            elif tag in ["id", "coreid"] and element.get("index"):
+                columns.setdefault(int(element.get("index")), "id")
+            elif tag == "field" and element.get("index"):
+                columns[int(element.get("index"))] = local_name(
+                    element.get("term", ""))
+        if not location:
+            raise ValueError("%s does not give the location of the core file"
+                             % META)
+        if not columns:
+            raise ValueError("%s does not describe the fields of the core"
+                             " file" % META)
+
+        # Locations are relative to meta.xml
+        self.core = metas[0][:-len(META)] + location
+        self.size = self.zip.getinfo(self.core).file_size
+        self.headers = [columns.get(i, "column%s" % i)
+                        for i in range(max(columns) + 1)]
+
+    def open(self):
+        """Open the core file for reading, decompressed on the fly."""
+        return self.zip.open(self.core)
@@ -0,0 +1,787 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""De-duplication engine.
+
+Deduper holds the duplicate detection logic: it reads records from a line
+reader, checks them in windows of WINDOW_SIZE records, writes the result rows
+to a csv-writer and builds the report. It doesn't depend on App Engine, so it
+runs anywhere: the task handlers (see DedupeTask.py) feed it files in GCS, and
+dedupe() feeds it local files (see dedupe_cli.py).
+
+"""
+
+import csv
+import json
+import time
+import logging
+
+from config import *
+from collection import CollectionIndex
+from stores import get_store
+from fingerprint import Fingerprinter, SEPARATOR
+from fuzzy import FuzzyIndex
+from locality import LocalityIndex
+from normalize import compile_key
+from pairs import DuplicatePairs
+from records import LineReader, RecordReader, ProjectingReader, csv_options
+
+# Options of dedupe(), with their default values
+DEFAULT_OPTIONS = {
+    "action": "report",
+    "duplicates": "all",
+    "delimiter": ",",
+    "id_field": None,
+    "partial_fields": None,
+    "performance": False,
+    "quotechar": '"'
+}
+
+# Stages of a de-duplication job, timed separately. Records are read and
+# parsed in the "read" and "parse" stages, checked for each type of duplicate
+# in the stage of the same name, and written in the "write" stage
+STAGES = ["upload", "read", "parse", "strict", "partial", "fuzzy", "locality",
+          "write", "checkpoint", "report", "notify"]
+
+
+def find_id_field(headers):
+    """Return the name of the "id" field of a file ("id" or "occurrenceID"),
+or None if there is none."""
+    headers_lower = [x.lower() for x in headers]
+    for name in ["id", "occurrenceid"]:
+        if name in headers_lower:
+            return headers[headers_lower.index(name)]
+    return None
+
+
+def parse_partial_fields(spec, headers):
+    """Turn a list of field:normalizer items, separated by commas, into a list
+of (position, normalizer) pairs. Raise ValueError if a field or normalizer is
+not valid."""
+    headers_lower = [x.lower() for x in headers]
+    fields = []
+    for item in spec.split(","):
+        field, _, normalizer = item.strip().partition(":")
+        normalizer = normalizer or "exact"
+        if field.lower() not in headers_lower:
+            raise ValueError("Couldn't find field '%s'" % field)
+        if normalizer not in ALLOWED_NORMALIZERS:
+            raise ValueError("Normalizer %s is not valid. Should be one of:"
+                             " %s" % (normalizer,
+                                      ", ".join(ALLOWED_NORMALIZERS)))
+        fields.append([headers_lower.index(field.lower()), normalizer])
+    return fields
+
+
+def find_default_fields(headers):
+    """Return the positions of the LOC, SCI, COL and DAT fields of a file, with
+None for the fields it doesn't have."""
+    headers_lower = [x.lower() for x in headers]
+    return [headers_lower.index(x.lower()) if x.lower() in headers_lower
+            else None for x in (LOC, SCI, COL, DAT)]
+
+
+def needs_default_fields(duplicates, partial_fields):
+    """Whether the LOC, SCI, COL and DAT fields are needed to find the given
+types of duplicates. Fuzzy and locality duplicates always use them, partial
+duplicates only if no other partial_fields are given."""
+    if "fuzzy" in duplicates or "locality" in duplicates:
+        return True
+    return "partial" in duplicates and not partial_fields
+
+
+def default_partial_fields(positions):
+    """Key fields of partial duplicates when none are given: the LOC, SCI, COL
+and DAT fields, if the file has them all. Empty otherwise, as partial
+duplicates are not checked then."""
+    if None in positions:
+        return []
+    return [[x, "exact"] for x in positions]
+
+
+class Deduper(object):
+    """
+Instance attributes:
+
+- action: Type of action to perform on the file
+- col: position of the "recordedBy" field in the file, or None
+- collection: id of the collection to check records against, or None
+- dat: position of the "eventDate" field in the file, or None
+- delimiter: field delimiter
+- detailed_report: whether the report lists the clusters of duplicates
+- dupe_ref: position of the original record (for flagging)
+- duplicate_order: original-duplicate pairs of records and ids, for strict
+                   duplicates
+- duplicates: List with types of duplicates to find (strict, partial...)
+- earlier_duplicates: [type, records, id, upload, position, id] of duplicates
+                      of records of earlier uploads of the collection
+- file_name: name of the result file, for warnings
+- fuzzy_duplicates: number of fuzzy duplicates found
+- fuzzy_duplicates_order: original-duplicate pairs of records, ids and
+                          similarity scores, for fuzzy duplicates
+- fuzzy_index: blocks of records already parsed, for fuzzy duplicates
+- headers: field names of the file
+- headers_lower: lowercase version of self.headers
+- id_field: field used as "id" for the record
+- idx: position of the id_field
+- is_dupe: keep track of whether the current record is not a duplicate (0),
+           is a strict duplicate (1), a partial duplicate (2), a fuzzy
+           duplicate (3) or a locality duplicate (4)
+- lines: line-reader object, to keep track of the position in the file
+- loc: position of the "locality" field in the file, or None
+- locality_duplicates: number of locality duplicates found
+- locality_duplicates_order: original-duplicate pairs of records, ids and
+                             similarity scores, for locality duplicates
+- locality_index: MinHash signatures and LSH buckets of records already
+                  parsed, for locality duplicates
+- partial_duplicates: number of partial duplicates found
+- partial_duplicates_order: original-duplicate pairs of records and ids, for
+                            partial duplicates
+- partial_extractor: function returning the normalized key fields of a row,
+                     for partial duplicates
+- partial_fields: (position, normalizer) pairs of the partial duplicate key
+                  fields
+- partial_fingerprint: fingerprint builder for partial duplicate keys
+- partial_index: persistent index of the partial keys of the collection
+- partial_store: seen-key store for partial duplicate keys
+- performance: whether to add stage times and remote calls to the report
+- quotechar: quote character of the file, or "" if fields are never quoted
+- raw: whether raw records are parsed instead of lists of fields
+- reader: record-reader object
+- records: number of records processed, also position indicator
+- report: final report to be delivered to the user
+- request_namespace: namespace of the seen-key stores
+- rpcs: number of remote calls made, by service
+- sci: position of the "scientificName" field in the file, or None
+- seen_key_store: backend of the seen-key stores
+- started: time at which the current run started
+- strict_duplicates: number of strict duplicates found
+- strict_fingerprint: fingerprint builder for strict duplicate keys
+- strict_index: persistent index of the strict keys of the collection
+- strict_store: seen-key store for strict duplicate keys
+- timings: seconds spent in each stage (see STAGES), and in previous runs
+- track_added: whether the seen-key stores and indexes keep what was added
+               since their last dump, for checkpoints
+           ("total")
+- warnings: list conaining all warnings generated during the process
+- writer: csv-writer object for the result file
+"""
+
+    seen_key_store = SEEN_KEY_STORE
+    detailed_report = True
+    track_added = False
+
+    def fields(self, row):
+        """Return the fields of a record, indexed by position. Records without
+quoted fields come as raw strings when parsing raw records, and records come as
+dictionaries of the fields needed when projecting them."""
+        if isinstance(row, str):
+            return row.split(self.delimiter)
+        return row
+
+    def record_id(self, row):
+        """Value of the "id" field of a record, or None if there is none."""
+        if self.id_field is None:
+            return None
+        return self.fields(row)[self.idx]
+
+    def field_name(self, position):
+        """Name of the field in a position, or None if there is none."""
+        if position is None:
+            return None
+        return self.headers[position]
+
+    def strict_key(self, row):
+        """Build the fixed-width key of a record for strict duplicates."""
+        if isinstance(row, list):
+            return self.strict_fingerprint(row)
+        # Raw record with no quoted fields: only separators need a change
+        return self.strict_fingerprint.data(row.replace(self.delimiter,
+                                                        SEPARATOR))
+
+    def partial_key(self, row):
+        """Build the fixed-width key of a record for partial duplicates."""
+        return self.partial_fingerprint(self.partial_extractor(row))
+
+    def check_strict_dupes(self, window, status):
+        """Check which records of the window are strict duplicates of previous
+ones. Update the status of the window records accordingly."""
+        # Only check records not already flagged as duplicates
+        pending = [i for i, x in enumerate(status) if x[0] == NO_DUPE]
+        # Calculate fingerprints
+        keys = [(self.strict_key(window[i][1]), window[i][0])
+                for i in pending]
+        # Check if hashes were already seen, all window at once
+        dupes = self.strict_store.check_multi(keys)
+        for i, dupe in zip(pending, dupes):
+            # If exists, STRICT_DUPE
+            if dupe is not None:
+                records, row = window[i]
+                status[i] = (STRICT_DUPE, dupe)
+                self.strict_duplicates += 1
+                self.duplicate_order.add((dupe, records),
+                                         self.record_id(row))
+
+        # Records new to the file may be in earlier uploads of the collection
+        if self.collection is not None:
+            new = [(i, key) for i, (key, records), dupe in
+                   zip(pending, keys, dupes) if dupe is None]
+            self.check_earlier_dupes(self.strict_index, STRICT_DUPE, window,
+                                     status, new)
+
+    def check_partial_dupes(self, window, status):
+        """Check which records of the window are partial duplicates of
+previous ones. Update the status of the window records accordingly."""
+        # Only check records not already flagged as duplicates
+        pending = [i for i, x in enumerate(status) if x[0] == NO_DUPE]
+        # Build id strings
+        keys = [(self.partial_key(window[i][1]), window[i][0])
+                for i in pending]
+        # Check if keys were already seen, all window at once
+        pdupes = self.partial_store.check_multi(keys)
+        for i, pdupe in zip(pending, pdupes):
+            # If exists, PARTIAL_DUPE
+            if pdupe is not None:
+                records, row = window[i]
+                status[i] = (PARTIAL_DUPE, pdupe)
+                self.partial_duplicates += 1
+                self.partial_duplicates_order.add((pdupe, records),
+                                                  self.record_id(row))
+
+        # Records new to the file may be in earlier uploads of the collection
+        if self.collection is not None:
+            new = [(i, key) for i, (key, records), pdupe in
+                   zip(pending, keys, pdupes) if pdupe is None]
+            self.check_earlier_dupes(self.partial_index, PARTIAL_DUPE, window,
+                                     status, new)
+
+    def check_earlier_dupes(self, index, is_dupe, window, status, new):
+        """Check which records new to the file, given as (position in the
+window, key) items, were seen in earlier uploads of the collection. Update the
+status of the window records accordingly."""
+        items = [(key, window[i][0], self.record_id(window[i][1]))
+                 for i, key in new]
+        earlier = index.check_multi(items)
+        for (i, key), original in zip(new, earlier):
+            if original is not None:
+                records, row = window[i]
+                # Flagged with the id of the earlier record if there is one,
+                # otherwise with its upload and position
+                ref = original.record_id or "%s:%s" % (original.dataset,
+                                                       original.record)
+                status[i] = (is_dupe, ref)
+                self.earlier_duplicates.append(
+                    [index.kind, records, self.record_id(row),
+                     original.dataset, original.record, original.record_id])
+
+    def check_fuzzy_dupes(self, window, status):
+        """Check which records of the window are fuzzy duplicates of previous
+ones. Update the status of the window records accordingly."""
+        for i, (records, row) in enumerate(window):
+            # Only check records not already flagged as duplicates
+            if status[i][0] != NO_DUPE:
+                continue
+            fdupe = self.fuzzy_index.check(row[self.loc], row[self.sci],
+                                           row[self.col], row[self.dat],
+                                           records)
+            # If similar enough, FUZZY_DUPE
+            if fdupe is not None:
+                ref, score = fdupe
+                status[i] = (FUZZY_DUPE, ref)
+                self.fuzzy_duplicates += 1
+                self.fuzzy_duplicates_order.add((ref, records, score),
+                                                self.record_id(row))
+
+    def check_locality_dupes(self, window, status):
+        """Check which records of the window are locality duplicates of
+previous ones. Update the status of the window records accordingly."""
+        for i, (records, row) in enumerate(window):
+            # Only check records not already flagged as duplicates
+            if status[i][0] != NO_DUPE:
+                continue
+            ldupe = self.locality_index.check(row[self.loc], row[self.sci],
+                                              row[self.dat], records)
+            # If similar enough, LOCALITY_DUPE
+            if ldupe is not None:
+                ref, score = ldupe
+                status[i] = (LOCALITY_DUPE, ref)
+                self.locality_duplicates += 1
+                self.locality_duplicates_order.add((ref, records, score),
+                                                   self.record_id(row))
+
+        # Warn once, also across checkpoints, when the index stops growing
+        if self.locality_index.is_full():
+            warning = ("Only the first %d records checked for locality "
+                       "duplicates were kept to be compared with later ones" %
+                       self.locality_index.max_records)
+            if warning not in self.warnings:
+                logging.warning(warning)
+                self.warnings.append(warning)
+
+    def parse_window(self, window):
+        """Check a window of (records, row) items for duplicates and handle
+each row according to the result."""
+        # (is_dupe, dupe_ref) for each record in the window
+        status = [(NO_DUPE, None)] * len(window)
+        started = time.time()
+
+        # Check for strict duplicates
+        if "strict" in self.duplicates:
+            self.check_strict_dupes(window, status)
+            started = self.timed("strict", started)
+
+        # Check for partial duplicates
+        if "partial" in self.duplicates:
+            self.check_partial_dupes(window, status)
+            started = self.timed("partial", started)
+
+        # Check for fuzzy duplicates
+        if "fuzzy" in self.duplicates:
+            self.check_fuzzy_dupes(window, status)
+            started = self.timed("fuzzy", started)
+
+        # Check for locality duplicates
+        if "locality" in self.duplicates:
+            self.check_locality_dupes(window, status)
+            started = self.timed("locality", started)
+
+        ##
+        # TODO: More type of duplicates will be added here
+        ##
+
+        # Handle rows according to check result and action type
+        for (records, row), (self.is_dupe, self.dupe_ref) in zip(window,
+                                                                 status):
+            self.handle_row(row, records)
+        self.timed("write", started)
+
+    def handle_row(self, row, records):
+        """Handle row according to check result and action type:
+- No duplicate and action is remove or flag: write row
+- Duplicate and action is remove: skip writing row
+- Duplicate and action is flag: update record and write row
+"""
+
+        # If action is remove and is duplicate, or action is report, omit write
+        if (self.action == "remove" and self.is_dupe != NO_DUPE) \
+                or self.action == "report":
+            pass
+
+        # Otherwise, write row
+        else:
+            # If action is flag, add three flag fields to row
+            if self.action == "flag":
+                row.extend((bool(self.is_dupe),
+                            self.is_dupe if self.is_dupe > 0 else None,
+                            self.dupe_ref))
+
+            # The writer builds the whole line before a single write
+            try:
+                self.writer.writerow(row)
+            except Exception, e:
+                logging.warning("Something went wrong writing a row\n"
+                                "f: %s\nrow: %s\nerror: %s" %
+                                (self.file_name, row, e))
+                self.warnings.append("Could not write record %s in new file" %
+                                     records)
+
+    def add_time(self, stage, seconds):
+        """Add seconds to the time spent in a stage."""
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def timed(self, stage, started):
+        """Add the time since started to a stage. Return the current time, to
+time the next stage from."""
+        now = time.time()
+        self.add_time(stage, now - started)
+        return now
+
+    def count_rpcs(self, service, calls):
+        """Add to the number of remote calls made to a service."""
+        if calls:
+            self.rpcs[service] = self.rpcs.get(service, 0) + calls
+
+    def count_store_rpcs(self):
+        """Add up the remote calls made by the seen-key stores and collection
+indexes so far."""
+        for store in [self.strict_store, self.partial_store]:
+            self.count_rpcs(self.seen_key_store, store.rpcs)
+            store.rpcs = 0
+        if self.collection is not None:
+            for index in [self.strict_index, self.partial_index]:
+                self.count_rpcs("datastore", index.rpcs)
+                index.rpcs = 0
+
+    def flush_collection(self):
+        """Wait for the keys added to the collection indexes to be stored."""
+        if self.collection is not None:
+            self.strict_index.flush()
+            self.partial_index.flush()
+
+    def elapsed(self):
+        """Seconds spent so far, in this and previous runs."""
+        return self.timings.get("total", 0.0) + time.time() - self.started
+
+    def performance_report(self):
+        """Time spent in each stage, throughput and remote calls."""
+        elapsed = self.elapsed()
+        return {
+            "seconds": round(elapsed, 3),
+            "rows_per_second": int(self.records / elapsed) if elapsed else 0,
+            "stages": dict((k, round(v, 3)) for k, v in
+                           self.timings.iteritems() if k != "total"),
+            "rpcs": self.rpcs
+        }
+
+    def state(self):
+        """Gather counters, duplicate pairs and ids in a JSON-friendly
+dictionary."""
+        state = {
+            "records": self.records,
+            "warnings": self.warnings,
+            "strict_duplicates": self.strict_duplicates,
+            "duplicate_order": self.duplicate_order.dump(),
+            "partial_duplicates": self.partial_duplicates,
+            "partial_duplicates_order": self.partial_duplicates_order.dump(),
+            "fuzzy_duplicates": self.fuzzy_duplicates,
+            "fuzzy_duplicates_order": self.fuzzy_duplicates_order.dump(),
+            "locality_duplicates": self.locality_duplicates,
+            "locality_duplicates_order":
+                self.locality_duplicates_order.dump(),
+            "timings": dict(self.timings, total=self.elapsed()),
+            "rpcs": self.rpcs
+        }
+        if self.collection is not None:
+            state["earlier_duplicates"] = self.earlier_duplicates
+            state["collection_keys"] = [self.strict_index.added,
+                                        self.partial_index.added]
+        return state
+
+    def load_state(self, state):
+        """Restore counters, duplicate pairs and ids from a dictionary built
+by state()."""
+        self.records = state["records"]
+        self.warnings = state["warnings"]
+        self.strict_duplicates = state["strict_duplicates"]
+        self.duplicate_order = DuplicatePairs.load(state["duplicate_order"])
+        self.partial_duplicates = state["partial_duplicates"]
+        self.partial_duplicates_order = DuplicatePairs.load(
+            state["partial_duplicates_order"])
+        self.fuzzy_duplicates = state["fuzzy_duplicates"]
+        self.fuzzy_duplicates_order = DuplicatePairs.load(
+            state["fuzzy_duplicates_order"])
+        self.locality_duplicates = state["locality_duplicates"]
+        self.locality_duplicates_order = DuplicatePairs.load(
+            state["locality_duplicates_order"])
+        # Checkpoints saved before stages were timed have no timings
+        self.timings = state.get("timings", {})
+        self.rpcs = state.get("rpcs", {})
+        if self.collection is not None:
+            self.earlier_duplicates = state["earlier_duplicates"]
+            self.strict_index.added, self.partial_index.added = \
+                state["collection_keys"]
+
+    def stores(self):
+        """Seen-key stores and indexes to keep across runs of the task."""
+        stores = [self.strict_store, self.partial_store]
+        if "fuzzy" in self.duplicates:
+            stores.append(self.fuzzy_index)
+        if "locality" in self.duplicates:
+            stores.append(self.locality_index)
+        # Records kept to rule out fingerprint collisions
+        if self.strict_fingerprint.verify:
+            stores += [self.strict_fingerprint, self.partial_fingerprint]
+        return stores
+
+    def init_report(self):
+        """Initialize warnings, report values and seen-key stores."""
+        # Initialize warnings
+        self.warnings = []
+
+        # Initialize report values
+        self.records = 0
+        self.strict_duplicates = 0
+        self.duplicate_order = DuplicatePairs()
+        self.partial_duplicates = 0
+        self.partial_duplicates_order = DuplicatePairs()
+        self.fuzzy_duplicates = 0
+        self.fuzzy_duplicates_order = DuplicatePairs(scored=True)
+        self.locality_duplicates = 0
+        self.locality_duplicates_order = DuplicatePairs(scored=True)
+        self.earlier_duplicates = []
+        self.timings = {}
+        self.rpcs = {}
+
+        # Initialize seen-key stores
+        self.strict_store = get_store("strict", self.request_namespace,
+                                      self.seen_key_store, self.track_added)
+        self.partial_store = get_store("partial", self.request_namespace,
+                                       self.seen_key_store, self.track_added)
+        logging.info("Using %s seen-key store" % self.seen_key_store)
+        self.fuzzy_index = FuzzyIndex(track_added=self.track_added)
+        self.locality_index = LocalityIndex(track_added=self.track_added)
+
+        # Initialize record fingerprints
+        self.strict_fingerprint = Fingerprinter(kind="exact.strict",
+                                                track_added=self.track_added)
+        self.partial_fingerprint = Fingerprinter(kind="exact.partial",
+                                                 track_added=self.track_added)
+        self.partial_extractor = compile_key(self.partial_fields)
+        logging.info("Using %s fingerprints" %
+                     self.strict_fingerprint.algorithm)
+
+        # Initialize persistent indexes of the collection, if any
+        if self.collection is not None:
+            algorithm = self.strict_fingerprint.algorithm
+            self.strict_index = CollectionIndex(
+                self.collection, "strict", self.request_namespace, algorithm)
+            self.partial_index = CollectionIndex(
+                self.collection, "partial", self.request_namespace, algorithm)
+            logging.info("Checking against collection %s" % self.collection)
+
+        # Calculating "id" field position, if exists
+        if self.id_field is not None:
+            self.idx = self.headers_lower.index(self.id_field.lower())
+            logging.info("Using %s as 'id' field" % self.id_field)
+            logging.info("'id' field in position %s" % self.idx)
+
+    def raw_records(self):
+        """Whether raw records can be parsed instead of lists of fields.
+Strict-only reports don't need the fields of the records."""
+        return RAW_RECORDS and self.action == "report" and \
+            self.duplicates == ["strict"]
+
+    def projected_columns(self):
+        """Positions of the only fields needed from each record, or None if
+all fields are needed. Partial-only reports only need the fields of the
+partial keys and the "id" field."""
+        if not PROJECT_RECORDS or self.action != "report" or \
+                self.duplicates != ["partial"]:
+            return None
+        columns = [position for position, name in self.partial_fields]
+        if self.id_field is not None:
+            columns.append(self.idx)
+        return columns
+
+    def open_records(self, lines):
+        """Start reading records from a line-reader object."""
+        self.lines = lines
+        self.raw = self.raw_records()
+        columns = self.projected_columns()
+        if self.raw:
+            self.reader = RecordReader(lines, self.delimiter, self.quotechar)
+            logging.info("Parsing raw records")
+        elif columns is not None:
+            self.reader = ProjectingReader(lines, self.delimiter, columns,
+                                           self.quotechar)
+            logging.info("Parsing fields %s of each record" %
+                         self.reader.columns)
+        else:
+            self.reader = csv.reader(lines, **csv_options(self.delimiter,
+                                                          self.quotechar))
+
+    def reader_offset(self):
+        """Position in the file of the first record not parsed yet."""
+        return self.lines.tell()
+
+    def rows(self):
+        """Iterate over the (records, row) items of the file."""
+        for row in self.reader:
+            self.records += 1
+            yield self.records, row
+
+    def pairs(self):
+        """Return the (type, pairs) items of the types of duplicate in the
+report. Fuzzy and locality duplicates are only included if requested."""
+        items = [("strict_duplicates", self.duplicate_order),
+                 ("partial_duplicates", self.partial_duplicates_order)]
+        if "fuzzy" in self.duplicates:
+            items.append(("fuzzy_duplicates", self.fuzzy_duplicates_order))
+        if "locality" in self.duplicates:
+            items.append(("locality_duplicates",
+                          self.locality_duplicates_order))
+        return items
+
+    def earlier_records(self):
+        """Iterate over the duplicates of records of earlier uploads of the
+collection, as dictionaries."""
+        for kind, records, record_id, dataset, original, original_id in \
+                self.earlier_duplicates:
+            yield {
+                "kind": kind,
+                "duplicate": records,
+                "id": record_id,
+                "dataset": dataset,
+                "original": original,
+                "original_id": original_id
+            }
+
+    def summary(self):
+        """Build a short report, with the counters of each type of duplicate
+but not the duplicates themselves."""
+        summary = {
+            "records": self.records,
+            "fields": len(self.headers),
+        }
+
+        # Add warning info
+        if len(self.warnings) > 0:
+            summary['warnings'] = self.warnings
+
+        # Number of duplicates, and of records they are duplicates of
+        for kind, pairs in self.pairs():
+            summary[kind] = {
+                "count": getattr(self, kind),
+                "originals": pairs.count_originals()
+            }
+
+        # Duplicates of records of earlier uploads, and keys added
+        if self.collection is not None:
+            kinds = [x[0] for x in self.earlier_duplicates]
+            summary["collection"] = {
+                "id": self.collection,
+                "strict_duplicates": kinds.count("strict"),
+                "partial_duplicates": kinds.count("partial"),
+                "new_keys": self.strict_index.added + self.partial_index.added
+            }
+
+        # Add stage times and remote calls, only if requested
+        if self.performance:
+            summary["performance"] = self.performance_report()
+        return summary
+
+    def build_report(self):
+        """Build the report from counters and, if detailed_report, the
+clusters of duplicates of each type."""
+        self.report = self.summary()
+        if self.detailed_report:
+            for kind, pairs in self.pairs():
+                if len(pairs) > 0:
+                    self.report[kind]["clusters"] = list(pairs.clusters())
+            if self.collection is not None:
+                self.report["collection"]["duplicates"] = list(
+                    self.earlier_records())
+
+    def write_report(self, f):
+        """Write the full report to a file-like object in JSON Lines: the
+summary first, then one line per cluster of duplicates, with its type, and
+one per duplicate of a record of an earlier upload of the collection."""
+        f.write(json.dumps(self.summary()) + "\n")
+        for kind, pairs in self.pairs():
+            for cluster in pairs.clusters():
+                cluster["type"] = kind
+                f.write(json.dumps(cluster) + "\n")
+        for duplicate in self.earlier_records():
+            duplicate["type"] = "earlier_duplicates"
+            f.write(json.dumps(duplicate) + "\n")
+
+    def configure(self, headers, options, output=None):
+        """Set up a local run from the header line of the file and a
+dictionary of options (see DEFAULT_OPTIONS). Raise ValueError for wrong
+options."""
+        opts = dict(DEFAULT_OPTIONS)
+        opts.update(options or {})
+
+        self.started = time.time()
+        self.seen_key_store = "memory"
+        self.request_namespace = None
+        self.collection = None
+        self.file_name = getattr(output, "name", None)
+        self.performance = opts["performance"]
+
+        self.action = opts["action"]
+        if self.action not in ALLOWED_ACTIONS:
+            raise ValueError("Action %s is not valid. Should be one of: %s" %
+                             (self.action, ", ".join(ALLOWED_ACTIONS)))
+        if opts["duplicates"] not in ALLOWED_DUPLICATES:
+            raise ValueError("Duplicate type %s is not valid. Should be one"
+                             " of: %s" % (opts["duplicates"],
+                                          ", ".join(ALLOWED_DUPLICATES)))
+        if opts["duplicates"] == "all":
+            self.duplicates = ALL_DUPLICATES
+        else:
+            self.duplicates = [opts["duplicates"]]
+
+        # Find the fields for partial duplicates
+        self.delimiter = opts["delimiter"]
+        self.quotechar = opts["quotechar"]
+        self.headers = headers
+        self.headers_lower = [x.lower() for x in headers]
+        positions = find_default_fields(headers)
+        self.loc, self.sci, self.col, self.dat = positions
+        if None in positions and \
+                needs_default_fields(self.duplicates, opts["partial_fields"]):
+            raise ValueError("The file should have %s, %s, %s and %s fields" %
+                             (LOC, SCI, COL, DAT))
+        if opts["partial_fields"]:
+            self.partial_fields = parse_partial_fields(opts["partial_fields"],
+                                                       headers)
+        else:
+            self.partial_fields = default_partial_fields(positions)
+        self.id_field = opts["id_field"] or find_id_field(headers)
+        if self.id_field is not None and \
+                self.id_field.lower() not in self.headers_lower:
+            raise ValueError("Couldn't find field '%s'" % self.id_field)
+
+    def start_output(self, output):
+        """Write the header line of the result file, if any, and set up the
+csv-writer for the result rows."""
+        if self.action == "report":
+            return
+        if self.action == "flag":
+            self.headers += ["isDuplicate", "duplicateType", "duplicateOf"]
+        output.write(self.delimiter.join(self.headers))
+        output.write("\n")
+        self.writer = csv.writer(output, delimiter=self.delimiter)
+
+    def run(self):
+        """Parse all the records, in windows of WINDOW_SIZE records."""
+        window = []
+        started = time.time()
+        for records, row in self.rows():
+            window.append((records, row))
+            if len(window) == WINDOW_SIZE:
+                self.timed("parse", started)
+                self.parse_window(window)
+                window = []
+                started = time.time()
+        self.timed("parse", started)
+        if len(window) > 0:
+            self.parse_window(window)
+        self.count_store_rpcs()
+
+
+def read_headers(lines, options=None):
+    """Read the header line of a file from a line-reader object."""
+    opts = dict(DEFAULT_OPTIONS)
+    opts.update(options or {})
+    return csv.reader(lines, **csv_options(opts["delimiter"],
+                                           opts["quotechar"])).next()
+
+
+def dedupe(input, output=None, options=None):
+    """Look for duplicates in a delimited file. input is a file-like object
+with the records, header line first. The result file is written to output, a
+file-like object (not needed for reports). options can override any of the
+DEFAULT_OPTIONS. Return the report. Raise ValueError for wrong options."""
+    engine = Deduper()
+    lines = LineReader(input)
+    engine.configure(read_headers(lines, options), options, output)
+    engine.init_report()
+    engine.open_records(lines)
+    engine.start_output(output)
+    engine.run()
+    engine.build_report()
+    return engine.report
@@ -0,0 +1,251 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+"""External-memory de-duplication of local files.
+
+The seen-key stores keep a key per distinct record, so their memory grows with
+the size of the file. ExternalDeduper finds the same strict and partial
+duplicates with bounded memory, sorting keys on disk instead:
+
+- first pass: the (key, record) entries of each duplicate type are sorted in
+  runs of up to EXTERNAL_RUN_SIZE entries, each written to a temporary file.
+- merge: the runs are merged, so that entries with the same key come together,
+  the first record being the original. The (record, original) pairs of the
+  rest are sorted again, in file order.
+- second pass: the records are read again, along with their duplicate status,
+  to write the result rows and gather the ids of duplicates. Reports without
+  ids don't need it.
+
+A strict duplicate has the same partial key as its original, which comes
+before. So the first record of each partial key is never a strict duplicate,
+and the partial duplicates of a serial run are the records with an earlier
+partial key that aren't strict duplicates.
+
+"""
+
+import csv
+import heapq
+import struct
+import logging
+import tempfile
+
+from config import *
+from engine import Deduper, read_headers
+from fingerprint import Fingerprinter
+from records import LineReader, csv_options
+
+# Big-endian record numbers sort like their binary strings
+RECORD = struct.Struct(">Q")
+
+
+def read_run(f, width):
+    """Iterate over the fixed-width entries of a run file."""
+    while True:
+        block = f.read(width * 4096)
+        if not block:
+            return
+        for i in xrange(0, len(block), width):
+            yield block[i:i + width]
+
+
+class ExternalSort(object):
+    """
+Sort (key, record) items with fixed-width binary keys, in runs written to
+temporary files every run_size items.
+
+Instance attributes:
+
+- entries: binary entries of the current run
+- run_size: maximum number of entries kept in memory
+- runs: temporary files with the sorted runs
+- tmpdir: directory of the temporary files (system default if None)
+- width: size of the entries
+"""
+
+    def __init__(self, run_size=EXTERNAL_RUN_SIZE, tmpdir=None):
+        self.entries = []
+        self.run_size = run_size
+        self.runs = []
+        self.tmpdir = tmpdir
+        self.width = None
+
+    def add(self, key, records):
+        """Add a key and its record number."""
+        entry = key + RECORD.pack(records)
+        self.width = len(entry)
+        self.entries.append(entry)
+        if len(self.entries) >= self.run_size:
+            self.flush()
+
+    def flush(self):
+        """Write the entries in memory to a new sorted run."""
+        if not self.entries:
+            return
+        self.entries.sort()
+        f = tempfile.TemporaryFile(dir=self.tmpdir)
+        f.write("".join(self.entries))
+        f.seek(0)
+        self.runs.append(f)
+        self.entries = []
+
+    def items(self):
+        """Iterate over the (key, record) items, sorted by key and record.
+The temporary files are removed at the end."""
+        self.flush()
+        if len(self.runs) > 1:
+            logging.info("Merging %s sorted runs" % len(self.runs))
+        try:
+            runs = [read_run(f, self.width) for f in self.runs]
+            for entry in heapq.merge(*runs):
+                yield (entry[:-RECORD.size],
+                       RECORD.unpack(entry[-RECORD.size:])[0])
+        finally:
+            self.close()
+
+    def duplicates(self):
+        """Iterate over the (original, record) pairs of records with a key
+already seen, the original being the first record with the same key."""
+        last = None
+        for key, records in self.items():
+            if key == last:
+                yield original, records
+            else:
+                last, original = key, records
+
+    def close(self):
+        """Remove the temporary files."""
+        for f in self.runs:
+            f.close()
+        self.runs = []
+
+
+def by_record(pairs, run_size, tmpdir=None):
+    """Sort (original, record) pairs by record. Return an iterator over the
+(record, original) pairs."""
+    ordered = ExternalSort(run_size, tmpdir)
+    for original, records in pairs:
+        ordered.add(RECORD.pack(records), original)
+    return ((RECORD.unpack(key)[0], original)
+            for key, original in ordered.items())
+
+
+class ExternalDeduper(Deduper):
+    """
+Deduper with sorted keys on disk instead of seen-key stores, for strict and
+partial duplicates.
+
+Instance attributes (besides those of Deduper):
+
+- run_size: maximum number of entries kept in memory per sort
+- sorts: ExternalSort of the keys of each type of duplicate
+- tmpdir: directory of the temporary files (system default if None)
+"""
+
+    def init_sorts(self, run_size, tmpdir=None):
+        """Set up the sorts of keys. Fingerprints are not verified: it would
+keep a copy of every record in memory."""
+        self.run_size = run_size
+        self.tmpdir = tmpdir
+        self.sorts = dict((x, ExternalSort(run_size, tmpdir))
+                          for x in self.duplicates)
+        self.strict_fingerprint = Fingerprinter(verify=False)
+        self.partial_fingerprint = Fingerprinter(verify=False)
+
+    def sort_keys(self):
+        """First pass: add the keys of every record to the sorts."""
+        for records, row in self.rows():
+            if "strict" in self.sorts:
+                self.sorts["strict"].add(self.strict_key(row), records)
+            if "partial" in self.sorts:
+                self.sorts["partial"].add(self.partial_key(row), records)
+
+    def statuses(self):
+        """Iterate over the (record, is_dupe, dupe_ref) items of duplicate
+records, in file order. Strict duplicates are not partial duplicates."""
+        def stream(kind, is_dupe):
+            pairs = by_record(self.sorts[kind].duplicates(), self.run_size,
+                              self.tmpdir)
+            for records, original in pairs:
+                yield records, is_dupe, original
+
+        streams = []
+        if "strict" in self.sorts:
+            streams.append(stream("strict", STRICT_DUPE))
+        if "partial" in self.sorts:
+            streams.append(stream("partial", PARTIAL_DUPE))
+        last = None
+        for records, is_dupe, original in heapq.merge(*streams):
+            if records != last:
+                last = records
+                yield records, is_dupe, original
+
+    def add_duplicate(self, records, is_dupe, original, row=None):
+        """Count a duplicate record, with its id if the row is given."""
+        record_id = row[self.idx] if row is not None else None
+        if is_dupe == STRICT_DUPE:
+            self.strict_duplicates += 1
+            self.duplicate_order.add((original, records), record_id)
+        else:
+            self.partial_duplicates += 1
+            self.partial_duplicates_order.add((original, records), record_id)
+
+    def run_external(self, input):
+        """Sort the keys, then find the duplicates, reading the file again if
+the result rows or ids are needed."""
+        self.sort_keys()
+        statuses = self.statuses()
+        if self.action == "report" and self.id_field is None:
+            for status in statuses:
+                self.add_duplicate(*status)
+            return
+
+        # Second pass
+        input.seek(0)
+        lines = LineReader(input)
+        read_headers(lines, {"delimiter": self.delimiter,
+                             "quotechar": self.quotechar})
+        reader = csv.reader(lines, **csv_options(self.delimiter,
+                                                 self.quotechar))
+        dupe = next(statuses, None)
+        for records, row in enumerate(reader, 1):
+            if dupe is not None and dupe[0] == records:
+                self.is_dupe, self.dupe_ref = dupe[1:]
+                self.add_duplicate(records, self.is_dupe, self.dupe_ref,
+                                   row if self.id_field is not None else None)
+                dupe = next(statuses, None)
+            else:
+                self.is_dupe, self.dupe_ref = NO_DUPE, None
+            self.handle_row(row, records)
+
+
+def dedupe_external(input, output=None, options=None,
+                    run_size=EXTERNAL_RUN_SIZE, tmpdir=None):
+    """Same as engine.dedupe(), keeping at most run_size keys in memory per
+type of duplicate. input must be seekable: it is read twice for flag and
+remove actions and ids. Raise ValueError for wrong options, or duplicate types
+other than strict and partial."""
+    engine = ExternalDeduper()
+    lines = LineReader(input)
+    engine.configure(read_headers(lines, options), options, output)
+    for kind in engine.duplicates:
+        if kind not in ["strict", "partial"]:
+            raise ValueError("%s duplicates can't be checked in external"
+                             " memory" % kind)
+    engine.init_report()
+    engine.init_sorts(run_size, tmpdir)
+    engine.open_records(lines)
+    engine.start_output(output)
+    engine.run_external(input)
+    engine.build_report()
+    return engine.report
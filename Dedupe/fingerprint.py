@@ -0,0 +1,131 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Record fingerprints.
+
+A fingerprint is a fixed-width binary digest of the raw bytes of the fields of
+a record. Fields are joined by NUL bytes, which the csv module never lets into
+a field, so two different records never produce the same input to the hash.
+
+Available hash functions:
+
+- md5: 128 bits, always available (default)
+- xxh64, xxh128: 64 and 128 bits, if the xxhash package is in lib/
+- murmur3: 128 bits, if the mmh3 package is in lib/
+
+"""
+
+import logging
+import marshal
+import hashlib
+
+from config import *
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import mmh3
+except ImportError:
+    mmh3 = None
+
+SEPARATOR = "\x00"
+
+HASHES = {
+    "md5": lambda data: hashlib.md5(data).digest()
+}
+if xxhash is not None:
+    HASHES["xxh64"] = lambda data: xxhash.xxh64(data).digest()
+    if hasattr(xxhash, "xxh3_128"):
+        HASHES["xxh128"] = lambda data: xxhash.xxh3_128(data).digest()
+if mmh3 is not None:
+    HASHES["murmur3"] = mmh3.hash_bytes
+
+
+class Fingerprinter(object):
+    """
+Build fingerprints of records.
+
+Instance attributes:
+
+- added: fingerprints added to exact since the last dump, only kept if
+         track_added is True
+- algorithm: name of the hash function
+- exact: canonical bytes of the first record seen with each fingerprint,
+         only kept if verify is True
+- hash: hash function
+- kind: name of the checkpoint files of exact
+- track_added: whether to keep the fingerprints added since the last dump
+- verify: whether to compare the bytes of records with the same fingerprint
+"""
+
+    def __init__(self, algorithm=FINGERPRINT, verify=VERIFY_FINGERPRINTS,
+                 kind="exact", track_added=False):
+        if algorithm not in HASHES:
+            logging.warning("Hash function %s not available, using md5" %
+                            algorithm)
+            algorithm = "md5"
+        self.algorithm = algorithm
+        self.hash = HASHES[algorithm]
+        self.verify = verify
+        self.kind = kind
+        self.track_added = track_added
+        self.exact = {}
+        self.added = []
+
+    def __call__(self, fields):
+        """Return the fingerprint of the given list of fields."""
+        return self.data(SEPARATOR.join(fields))
+
+    def data(self, data):
+        """Return the fingerprint of fields already joined by SEPARATOR."""
+        key = self.hash(data)
+        if not self.verify:
+            return key
+
+        # On collision, derive new fingerprints until finding a free one or
+        # the one of the same record. The chain is the same for every copy of
+        # a record, so duplicates still share their fingerprint.
+        first = self.first(key, data)
+        n = 0
+        while first != data:
+            n += 1
+            logging.warning("Fingerprint collision, rehashing (%s)" % n)
+            key = self.hash("%s%s%s" % (n, SEPARATOR, data))
+            first = self.first(key, data)
+        return key
+
+    def first(self, key, data):
+        """Return the bytes of the first record seen with a fingerprint. If
+the fingerprint is new, the given record is the first one."""
+        first = self.exact.get(key)
+        if first is None:
+            self.exact[key] = first = data
+            if self.track_added:
+                self.added.append(key)
+        return first
+
+    def dump(self, f):
+        """Write the records added since the last dump to a file-like object,
+to be restored later with load()."""
+        f.write(marshal.dumps([(x, self.exact[x]) for x in self.added]))
+        self.added = []
+
+    def load(self, f):
+        """Add the records written by dump() from a file-like object. Loading
+all the dumps in order restores the records."""
+        self.exact.update(marshal.loads(f.read()))
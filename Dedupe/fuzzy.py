@@ -0,0 +1,137 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Fuzzy duplicate detection.
+
+Fuzzy duplicates are records that share scientific name and year, and whose
+locality, collector and date are similar but not necessarily equal, like
+typos or different ways of writing the same value.
+
+Comparing every record with every other record is not feasible, so records are
+grouped in blocks by normalized scientific name and year, and each record is
+only compared with the first FUZZY_BLOCK_SIZE records of its block. Similarity
+between values is the Dice coefficient of their sets of character bigrams, and
+the score of a pair of records is the weighted mean of the similarities of
+their fields.
+
+"""
+
+import marshal
+
+from normalize import normalize_text, normalize_date
+from config import *
+
+# Weight of each field in the similarity score
+LOCALITY_WEIGHT = 0.5
+COLLECTOR_WEIGHT = 0.3
+DATE_WEIGHT = 0.2
+
+
+def bigrams(value):
+    """Return the set of character bigrams of a normalized value."""
+    value = " %s " % value
+    return frozenset([value[i:i+2] for i in xrange(len(value) - 1)])
+
+
+def similarity(a, b):
+    """Return the Dice coefficient of two sets of bigrams, from 0 to 1."""
+    if a == b:
+        return 1.0
+    return 2.0 * len(a & b) / (len(a) + len(b))
+
+
+class FuzzyIndex(object):
+    """Blocks of records already parsed, to look for fuzzy duplicates.
+
+Instance attributes:
+
+- added: (block key, entry) items added to the blocks since the last dump,
+         only kept if track_added is True
+- block_size: maximum number of records compared per block
+- blocks: dictionary of blocks, each a list of [records, loc, col, dat] entries
+- features: dictionary of bigram sets of the entries, by records
+- kind: type of duplicate, to name the checkpoint files
+- threshold: minimum similarity score of fuzzy duplicates
+- track_added: whether to keep the entries added since the last dump
+"""
+
+    kind = "fuzzy"
+
+    def __init__(self, threshold=FUZZY_THRESHOLD, block_size=FUZZY_BLOCK_SIZE,
+                 track_added=False):
+        self.threshold = threshold
+        self.block_size = block_size
+        self.track_added = track_added
+        self.blocks = {}
+        self.features = {}
+        self.added = []
+
+    @staticmethod
+    def block_key(sci, dat):
+        """Return the key of the block of a record from its normalized
+scientific name and date, or None if the record has no scientific name."""
+        if not sci:
+            return None
+        return "%s|%s" % (sci, dat[:4])
+
+    def add(self, block, entry):
+        """Add an entry to a block, unless the block is full. Return whether
+the entry was added."""
+        if len(block) >= self.block_size:
+            return False
+        block.append(entry)
+        self.features[entry[0]] = tuple(bigrams(x) for x in entry[1:])
+        return True
+
+    def check(self, loc, sci, col, dat, records):
+        """Return the position of the most similar record of the same block,
+and the similarity score, if the score is over the threshold. Otherwise, add
+the record to its block and return None."""
+        dat = normalize_date(dat)
+        key = self.block_key(normalize_text(sci), dat)
+        if key is None:
+            return None
+        entry = [records, normalize_text(loc), normalize_text(col), dat]
+        block = self.blocks.setdefault(key, [])
+
+        loc_bg, col_bg, dat_bg = [bigrams(x) for x in entry[1:]]
+        best, best_score = None, self.threshold
+        for other in block:
+            other_loc, other_col, other_dat = self.features[other[0]]
+            score = LOCALITY_WEIGHT * similarity(loc_bg, other_loc) + \
+                COLLECTOR_WEIGHT * similarity(col_bg, other_col) + \
+                DATE_WEIGHT * similarity(dat_bg, other_dat)
+            if score >= best_score:
+                best, best_score = other[0], score
+                if score == 1.0:
+                    break
+
+        if best is None:
+            if self.add(block, entry) and self.track_added:
+                self.added.append((key, entry))
+            return None
+        return best, round(best_score, 4)
+
+    def dump(self, f):
+        """Write the entries added since the last dump to a file-like object,
+to be restored later with load(). Bigram sets are rebuilt on load."""
+        f.write(marshal.dumps(self.added))
+        self.added = []
+
+    def load(self, f):
+        """Add the entries written by dump() from a file-like object. Loading
+all the dumps in order restores the blocks."""
+        for key, entry in marshal.loads(f.read()):
+            self.add(self.blocks.setdefault(key, []), entry)
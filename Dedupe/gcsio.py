@@ -0,0 +1,320 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Buffered Google Cloud Storage I/O.
+
+PrefetchReader reads a file in large buffers on a background thread, keeping
+up to PREFETCH_BUFFERS buffers ready, so reads from GCS overlap with the
+parsing of records. The file is also opened on that thread: GCS reads are
+driven by the event loop of the thread that opened the file, and ndb event
+loops are thread-local. BufferedWriter gathers many small writes (one per
+row) in large blocks, written to GCS on a background thread.
+
+Both can handle gzip-compressed files, decompressing or compressing the data
+on their background threads. Compressed files may hold several gzip members,
+so parts of a file compressed separately can be composed in GCS.
+
+Both keep track of bytes transferred (uncompressed) and of the time spent
+waiting for the other side, available with stats(), to help tuning buffer
+sizes.
+
+"""
+
+import time
+import zlib
+import Queue
+import threading
+
+from config import *
+
+
+# zlib window bits for gzip headers and trailers
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def gunzip(data, max_size):
+    """Decompress gzip data held in memory, all members included. Return
+None if the result would be larger than max_size bytes."""
+    chunks = []
+    size = 0
+    while data:
+        d = zlib.decompressobj(GZIP_WBITS)
+        chunk = d.decompress(data, max_size + 1 - size)
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > max_size or d.unconsumed_tail:
+            return None
+        data = d.unused_data
+    return "".join(chunks)
+
+
+def throughput(size, seconds, wait, requests):
+    """Build a dictionary with transfer statistics."""
+    return {
+        "bytes": size,
+        "requests": requests,
+        "seconds": round(seconds, 3),
+        "wait": round(wait, 3),
+        "mb_per_second": round(size / 1048576.0 / max(seconds, 0.001), 3)
+    }
+
+
+class PrefetchReader(object):
+    """
+Read a file-like object in large buffers, on a background thread. The file is
+opened, read and closed on that thread, calling opener. Errors opening the file
+are raised when creating the reader.
+
+Instance attributes:
+
+- buffer: part of the last buffer not returned yet
+- buffer_size: size of the reads from the file
+- closed: whether the reader has been closed
+- decompress: whether the file is gzip-compressed
+- error: exception raised opening the file, if any
+- fetched: number of bytes read from the file, before decompression
+- file: file-like object to read from, once opened
+- opener: function returning the file-like object to read from
+- queue: buffers already read, waiting to be returned
+- opened: event set once the file is opened, or failed to open
+- reads: number of buffers read from the file
+- size: number of bytes returned so far
+- started: time at which the reader was created
+- thread: background thread
+- wait: time spent waiting for buffers to be read
+"""
+
+    def __init__(self, opener, buffer_size=READ_BUFFER_SIZE,
+                 depth=PREFETCH_BUFFERS, decompress=False):
+        self.opener = opener
+        self.file = None
+        self.buffer_size = buffer_size
+        self.decompress = decompress
+        self.buffer = ""
+        self.closed = False
+        self.error = None
+        self.fetched = 0
+        self.reads = 0
+        self.size = 0
+        self.wait = 0.0
+        self.started = time.time()
+        self.queue = Queue.Queue(depth)
+        self.opened = threading.Event()
+        self.thread = threading.Thread(target=self._fetch)
+        self.thread.daemon = True
+        self.thread.start()
+        self.opened.wait()
+        if self.error is not None:
+            raise self.error
+
+    def _chunks(self):
+        """Read the file in buffers, decompressing them if needed.
+Decompressed buffers are not larger than buffer_size either."""
+        d = None
+        while not self.closed:
+            data = self.file.read(self.buffer_size)
+            self.reads += 1
+            self.fetched += len(data)
+            if not data:
+                break
+            if not self.decompress:
+                yield data
+                continue
+            while data:
+                if d is None:
+                    d = zlib.decompressobj(GZIP_WBITS)
+                chunk = d.decompress(data, self.buffer_size)
+                if chunk:
+                    yield chunk
+                if d.unconsumed_tail:
+                    data = d.unconsumed_tail
+                elif d.unused_data:
+                    # End of a gzip member, the next one starts here
+                    data = d.unused_data
+                    d = None
+                else:
+                    data = ""
+        if d is not None:
+            chunk = d.flush()
+            if chunk:
+                yield chunk
+
+    def _fetch(self):
+        """Open the file, and read buffers until the end of the file or until
+closed."""
+        try:
+            self.file = self.opener()
+        except Exception, e:
+            self.error = e
+            return
+        finally:
+            self.opened.set()
+        try:
+            for chunk in self._chunks():
+                self.queue.put(chunk)
+            self.queue.put("")
+        except Exception, e:
+            self.queue.put(e)
+        finally:
+            self.file.close()
+
+    def read(self, size=-1):
+        """Return at most size bytes, or the rest of the current buffer if no
+size is given. An empty string means the end of the file."""
+        if not self.buffer:
+            waiting = time.time()
+            chunk = self.queue.get()
+            self.wait += time.time() - waiting
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                # Keep the end of the file for later reads
+                self.queue.put(chunk)
+                return ""
+            self.buffer = chunk
+        if size < 0 or size >= len(self.buffer):
+            data, self.buffer = self.buffer, ""
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        self.size += len(data)
+        return data
+
+    def close(self):
+        """Stop the background thread, which closes the file."""
+        self.closed = True
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+
+    def stats(self):
+        """Transfer statistics."""
+        return throughput(self.size, time.time() - self.started, self.wait,
+                          self.reads)
+
+
+class BufferedWriter(object):
+    """
+Gather small writes in large blocks, written to a file-like object on a
+background thread.
+
+Instance attributes:
+
+- background: whether blocks are written on a background thread
+- blocks: number of blocks written to the file
+- buffer: pieces of data of the current block
+- buffer_size: size of the blocks
+- compressor: zlib compressor object, if blocks are gzip-compressed
+- error: exception raised on the background thread, if any
+- file: file-like object to write to
+- pending: number of bytes in the current block
+- queue: blocks waiting to be written
+- size: number of bytes written so far
+- started: time at which the writer was created
+- thread: background thread
+- wait: time spent waiting for blocks to be written
+"""
+
+    def __init__(self, f, buffer_size=WRITE_BUFFER_SIZE, background=True,
+                 compress=False):
+        self.file = f
+        self.compressor = None
+        if compress:
+            self.compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED,
+                                               GZIP_WBITS)
+        self.buffer_size = buffer_size
+        self.background = background
+        self.buffer = []
+        self.blocks = 0
+        self.pending = 0
+        self.size = 0
+        self.wait = 0.0
+        self.error = None
+        self.started = time.time()
+        if background:
+            self.queue = Queue.Queue(2)
+            self.thread = threading.Thread(target=self._store)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _store(self):
+        """Write blocks until receiving None."""
+        while True:
+            block = self.queue.get()
+            if block is None:
+                break
+            if self.error is None:
+                try:
+                    self._write(block)
+                except Exception, e:
+                    self.error = e
+
+    def _write(self, block):
+        """Write a block to the file, compressing it if needed. An empty block
+ends the compressed stream."""
+        if self.compressor is not None:
+            if block:
+                block = self.compressor.compress(block)
+            else:
+                block = self.compressor.flush()
+        if block:
+            self.file.write(block)
+            self.blocks += 1
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.pending += len(data)
+        if self.pending >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Send the current block to the file."""
+        if self.error is not None:
+            raise self.error
+        block = "".join(self.buffer)
+        self.buffer = []
+        self.size += self.pending
+        self.pending = 0
+        if block:
+            self._send(block)
+
+    def _send(self, block):
+        """Hand a block to the background thread, or write it directly."""
+        waiting = time.time()
+        if self.background:
+            self.queue.put(block)
+        else:
+            self._write(block)
+        self.wait += time.time() - waiting
+
+    def close(self):
+        """Write the pending data and close the file."""
+        self.flush()
+        if self.compressor is not None:
+            self._send("")
+        if self.background:
+            waiting = time.time()
+            self.queue.put(None)
+            self.thread.join()
+            self.wait += time.time() - waiting
+            if self.error is not None:
+                raise self.error
+        self.file.close()
+
+    def stats(self):
+        """Transfer statistics."""
+        return throughput(self.size, time.time() - self.started, self.wait,
+                          self.blocks)
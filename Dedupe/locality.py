@@ -0,0 +1,178 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Locality duplicate detection.
+
+Locality duplicates are records with the same scientific name and date, and
+near-duplicate locality strings, like "5 km N of Lawrence, KS" and "5km N.
+Lawrence KS".
+
+Localities are split in character shingles and summarized in MinHash
+signatures: the minimum value of the shingle hashes under LSH_BANDS * LSH_ROWS
+different hash functions. The fraction of equal values in two signatures
+estimates the Jaccard similarity of the shingle sets. Signatures are cut in
+bands, and records are bucketed by band (and scientific name and date), so only
+records sharing a bucket are compared: the work grows linearly with the number
+of records, instead of quadratically.
+
+"""
+
+import hashlib
+import marshal
+import random
+import struct
+import zlib
+
+from normalize import normalize_text, normalize_date
+from config import *
+
+# Length of the character shingles
+SHINGLE_SIZE = 3
+
+# Seed of the hash functions. Changing it invalidates saved checkpoints
+SEED = 2016
+
+MASK = 0xffffffff
+
+
+def shingles(value):
+    """Return the set of 32-bit hashes of the character shingles of a
+normalized value."""
+    if len(value) <= SHINGLE_SIZE:
+        return set([zlib.crc32(value) & MASK])
+    return set([zlib.crc32(value[i:i+SHINGLE_SIZE]) & MASK
+                for i in xrange(len(value) - SHINGLE_SIZE + 1)])
+
+
+class LocalityIndex(object):
+    """MinHash signatures and LSH buckets of the records already parsed, to
+look for locality duplicates.
+
+Instance attributes:
+
+- added: (records, packed signature, bucket keys) of the records indexed since
+         the last dump, only kept if track_added is True
+- bands: number of bands per signature
+- buckets: dictionary of the first record of each bucket, by bucket key
+- coefficients: (a, b) pairs of the hash functions, a * x + b
+- kind: type of duplicate, to name the checkpoint files
+- max_records: maximum number of records kept in the index
+- rows: number of signature values per band
+- signatures: dictionary of packed signatures of the indexed records
+- threshold: minimum estimated similarity of locality duplicates
+- track_added: whether to keep the records indexed since the last dump
+"""
+
+    kind = "locality"
+
+    def __init__(self, bands=LSH_BANDS, rows=LSH_ROWS,
+                 threshold=LOCALITY_THRESHOLD,
+                 max_records=LOCALITY_MAX_RECORDS, track_added=False):
+        self.bands = bands
+        self.track_added = track_added
+        self.rows = rows
+        self.threshold = threshold
+        self.max_records = max_records
+        self.buckets = {}
+        self.signatures = {}
+        self.added = []
+        # Products must fit in a machine integer: a < 2**30, x < 2**32
+        rnd = random.Random(SEED)
+        self.coefficients = [(rnd.randrange(1, 1 << 30, 2),
+                              rnd.randrange(0, 1 << 30))
+                             for i in xrange(bands * rows)]
+        self.packer = struct.Struct("<%dI" % (bands * rows))
+
+    @staticmethod
+    def group_key(sci, dat):
+        """Return the key of the group of records with the same normalized
+scientific name and date, the only ones compared with each other."""
+        return hashlib.md5("%s\x00%s" % (normalize_text(sci),
+                                         normalize_date(dat))).digest()[:8]
+
+    def signature(self, value):
+        """Return the MinHash signature of a normalized value."""
+        hashes = shingles(value)
+        return [min([((a * x + b) >> 16) & MASK for x in hashes])
+                for a, b in self.coefficients]
+
+    def bucket_keys(self, signature, group):
+        """Return the key of the bucket of each band of a signature, within
+a group of records."""
+        keys = []
+        for band in xrange(self.bands):
+            values = signature[band * self.rows:(band + 1) * self.rows]
+            keys.append(struct.pack("<B%dI" % self.rows, band, *values) +
+                        group)
+        return keys
+
+    def score(self, signature, records):
+        """Estimate the similarity of a signature with the signature of an
+indexed record."""
+        other = self.packer.unpack(self.signatures[records])
+        same = sum(1 for x, y in zip(signature, other) if x == y)
+        return float(same) / len(signature)
+
+    def check(self, loc, sci, dat, records):
+        """Return the position of the most similar record in the same buckets,
+and the estimated similarity, if over the threshold. Otherwise, add the record
+to the index (unless full) and return None."""
+        loc = normalize_text(loc)
+        if not loc:
+            return None
+        group = self.group_key(sci, dat)
+        signature = self.signature(loc)
+        keys = self.bucket_keys(signature, group)
+
+        # Candidates are the records sharing at least one bucket
+        candidates = set(self.buckets[k] for k in keys if k in self.buckets)
+        best, best_score = None, self.threshold
+        for candidate in sorted(candidates):
+            score = self.score(signature, candidate)
+            if score > best_score or score == best_score and best is None:
+                best, best_score = candidate, score
+
+        if best is not None:
+            return best, round(best_score, 4)
+
+        if not self.is_full():
+            self.index(records, self.packer.pack(*signature), keys)
+            if self.track_added:
+                self.added.append((records, self.signatures[records],
+                                   keys))
+        return None
+
+    def is_full(self):
+        """Return True if no more records are indexed."""
+        return len(self.signatures) >= self.max_records
+
+    def index(self, records, signature, keys):
+        """Add a record to the index, with its packed signature, in the given
+buckets."""
+        self.signatures[records] = signature
+        for k in keys:
+            self.buckets.setdefault(k, records)
+
+    def dump(self, f):
+        """Write the records indexed since the last dump to a file-like
+object, to be restored later with load()."""
+        f.write(marshal.dumps(self.added))
+        self.added = []
+
+    def load(self, f):
+        """Add the records written by dump() from a file-like object. Loading
+all the dumps in order restores the index."""
+        for records, signature, keys in marshal.loads(f.read()):
+            self.index(records, signature, keys)
@@ -40,6 +40,8 @@ class LogEntry(ndb.Model):
     dat = ndb.StringProperty()
     col = ndb.StringProperty()
     id_field = ndb.StringProperty()
+    partial_fields = ndb.StringProperty(repeated=True)
+    collection = ndb.StringProperty()
 
     # File parameters
     namespace = ndb.StringProperty()
@@ -49,3 +51,76 @@ class LogEntry(ndb.Model):
     fields = ndb.IntegerProperty()
     strict_duplicates = ndb.IntegerProperty()
     partial_duplicates = ndb.IntegerProperty()
+    fuzzy_duplicates = ndb.IntegerProperty()
+    locality_duplicates = ndb.IntegerProperty()
+
+    # Performance: seconds spent in each stage (see engine.STAGES), overall
+    # throughput and remote calls. Added up over all shards of sharded jobs
+    seconds = ndb.FloatProperty()
+    rows_per_second = ndb.IntegerProperty()
+    upload_time = ndb.FloatProperty()
+    read_time = ndb.FloatProperty()
+    parse_time = ndb.FloatProperty()
+    strict_time = ndb.FloatProperty()
+    partial_time = ndb.FloatProperty()
+    fuzzy_time = ndb.FloatProperty()
+    locality_time = ndb.FloatProperty()
+    write_time = ndb.FloatProperty()
+    checkpoint_time = ndb.FloatProperty()
+    report_time = ndb.FloatProperty()
+    notify_time = ndb.FloatProperty()
+    memcache_rpcs = ndb.IntegerProperty()
+    gcs_read_rpcs = ndb.IntegerProperty()
+    gcs_write_rpcs = ndb.IntegerProperty()
+
+
+class JobProgress(ndb.Model):
+
+    # Progress of a de-duplication task, in the request namespace. Keyed by
+    # task: "dedupe" (whole file), "split", "shard.NNNN" or "merge"
+    status = ndb.StringProperty()
+    error = ndb.StringProperty()
+    records = ndb.IntegerProperty()
+    bytes_read = ndb.IntegerProperty()
+    file_size = ndb.IntegerProperty()
+    seconds = ndb.FloatProperty()
+    rows_per_second = ndb.IntegerProperty()
+    strict_duplicates = ndb.IntegerProperty()
+    partial_duplicates = ndb.IntegerProperty()
+    fuzzy_duplicates = ndb.IntegerProperty()
+    locality_duplicates = ndb.IntegerProperty()
+    created_at = ndb.DateTimeProperty(auto_now_add=True)
+    updated_at = ndb.DateTimeProperty(auto_now=True)
+
+
+class CachedResult(ndb.Model):
+
+    # Results of a finished job, in the default namespace, keyed by a hash of
+    # the upload and the options of the request (see cache.cache_key)
+    request_namespace = ndb.StringProperty()
+    report = ndb.TextProperty()
+    file_url = ndb.StringProperty()
+    report_url = ndb.StringProperty()
+    created_at = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class CollectionKey(ndb.Model):
+
+    # Key of a record of a collection, in the namespace of the collection (see
+    # collection.py), named after the type of duplicate, the fingerprint
+    # algorithm and the key. Keeps the first record seen with the key. Uploads
+    # look up many keys once each: caching them would only use up memory
+    _use_cache = False
+    _use_memcache = False
+
+    dataset = ndb.StringProperty(indexed=False)
+    record = ndb.IntegerProperty(indexed=False)
+    record_id = ndb.StringProperty(indexed=False)
+
+
+class ShardJob(ndb.Model):
+
+    # Sharded de-duplication progress, keyed by request namespace
+    shards = ndb.IntegerProperty()
+    done = ndb.IntegerProperty(repeated=True)
+    created_at = ndb.DateTimeProperty(auto_now_add=True)
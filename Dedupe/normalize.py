@@ -0,0 +1,184 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Field normalizers.
+
+Normalizers turn field values into a canonical form, so that values written in
+different ways compare equal: "Smith, J." and "smith j", or "2001-03-12" and
+"12 Mar 2001".
+
+Partial duplicate keys are built from a configurable list of fields, each with
+its own normalizer (see NORMALIZERS). compile_key() turns that list into a
+single key-extractor function, with normalizer results memoized, since
+values like recordedBy repeat across many records.
+
+"""
+
+import operator
+import re
+import unicodedata
+
+from config import *
+
+PUNCTUATION = re.compile(r"[\W_]+")
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12
+}
+
+# Numeric dates: year first, day first (or month first) and partial dates
+YMD = re.compile(r"^(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})(?:$|[ T/])")
+DMY = re.compile(r"^(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})$")
+YM = re.compile(r"^(\d{4})[-/.](\d{1,2})$")
+Y = re.compile(r"^(\d{4})$")
+
+# Dates with month names: "12 Mar 2001", "March 12, 2001", "Mar 2001"
+DAY_MONTH_YEAR = re.compile(r"^(\d{1,2}) ([a-z]{3})[a-z]* (\d{4})$")
+MONTH_DAY_YEAR = re.compile(r"^([a-z]{3})[a-z]* (\d{1,2}) (\d{4})$")
+MONTH_YEAR = re.compile(r"^([a-z]{3})[a-z]* (\d{4})$")
+
+
+def fold_case(value):
+    """Lowercase the value and strip accents."""
+    try:
+        value = value.decode("utf-8")
+    except UnicodeError:
+        return value.lower()
+    value = unicodedata.normalize("NFKD", value)
+    return value.encode("ascii", "ignore").lower()
+
+
+def normalize_text(value):
+    """Fold case, and turn punctuation and runs of whitespace into single
+spaces."""
+    return PUNCTUATION.sub(" ", fold_case(value)).strip()
+
+
+def iso_date(year, month=None, day=None):
+    """Build an ISO 8601 date, as precise as the given parts."""
+    parts = ["%04d" % year]
+    if month is not None:
+        parts.append("%02d" % month)
+        if day is not None:
+            parts.append("%02d" % day)
+    return "-".join(parts)
+
+
+def normalize_date(value):
+    """Turn a date into ISO 8601 format, as precise as the original. Date
+intervals are reduced to their start. Values not recognized as dates are only
+stripped."""
+    value = value.strip()
+
+    m = YMD.match(value)
+    if m:
+        return iso_date(*map(int, m.groups()))
+
+    m = DMY.match(value)
+    if m:
+        first, second, year = map(int, m.groups())
+        # Day first, unless it can only be month first
+        if second > 12:
+            return iso_date(year, first, second)
+        return iso_date(year, second, first)
+
+    m = YM.match(value)
+    if m:
+        return iso_date(*map(int, m.groups()))
+
+    m = Y.match(value)
+    if m:
+        return iso_date(int(m.group(1)))
+
+    # Dates with month names
+    text = normalize_text(value)
+    m = DAY_MONTH_YEAR.match(text)
+    if m and m.group(2) in MONTHS:
+        return iso_date(int(m.group(3)), MONTHS[m.group(2)], int(m.group(1)))
+    m = MONTH_DAY_YEAR.match(text)
+    if m and m.group(1) in MONTHS:
+        return iso_date(int(m.group(3)), MONTHS[m.group(1)], int(m.group(2)))
+    m = MONTH_YEAR.match(text)
+    if m and m.group(1) in MONTHS:
+        return iso_date(int(m.group(2)), MONTHS[m.group(1)])
+
+    return value
+
+
+# Normalizers available for partial duplicate key fields, by name
+NORMALIZERS = {
+    "exact": None,
+    "case": fold_case,
+    "text": normalize_text,
+    "date": normalize_date
+}
+
+
+def memoize(func, size=NORMALIZER_CACHE_SIZE):
+    """Return a version of a one-argument function that remembers the results
+of about the last size distinct arguments. Results are kept in two
+generations: when the recent one is full, the old one is dropped and the
+recent one takes its place, so values in use survive and memory is bounded."""
+    cache = {"recent": {}, "old": {}}
+    half = max(1, size // 2)
+
+    def memoized(value):
+        recent = cache["recent"]
+        try:
+            return recent[value]
+        except KeyError:
+            pass
+        result = cache["old"].get(value)
+        if result is None:
+            result = func(value)
+        if len(recent) >= half:
+            cache["old"] = recent
+            recent = cache["recent"] = {}
+        recent[value] = result
+        return result
+
+    return memoized
+
+
+def compile_key(fields, cache_size=NORMALIZER_CACHE_SIZE):
+    """Build a function returning the normalized values of the key fields of
+a row. fields is a list of (position, normalizer name) pairs."""
+    positions = [position for position, name in fields]
+    # No key fields when partial duplicates are not checked
+    if not positions:
+        return lambda row: ()
+    if len(positions) == 1:
+        position = positions[0]
+        get = lambda row: (row[position],)
+    else:
+        get = operator.itemgetter(*positions)
+
+    normalizers = [NORMALIZERS[name] for position, name in fields]
+    if not any(normalizers):
+        return get
+
+    normalizers = [memoize(x, cache_size) if x else None
+                   for x in normalizers]
+    steps = list(enumerate(normalizers))
+
+    def key(row):
+        values = list(get(row))
+        for i, normalizer in steps:
+            if normalizer is not None:
+                values[i] = normalizer(values[i])
+        return values
+
+    return key
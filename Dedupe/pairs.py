@@ -0,0 +1,126 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+"""Duplicate pairs.
+
+Duplicates are kept as (original, duplicate) pairs of record positions, in
+integer arrays: 16 bytes per pair instead of over 100 for a tuple in a set.
+Fuzzy and locality duplicates also keep their similarity score, and the value
+of the "id" field of each duplicate is kept when there is one. Each record is
+added at most once, so there is no need for a set.
+
+For the report, duplicates are grouped in clusters: the original record, and
+all its duplicates.
+
+"""
+
+from array import array
+
+
+class DuplicatePairs(object):
+    """
+Original-duplicate pairs of records of a type of duplicate.
+
+Instance attributes:
+
+- duplicates: positions of the duplicate records
+- ids: values of the "id" field of the duplicate records, if there is one
+- originals: positions of the original records
+- scores: similarity scores of the pairs, or None if not scored
+"""
+
+    def __init__(self, scored=False):
+        self.originals = array("l")
+        self.duplicates = array("l")
+        self.scores = array("d") if scored else None
+        self.ids = []
+
+    def __len__(self):
+        return len(self.duplicates)
+
+    def __iter__(self):
+        """Iterate over the (original, duplicate) pairs, or (original,
+duplicate, score) triples if scored."""
+        if self.scores is None:
+            return iter(zip(self.originals, self.duplicates))
+        return iter(zip(self.originals, self.duplicates, self.scores))
+
+    def add(self, pair, record_id=None):
+        """Add an (original, duplicate) pair, or (original, duplicate, score)
+triple if scored, with the "id" of the duplicate record if there is one."""
+        self.originals.append(pair[0])
+        self.duplicates.append(pair[1])
+        if self.scores is not None:
+            self.scores.append(pair[2])
+        if record_id is not None:
+            self.ids.append(record_id)
+
+    def update(self, other):
+        """Add all the pairs of another DuplicatePairs object."""
+        self.originals.extend(other.originals)
+        self.duplicates.extend(other.duplicates)
+        if self.scores is not None:
+            self.scores.extend(other.scores)
+        self.ids.extend(other.ids)
+
+    def count_originals(self):
+        """Number of different original records."""
+        return len(set(self.originals))
+
+    def clusters(self):
+        """Iterate over the clusters of duplicates, by position of the
+original record. Each cluster is a dictionary with the position of the
+original, and the positions, ids and scores of its duplicates, in file
+order."""
+        order = sorted(xrange(len(self)),
+                       key=lambda i: (self.originals[i], self.duplicates[i]))
+        cluster = None
+        for i in order:
+            if cluster is None or cluster["original"] != self.originals[i]:
+                if cluster is not None:
+                    yield cluster
+                cluster = {"original": self.originals[i], "duplicates": []}
+                if self.ids:
+                    cluster["ids"] = []
+                if self.scores is not None:
+                    cluster["scores"] = []
+            cluster["duplicates"].append(self.duplicates[i])
+            if self.ids:
+                cluster["ids"].append(self.ids[i])
+            if self.scores is not None:
+                cluster["scores"].append(self.scores[i])
+        if cluster is not None:
+            yield cluster
+
+    def dump(self):
+        """Return the pairs in a JSON-friendly dictionary."""
+        data = {
+            "originals": self.originals.tolist(),
+            "duplicates": self.duplicates.tolist(),
+            "ids": self.ids
+        }
+        if self.scores is not None:
+            data["scores"] = self.scores.tolist()
+        return data
+
+    @classmethod
+    def load(cls, data):
+        """Build a DuplicatePairs object from a dictionary built by dump()."""
+        pairs = cls(scored="scores" in data)
+        pairs.originals.extend(data["originals"])
+        pairs.duplicates.extend(data["duplicates"])
+        if pairs.scores is not None:
+            pairs.scores.extend(data["scores"])
+        pairs.ids = data["ids"]
+        return pairs
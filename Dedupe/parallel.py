@@ -0,0 +1,295 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Parallel de-duplication of local files.
+
+The file is split in byte ranges of about PARALLEL_CHUNK_SIZE bytes, cut at
+record boundaries, and handled by a pool of worker processes in two steps:
+
+- digest: workers parse the records of a range and build their strict and
+  partial duplicate keys, the expensive part. The keys of a range go back to
+  the coordinator packed in a single string per type.
+- write: for flag and remove actions, once the coordinator has checked the
+  keys of a range, workers parse the range again and write its result rows,
+  with the duplicate status found by the coordinator.
+
+The coordinator checks the keys of each range in file order against the
+seen-key stores, so the first-seen order, duplicate references, report and
+result file are exactly the same as in a serial run.
+
+Only strict and partial duplicates are checked in parallel: fuzzy and locality
+duplicates need the records in order. Fingerprint collisions can't be
+verified either, since each worker sees only part of the records.
+
+"""
+
+import re
+import csv
+import collections
+import multiprocessing
+from StringIO import StringIO
+
+from config import *
+from engine import Deduper, read_headers
+from fingerprint import Fingerprinter
+from records import LineReader, RecordReader, csv_options
+
+# Deduper of the worker process, set up by init_worker()
+worker = None
+
+
+def split_ranges(f, start, chunk_size, delimiter, quotechar='"'):
+    """Return the (start, end) byte ranges of a file from start on, of about
+chunk_size bytes each, cut at record boundaries. Files with no quote character
+are cut at the last newline of each chunk."""
+    ranges = []
+    while True:
+        f.seek(start)
+        data = f.read(chunk_size)
+        if len(data) < chunk_size:
+            if data:
+                ranges.append((start, start + len(data)))
+            return ranges
+        end = data.rfind("\n") + 1
+        if quotechar and (quotechar in data or end == 0):
+            end = find_cut(f, start, data, delimiter, quotechar)
+        elif end == 0:
+            # A single line longer than the chunk, with no quoted fields
+            f.seek(start)
+            lines = LineReader(f, start)
+            next(lines)
+            end = lines.tell() - start
+        ranges.append((start, start + end))
+        start += end
+
+
+def find_cut(f, start, data, delimiter, quotechar='"'):
+    """Return the length of the records of a file from start on that end
+past data, the first bytes read from there, up to the end of the first record
+that does. Quoted fields may span several lines, but quotes inside them are
+doubled: a newline ends a record if the quotes before it are even. Quotes
+inside unquoted fields break that count, so the records are parsed from the
+last record boundary before the first of them."""
+    size = len(data)
+    # A quote with no delimiter, newline or quote next to it
+    stray = re.compile("[^{0}{1}\r\n]{1}[^{0}{1}\r\n]".format(
+        re.escape(delimiter), re.escape(quotechar)))
+    pos = size
+    quotes = data.count(quotechar)
+    while True:
+        newline = data.find("\n", pos)
+        if newline >= 0:
+            quotes += data.count(quotechar, pos, newline)
+            pos = newline + 1
+            if quotes % 2 == 0:
+                break
+            continue
+        # Records spanning more than one chunk are only read on if the count
+        # of quotes can be trusted
+        more = f.read(size)
+        if not more or (len(data) >= 2 * size and stray.search(data)):
+            pos = len(data)
+            break
+        data += more
+    match = stray.search(data, 0, pos)
+    if match is None:
+        return pos
+
+    # Last newline after even quotes before the stray quote, if any
+    base = match.start() + 1
+    quotes = data.count(quotechar, 0, base)
+    while base > 0:
+        newline = data.rfind("\n", 0, base)
+        quotes -= data.count(quotechar, newline + 1, base)
+        base = newline + 1
+        if base == 0 or quotes % 2 == 0:
+            break
+        base = newline
+    f.seek(start + base)
+    lines = LineReader(f, start + base)
+    for record in RecordReader(lines, delimiter, quotechar):
+        if lines.tell() - start >= size:
+            break
+    return lines.tell() - start
+
+
+def read_range(path, start, end):
+    """Return a line-reader object over a byte range of a file."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        return LineReader(StringIO(f.read(end - start)))
+
+
+def init_worker(headers, options):
+    """Set up the Deduper of a worker process."""
+    global worker
+    worker = Deduper()
+    worker.configure(headers, options)
+    worker.init_report()
+    worker.strict_fingerprint = Fingerprinter(verify=False)
+    worker.partial_fingerprint = Fingerprinter(verify=False)
+
+
+def digest_range(task):
+    """Parse the records of a byte range of a file. Return the number of
+records, their strict and partial keys (each type packed in a string, or None
+if not checked) and their ids (or None if there is no id field)."""
+    path, start, end = task
+    worker.open_records(read_range(path, start, end))
+    strict = [] if "strict" in worker.duplicates else None
+    partial = [] if "partial" in worker.duplicates else None
+    ids = [] if worker.id_field is not None else None
+    count = 0
+    for row in worker.reader:
+        count += 1
+        if strict is not None:
+            strict.append(worker.strict_key(row))
+        if partial is not None:
+            partial.append(worker.partial_key(row))
+        if ids is not None:
+            ids.append(worker.fields(row)[worker.idx])
+    return (count,
+            "".join(strict) if strict is not None else None,
+            "".join(partial) if partial is not None else None,
+            ids)
+
+
+def write_range(task):
+    """Write the result rows of a byte range of a file, given the
+(is_dupe, dupe_ref) status of its duplicate records, by position in the
+range. Return the rows, and the warnings raised."""
+    path, start, end, first, status = task
+    out = StringIO()
+    worker.writer = csv.writer(out, delimiter=worker.delimiter)
+    worker.warnings = []
+    reader = csv.reader(read_range(path, start, end),
+                        **csv_options(worker.delimiter, worker.quotechar))
+    for i, row in enumerate(reader):
+        worker.is_dupe, worker.dupe_ref = status.get(i, (NO_DUPE, None))
+        worker.handle_row(row, first + i)
+    return out.getvalue(), worker.warnings
+
+
+def unpack(keys, count):
+    """Split a string of count fixed-width keys."""
+    if not count:
+        return []
+    width = len(keys) // count
+    return [keys[i:i + width] for i in xrange(0, len(keys), width)]
+
+
+class ParallelDeduper(Deduper):
+    """Coordinator of a parallel run."""
+
+    def check_range(self, count, strict, partial, ids):
+        """Check the keys of the records of a range, the next ones in file
+order. Return the (is_dupe, dupe_ref) status of the duplicate records, by
+position in the range."""
+        first = self.records + 1
+        status = {}
+
+        # Check for strict duplicates
+        if strict is not None:
+            items = zip(unpack(strict, count), xrange(first, first + count))
+            dupes = self.strict_store.check_multi(items)
+            for i, dupe in enumerate(dupes):
+                if dupe is not None:
+                    status[i] = (STRICT_DUPE, dupe)
+                    self.strict_duplicates += 1
+                    self.duplicate_order.add(
+                        (dupe, first + i), ids[i] if ids is not None else None)
+
+        # Check for partial duplicates, among the rest
+        if partial is not None:
+            pending = [i for i in xrange(count) if i not in status]
+            keys = unpack(partial, count)
+            items = [(keys[i], first + i) for i in pending]
+            pdupes = self.partial_store.check_multi(items)
+            for i, pdupe in zip(pending, pdupes):
+                if pdupe is not None:
+                    status[i] = (PARTIAL_DUPE, pdupe)
+                    self.partial_duplicates += 1
+                    self.partial_duplicates_order.add(
+                        (pdupe, first + i),
+                        ids[i] if ids is not None else None)
+
+        self.records += count
+        return status
+
+    def run_parallel(self, path, ranges, headers, options, output,
+                     processes=None):
+        """Digest the byte ranges of the file in a pool of worker processes,
+check their keys in file order and write their result rows. At most two
+ranges per process are waiting to be checked at any time, to keep memory
+bounded."""
+        processes = processes or multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(processes, init_worker,
+                                    (headers, options))
+        try:
+            digests = collections.deque()
+            writes = collections.deque()
+            for start, end in ranges[:2 * processes]:
+                digests.append(((start, end), pool.apply_async(
+                    digest_range, ((path, start, end),))))
+            tasks = iter(ranges[2 * processes:])
+
+            while digests or writes:
+                # Check the next range in file order
+                if digests:
+                    (start, end), result = digests.popleft()
+                    count, strict, partial, ids = result.get()
+                    first = self.records + 1
+                    status = self.check_range(count, strict, partial, ids)
+                    if self.action != "report":
+                        writes.append(pool.apply_async(
+                            write_range, ((path, start, end, first, status),)))
+                    task = next(tasks, None)
+                    if task is not None:
+                        digests.append((task, pool.apply_async(
+                            digest_range, ((path,) + task,))))
+
+                # Write the result rows of the ranges already done, in order
+                while writes and (writes[0].ready() or not digests):
+                    rows, warnings = writes.popleft().get()
+                    output.write(rows)
+                    self.warnings += warnings
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+def dedupe_parallel(path, output=None, options=None, processes=None,
+                    chunk_size=PARALLEL_CHUNK_SIZE):
+    """Same as engine.dedupe(), on the local file at path, with a pool of
+processes (as many as CPUs by default). Raise ValueError for wrong options, or
+duplicate types that can't be checked in parallel."""
+    engine = ParallelDeduper()
+    with open(path, "rb") as f:
+        lines = LineReader(f)
+        headers = read_headers(lines, options)
+        engine.configure(list(headers), options, output)
+        for kind in engine.duplicates:
+            if kind not in ["strict", "partial"]:
+                raise ValueError("%s duplicates can't be checked in"
+                                 " parallel" % kind)
+        ranges = split_ranges(f, lines.tell(), chunk_size, engine.delimiter,
+                              engine.quotechar)
+
+    engine.init_report()
+    engine.start_output(output)
+    engine.run_parallel(path, ranges, headers, options, output, processes)
+    engine.build_report()
+    return engine.report
@@ -0,0 +1,181 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Line and raw record readers.
+
+LineReader splits a file, read in large buffers, in lines, and keeps track of
+the position of the first line not returned yet. Fed to a csv-reader, that is
+the position of the first record not parsed yet.
+
+RecordReader splits the lines of a LineReader in records without parsing their
+fields. Lines with no quote characters are complete records, and their fields
+are exactly the ones a csv-reader would return when splitting by the
+delimiter, so they are returned as raw strings (without the line terminator).
+Lines with quote characters may hold quoted fields, even spanning several
+lines, so they are handed to a csv-reader, and returned as lists of fields.
+So are lines with carriage returns or NUL bytes, for the csv-reader to handle
+them (or reject them) as usual.
+
+ProjectingReader returns only some fields of each record, as a dictionary by
+position. Records with no quoted fields are split by the delimiter up to the
+last field needed, so the rest of the line is never split.
+
+Files are quoted with '"' by default. Files whose fields are never quoted
+(such as tab-delimited Darwin Core Archives with an empty fieldsEnclosedBy)
+are read with no quote character, and quotes in them are plain characters.
+
+"""
+
+import csv
+import operator
+
+from config import *
+
+
+def csv_options(delimiter, quotechar='"'):
+    """Keyword arguments of a csv-reader for a delimiter and quote character,
+or no quote character if quotechar is empty."""
+    if quotechar:
+        return dict(delimiter=delimiter, quotechar=quotechar)
+    return dict(delimiter=delimiter, quoting=csv.QUOTE_NONE)
+
+
+class LineReader(object):
+    """
+Iterate over the lines of a file, line terminators included.
+
+Instance attributes:
+
+- buffer_size: size of the reads from the file
+- file: file-like object to read from
+- lines: iterator over the lines of the file
+- offset: position in the file of the first line not returned yet
+"""
+
+    def __init__(self, f, offset=0, buffer_size=READ_BUFFER_SIZE):
+        self.file = f
+        self.offset = offset
+        self.buffer_size = buffer_size
+        self.lines = self._lines()
+
+    def _lines(self):
+        """Read the file in buffers and split them in lines."""
+        rest = ""
+        while True:
+            chunk = self.file.read(self.buffer_size)
+            if not chunk:
+                break
+            chunk = rest + chunk
+            end = chunk.rfind("\n") + 1
+            rest = chunk[end:]
+            for line in chunk[:end].split("\n")[:-1]:
+                yield line + "\n"
+        if rest:
+            yield rest
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = next(self.lines)
+        self.offset += len(line)
+        return line
+
+    def tell(self):
+        """Position in the file of the first line not returned yet."""
+        return self.offset
+
+
+class RecordReader(object):
+    """
+Iterate over the records of a file, either as raw strings or, for records with
+quoted fields, as lists of fields.
+
+Instance attributes:
+
+- lines: line-reader object
+- pending: line already read, to be parsed by the csv-reader
+- quotechar: quote character of the file, or "" if fields are never quoted
+- reader: csv-reader object for records with quoted fields
+"""
+
+    def __init__(self, lines, delimiter, quotechar='"'):
+        self.lines = lines
+        self.pending = None
+        self.quotechar = quotechar
+        self.reader = csv.reader(self._pull(),
+                                 **csv_options(delimiter, quotechar))
+
+    def _pull(self):
+        """Feed lines to the csv-reader, starting with the pending one."""
+        while True:
+            if self.pending is not None:
+                line = self.pending
+                self.pending = None
+            else:
+                line = next(self.lines)
+            yield line
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = next(self.lines)
+        body = line[:-1] if line.endswith("\n") else line
+        if body.endswith("\r"):
+            body = body[:-1]
+        if (not self.quotechar or self.quotechar not in body) and \
+                "\r" not in body and "\x00" not in body:
+            return body
+
+        # Quoted fields may span several lines, let the csv module decide
+        self.pending = line
+        return self.reader.next()
+
+    def tell(self):
+        """Position in the file of the first record not returned yet."""
+        return self.lines.tell()
+
+
+class ProjectingReader(RecordReader):
+    """
+Iterate over the records of a file, keeping only the fields in some positions.
+Records are dictionaries of {position: field}, so they can be indexed like
+lists of fields.
+
+Instance attributes (besides those of RecordReader):
+
+- columns: positions of the fields to keep, sorted
+- delimiter: field delimiter
+- get: function returning the fields to keep from a list of fields
+- maxsplit: number of splits needed to reach the last field to keep
+"""
+
+    def __init__(self, lines, delimiter, columns, quotechar='"'):
+        RecordReader.__init__(self, lines, delimiter, quotechar)
+        self.delimiter = delimiter
+        self.columns = sorted(set(columns))
+        self.maxsplit = self.columns[-1] + 1
+        if len(self.columns) == 1:
+            position = self.columns[0]
+            self.get = lambda row: (row[position],)
+        else:
+            self.get = operator.itemgetter(*self.columns)
+
+    def next(self):
+        row = RecordReader.next(self)
+        if not isinstance(row, list):
+            row = row.split(self.delimiter, self.maxsplit)
+        return dict(zip(self.columns, self.get(row)))
@@ -0,0 +1,180 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Seen-key stores.
+
+A seen-key store keeps track of the keys of the records already parsed,
+together with the position of the record in which each key was seen for the
+first time. Keys are fixed-width record fingerprints (see fingerprint.py).
+
+Two backends are available:
+
+- memory: a plain dictionary living in the instance memory. This is the
+  default. No network round trips, and keys are never evicted.
+- memcache: the shared memcache service, isolated by request namespace. Kept
+  as an optional backend, but memcache can evict keys while the job is still
+  running, which would hide real duplicates. Keys are checked in windows of
+  records, with a single get_multi and set_multi call per window.
+
+"""
+
+import struct
+
+# memcache is only available in App Engine
+try:
+    from google.appengine.api import memcache
+except ImportError:
+    memcache = None
+
+from config import *
+
+
+class SeenKeyStore(object):
+    """Base class for seen-key stores. Backends implement check_multi(self,
+items): check a window of (key, records) items, in record order, and return
+the list of positions of the first records seen with each key (None for new
+keys). New keys are stored along with the position of their record.
+
+Instance attributes:
+
+- kind: type of duplicate the keys belong to (strict, partial...)
+- namespace: namespace of the current request
+- rpcs: number of remote calls made so far
+- track_added: whether to keep the keys stored since the last dump
+"""
+
+    def __init__(self, kind, namespace=None, track_added=False):
+        self.kind = kind
+        self.namespace = namespace
+        self.track_added = track_added
+        self.rpcs = 0
+
+    def check(self, key, records):
+        """Return the position of the first record seen with the given key,
+or None if the key is new. New keys are stored along with the position of the
+current record."""
+        return self.check_multi([(key, records)])[0]
+
+    def dump(self, f):
+        """Write the keys stored since the last dump to a file-like object, to
+be restored later with load(). Nothing to do for stores that live outside the
+instance."""
+        pass
+
+    def load(self, f):
+        """Add the keys written by dump() from a file-like object. Loading all
+the dumps in order restores the store."""
+        pass
+
+
+class MemorySeenKeyStore(SeenKeyStore):
+    """Seen-key store backed by a dictionary in instance memory.
+
+Instance attributes (besides those of SeenKeyStore):
+
+- added: keys stored since the last dump, only kept if track_added is True
+- keys: position of the first record seen with each key
+"""
+
+    def __init__(self, kind, namespace=None, track_added=False):
+        super(MemorySeenKeyStore, self).__init__(kind, namespace, track_added)
+        self.keys = {}
+        self.added = []
+
+    def check_multi(self, items):
+        firsts = []
+        for key, records in items:
+            first = self.keys.get(key)
+            if first is None:
+                self.keys[key] = records
+                if self.track_added:
+                    self.added.append(key)
+            firsts.append(first)
+        return firsts
+
+    def dump(self, f):
+        # Fixed-width records: key followed by 8-byte position
+        width = len(self.added[0]) if self.added else 0
+        f.write(struct.pack("<B", width))
+        chunk = []
+        for key in self.added:
+            chunk.append(key)
+            chunk.append(struct.pack("<Q", self.keys[key]))
+            if len(chunk) >= 2 * WINDOW_SIZE:
+                f.write("".join(chunk))
+                chunk = []
+        f.write("".join(chunk))
+        self.added = []
+
+    def load(self, f):
+        width = struct.unpack("<B", f.read(1))[0]
+        size = width + 8
+        chunk = ""
+        while True:
+            data = f.read(size * WINDOW_SIZE)
+            if not data:
+                break
+            chunk += data
+            end = len(chunk) - len(chunk) % size
+            for i in xrange(0, end, size):
+                self.keys[chunk[i:i+width]] = struct.unpack(
+                    "<Q", chunk[i+width:i+size])[0]
+            chunk = chunk[end:]
+
+
+class MemcacheSeenKeyStore(SeenKeyStore):
+    """Seen-key store backed by the shared memcache service."""
+
+    def _key(self, key):
+        # Prefix with duplicate type, so different kinds never collide
+        return "%s:%s" % (self.kind, key.encode('hex'))
+
+    def check_multi(self, items):
+        # Local pass: first position of each key inside the window
+        local = {}
+        for key, records in items:
+            local.setdefault(self._key(key), records)
+
+        # Remote pass: a single lookup for all the keys in the window
+        remote = memcache.get_multi(local.keys(), namespace=self.namespace)
+        self.rpcs += 1
+
+        # Keys not seen before the window are stored with a single call
+        new = dict((k, v) for k, v in local.iteritems() if k not in remote)
+        if len(new) > 0:
+            memcache.set_multi(new, namespace=self.namespace)
+            self.rpcs += 1
+
+        # Duplicates refer to previous windows first, then to the current one.
+        # Keys stored by an interrupted run of the same record are new
+        firsts = []
+        for key, records in items:
+            k = self._key(key)
+            first = remote.get(k, local[k])
+            firsts.append(first if first != records else None)
+        return firsts
+
+
+STORES = {
+    "memory": MemorySeenKeyStore,
+    "memcache": MemcacheSeenKeyStore
+}
+
+
+def get_store(kind, namespace=None, backend=SEEN_KEY_STORE,
+              track_added=False):
+    """Build a seen-key store of the configured backend. Stores that are
+dumped to checkpoints need track_added."""
+    return STORES[backend](kind, namespace, track_added)
@@ -0,0 +1,200 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Synthetic Darwin Core occurrence files.
+
+Records are made up from a fixed random seed, so the same arguments always
+give the same file. A share of the records are copies of previous ones:
+
+- strict: exact copies
+- partial: same locality, scientific name, collector and date, with a
+  different catalog number and coordinates
+- fuzzy: partial copies with typos, case and punctuation changes in the
+  locality and collector
+
+Usage:
+    python bench/generate.py [options] output
+
+Examples:
+    python bench/generate.py --rows 1000 data/occ_sample_with_dupes.txt
+    python bench/generate.py --rows 1000000 --columns 40 big.csv.gz
+
+"""
+
+import csv
+import gzip
+import random
+import argparse
+
+# Darwin Core fields of the records. Files with more columns get extra
+# "dynamicProperty" fields
+FIELDS = ["occurrenceID", "catalogNumber", "institutionCode", "basisOfRecord",
+          "scientificName", "locality", "recordedBy", "eventDate",
+          "decimalLatitude", "decimalLongitude", "country", "stateProvince"]
+
+SYLLABLES = ["ra", "na", "to", "mi", "ca", "lo", "pe", "su", "ve", "di", "mo",
+             "ter", "bus", "lus", "cus", "phi", "ta", "rix", "gon", "ly"]
+COUNTRIES = ["United States", "Mexico", "Canada", "Spain", "Brazil", "Peru"]
+DIRECTIONS = ["N", "S", "E", "W", "NE", "NW", "SE", "SW"]
+INSTITUTIONS = ["MVZ", "KU", "UAM", "MCZ", "FMNH", "LACM"]
+BASIS = ["PreservedSpecimen", "HumanObservation", "FossilSpecimen"]
+
+
+def word(rnd, syllables=3):
+    """Return a made-up word."""
+    return "".join(rnd.choice(SYLLABLES)
+                   for _ in range(rnd.randint(2, syllables)))
+
+
+def typo(rnd, value):
+    """Return value with a small change: a swapped pair of letters, a change
+of case or punctuation."""
+    change = rnd.randint(0, 2)
+    if change == 0 and len(value) > 3:
+        i = rnd.randint(0, len(value) - 2)
+        return value[:i] + value[i + 1] + value[i] + value[i + 2:]
+    elif change == 1:
+        return value.upper()
+    return value.replace(",", ";").replace(".", "")
+
+
+class Generator(object):
+    """
+Make up occurrence records.
+
+Instance attributes:
+
+- columns: number of fields of each record
+- fuzzy: share of fuzzy duplicates (0 to 1)
+- headers: field names
+- partial: share of partial duplicates (0 to 1)
+- rnd: random number generator
+- rows: records made so far, to copy duplicates from
+- species: scientific names to choose from
+- strict: share of strict duplicates (0 to 1)
+- towns: town names to choose from
+"""
+
+    def __init__(self, columns=len(FIELDS), strict=0.05, partial=0.05,
+                 fuzzy=0.02, seed=2016):
+        self.rnd = random.Random(seed)
+        self.columns = max(columns, len(FIELDS))
+        self.headers = FIELDS + ["dynamicProperty%s" % i for i in
+                                 range(self.columns - len(FIELDS))]
+        self.strict = strict
+        self.partial = partial
+        self.fuzzy = fuzzy
+        self.rows = []
+        self.species = ["%s %s" % (word(self.rnd).capitalize(),
+                                   word(self.rnd)) for _ in range(500)]
+        self.towns = [word(self.rnd, 4).capitalize() for _ in range(300)]
+
+    def record(self, n):
+        """Make up the n-th new record."""
+        rnd = self.rnd
+        lat = rnd.uniform(-40, 60)
+        lon = rnd.uniform(-120, -40)
+        row = [
+            "urn:occ:%s" % n,
+            str(n),
+            rnd.choice(INSTITUTIONS),
+            rnd.choice(BASIS),
+            rnd.choice(self.species),
+            "%s km %s of %s, %s County" % (rnd.randint(1, 30),
+                                           rnd.choice(DIRECTIONS),
+                                           rnd.choice(self.towns),
+                                           rnd.choice(self.towns)),
+            "%s. %s" % (rnd.choice("ABCDEFGHJKLMNPRSTW"),
+                        word(rnd).capitalize()),
+            "%04d-%02d-%02d" % (rnd.randint(1900, 2015), rnd.randint(1, 12),
+                                rnd.randint(1, 28)),
+            "%.5f" % lat,
+            "%.5f" % lon,
+            rnd.choice(COUNTRIES),
+            rnd.choice(self.towns)
+        ]
+        row += [word(rnd) for _ in range(self.columns - len(FIELDS))]
+        return row
+
+    def next(self, n):
+        """Return the n-th record, a new one or a copy of a previous one."""
+        rnd = self.rnd
+        kind = rnd.random()
+        if self.rows and kind < self.strict:
+            return list(rnd.choice(self.rows))
+
+        kind -= self.strict
+        if self.rows and kind < self.partial + self.fuzzy:
+            row = list(rnd.choice(self.rows))
+            row[0] = "urn:occ:%s" % n
+            row[1] = str(n)
+            row[8] = "%.5f" % (float(row[8]) + rnd.uniform(-0.01, 0.01))
+            row[9] = "%.5f" % (float(row[9]) + rnd.uniform(-0.01, 0.01))
+            if kind >= self.partial:
+                row[5] = typo(rnd, row[5])
+                row[6] = typo(rnd, row[6])
+        else:
+            row = self.record(n)
+
+        # Keep a bounded pool of records to copy from
+        if len(self.rows) < 10000:
+            self.rows.append(row)
+        else:
+            self.rows[rnd.randint(0, len(self.rows) - 1)] = row
+        return row
+
+
+def generate(f, rows, delimiter="\t", **kwargs):
+    """Write rows records to the file-like object f, header line first. Other
+arguments go to Generator."""
+    generator = Generator(**kwargs)
+    f.write(delimiter.join(generator.headers))
+    f.write("\n")
+    writer = csv.writer(f, delimiter=delimiter, lineterminator="\n")
+    for n in xrange(1, rows + 1):
+        writer.writerow(generator.next(n))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic Darwin Core occurrence file.")
+    parser.add_argument("output",
+                        help="file to write (.txt or .tsv for tab-separated,"
+                             " .csv for comma-separated, .gz to compress)")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--columns", type=int, default=len(FIELDS))
+    parser.add_argument("--strict", type=float, default=0.05,
+                        help="share of strict duplicates")
+    parser.add_argument("--partial", type=float, default=0.05,
+                        help="share of partial duplicates")
+    parser.add_argument("--fuzzy", type=float, default=0.02,
+                        help="share of fuzzy duplicates")
+    parser.add_argument("--seed", type=int, default=2016)
+    args = parser.parse_args(argv)
+
+    name = args.output[:-3] if args.output.endswith(".gz") else args.output
+    delimiter = "," if name.endswith(".csv") else "\t"
+    if args.output.endswith(".gz"):
+        f = gzip.open(args.output, "wb")
+    else:
+        f = open(args.output, "wb")
+    with f:
+        generate(f, args.rows, delimiter, columns=args.columns,
+                 strict=args.strict, partial=args.partial, fuzzy=args.fuzzy,
+                 seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Benchmarks of the de-duplication engine.
+
+Runs the engine on a synthetic file (see generate.py) for every combination
+of actions and duplicate types, each in its own process so that peak memory is
+measured per case. The in-memory seen-key store stands in for memcache and
+local files for GCS. Results are written in JSON, along with the commit and
+the parameters of the file, and can be compared with a previous run.
+
+Stages of each case:
+
+- setup: headers, options and seen-key stores
+- parse: reading and parsing the records
+- strict, partial: checking the records for each type of duplicate
+- write: writing the result rows
+- report: building the report
+
+The "parse" case only reads and parses the records, as a floor for the rest.
+
+Usage:
+    python bench/run.py [options]
+
+Examples:
+    python bench/run.py --rows 200000 --output before.json
+    python bench/run.py --rows 200000 --compare before.json
+
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import platform
+import resource
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import *
+from Dedupe.engine import Deduper, read_headers
+from Dedupe.records import LineReader
+from generate import generate
+
+ACTIONS = ["report", "flag", "remove"]
+DUPLICATES = ["strict", "partial", "all"]
+
+
+def peak_memory():
+    """Peak resident memory of the process, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux gives kilobytes, OS X bytes
+    if sys.platform == "darwin":
+        return peak / 1024.0 / 1024
+    return peak / 1024.0
+
+
+def parse_case(path, options):
+    """Only read and parse the records of the file."""
+    stages = {}
+    start = time.time()
+    with open(path, "rb") as f:
+        lines = LineReader(f)
+        read_headers(lines, options)
+        records = sum(1 for _ in csv.reader(lines,
+                                            delimiter=options["delimiter"]))
+    stages["parse"] = time.time() - start
+    return records, stages
+
+
+def dedupe_case(path, options):
+    """Run the engine on the file, timing each stage."""
+    stages = {}
+    engine = Deduper()
+    with open(path, "rb") as f, open(os.devnull, "wb") as output:
+        start = time.time()
+        lines = LineReader(f)
+        engine.configure(read_headers(lines, options), options, output)
+        engine.init_report()
+        engine.open_records(lines)
+        engine.start_output(output)
+        stages["setup"] = time.time() - start
+
+        engine.run()
+        stages.update((k, v) for k, v in engine.timings.items()
+                      if k != "total")
+
+        start = time.time()
+        engine.build_report()
+        stages["report"] = time.time() - start
+    return engine.records, stages
+
+
+def run_case(path, options, queue):
+    """Run a case, and put its results in the queue."""
+    if options["action"] == "parse":
+        records, stages = parse_case(path, options)
+    else:
+        records, stages = dedupe_case(path, options)
+    seconds = sum(stages.values())
+    queue.put({
+        "action": options["action"],
+        "duplicates": options["duplicates"],
+        "records": records,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": int(records / seconds) if seconds else None,
+        "peak_memory_mb": round(peak_memory(), 1),
+        "stages": dict((k, round(v, 3)) for k, v in stages.items())
+    })
+
+
+def measure(path, options):
+    """Run a case in its own process, so that memory is not shared with other
+cases."""
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target=run_case, args=(path, options, queue))
+    p.start()
+    result = queue.get()
+    p.join()
+    return result
+
+
+def commit():
+    """Current git commit of the repository, if any."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short",
+                                        "HEAD"], cwd=ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Print the change of speed and memory of each case from a previous
+run."""
+    previous = dict(((x["action"], x["duplicates"]), x)
+                    for x in baseline["cases"])
+    print "%-8s %-8s %12s %12s %8s %10s" % ("action", "dupes", "rows/s",
+                                           "before", "change", "memory")
+    for case in results["cases"]:
+        before = previous.get((case["action"], case["duplicates"]))
+        if before is None or not before["rows_per_sec"]:
+            continue
+        change = 100.0 * case["rows_per_sec"] / before["rows_per_sec"] - 100
+        memory = case["peak_memory_mb"] - before["peak_memory_mb"]
+        print "%-8s %-8s %12s %12s %+7.1f%% %+8.1fMB" % (
+            case["action"], case["duplicates"], case["rows_per_sec"],
+            before["rows_per_sec"], change, memory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the de-duplication engine.")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--columns", type=int, default=20)
+    parser.add_argument("--strict", type=float, default=0.05,
+                        help="share of strict duplicates")
+    parser.add_argument("--partial", type=float, default=0.05,
+                        help="share of partial duplicates")
+    parser.add_argument("--fuzzy", type=float, default=0.02,
+                        help="share of fuzzy duplicates")
+    parser.add_argument("--seed", type=int, default=2016)
+    parser.add_argument("--actions", default=",".join(ACTIONS),
+                        help="comma-separated actions to run")
+    parser.add_argument("--duplicates", default=",".join(DUPLICATES),
+                        help="comma-separated duplicate types to run")
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare",
+                        help="results of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    params = {
+        "rows": args.rows,
+        "columns": args.columns,
+        "strict": args.strict,
+        "partial": args.partial,
+        "fuzzy": args.fuzzy,
+        "seed": args.seed
+    }
+    results = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fingerprint": FINGERPRINT,
+        "params": params,
+        "cases": []
+    }
+
+    fd, path = tempfile.mkstemp(suffix=".txt")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            generate(f, args.rows, "\t", columns=args.columns,
+                     strict=args.strict, partial=args.partial,
+                     fuzzy=args.fuzzy, seed=args.seed)
+
+        cases = [("parse", None)]
+        cases += [(action, duplicates)
+                  for action in args.actions.split(",")
+                  for duplicates in args.duplicates.split(",")]
+        for action, duplicates in cases:
+            options = {
+                "action": action,
+                "duplicates": duplicates,
+                "delimiter": "\t"
+            }
+            result = measure(path, options)
+            results["cases"].append(result)
+            print >> sys.stderr, "%-8s %-8s %10s rows/s %8.1fMB" % (
+                action, duplicates, result["rows_per_sec"],
+                result["peak_memory_mb"])
+    finally:
+        os.remove(path)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, sort_keys=True, indent=4)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    elif not args.output:
+        print json.dumps(results, sort_keys=True, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -22,10 +22,17 @@ if IS_DEV:
 else:
     QUEUE_NAME = 'dedupe'
 
-# Allowed values for parameters and headers
+# Allowed values for parameters and headers. Darwin Core Archives can be sent
+# as any of ARCHIVE_TYPES
 ALLOWED_ACTIONS = ["report", "flag", "remove"]
-ALLOWED_TYPES = ["text/csv", "text/tab-separated-values"]
-ALLOWED_DUPLICATES = ["strict", "partial", "all"]
+ARCHIVE_TYPES = ["application/zip", "application/x-dwca"]
+ALLOWED_TYPES = ["text/csv", "text/tab-separated-values"] + ARCHIVE_TYPES
+ALLOWED_DUPLICATES = ["strict", "partial", "fuzzy", "locality", "all"]
+ALLOWED_ENCODINGS = ["identity", "gzip"]
+
+# Types of duplicates checked when "all" are requested. Fuzzy and locality
+# duplicates are only checked on request
+ALL_DUPLICATES = ["strict", "partial"]
 
 # Names of default fields for partial duplicate detection
 LOC = "locality"
@@ -33,16 +40,132 @@ SCI = "scientificName"
 COL = "recordedBy"
 DAT = "eventDate"
 
+# Normalizers for the fields of partial duplicate keys, given in the
+# "partial_fields" parameter as field:normalizer (exact by default):
+# - exact: values as they are
+# - case: lowercase, no accents
+# - text: same as case, with punctuation and runs of whitespace as one space
+# - date: ISO 8601 dates
+ALLOWED_NORMALIZERS = ["exact", "case", "text", "date"]
+
+# Number of normalized values remembered per partial duplicate key field
+NORMALIZER_CACHE_SIZE = 10000
+
 # Codification of duplicate type
 NO_DUPE = 0
 STRICT_DUPE = 1
 PARTIAL_DUPE = 2
+FUZZY_DUPE = 3
+LOCALITY_DUPE = 4
+
+# Backend for the seen-key store ("memory" or "memcache")
+SEEN_KEY_STORE = "memory"
+
+# Hash function for record fingerprints: "md5" (always available), or "xxh64",
+# "xxh128" and "murmur3" if the xxhash or mmh3 packages are installed in lib/
+FINGERPRINT = "md5"
+
+# Compare the bytes of records with the same fingerprint, to rule out hash
+# collisions. Keeps a copy of each distinct record in memory
+VERIFY_FINGERPRINTS = False
+
+# Files in GCS are read in buffers of READ_BUFFER_SIZE bytes, keeping up to
+# PREFETCH_BUFFERS buffers read ahead, and written in blocks of
+# WRITE_BUFFER_SIZE bytes. Check the throughput in the logs to tune them
+READ_BUFFER_SIZE = 4 * 1024 * 1024
+PREFETCH_BUFFERS = 2
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Compression level of gzip-compressed result files
+COMPRESS_LEVEL = 6
+
+# Uploads are sniffed for headers in the first PEEK_SIZE bytes, and copied to
+# GCS in chunks of UPLOAD_CHUNK_SIZE bytes
+PEEK_SIZE = 64 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Strict-only reports hash raw records instead of parsing their fields, and
+# partial-only reports parse only the fields of partial keys and the "id" field
+RAW_RECORDS = True
+PROJECT_RECORDS = True
+
+# Number of records checked together against the seen-key store
+WINDOW_SIZE = 500
+
+# Fuzzy duplicates are looked for among records with the same scientific name
+# and year, comparing at most FUZZY_BLOCK_SIZE records per block. Records with
+# a similarity score of FUZZY_THRESHOLD or more (0 to 1) are duplicates
+FUZZY_BLOCK_SIZE = 50
+FUZZY_THRESHOLD = 0.85
+
+# Locality duplicates share scientific name and date, and have near-duplicate
+# localities. Localities are hashed in MinHash signatures of LSH_BANDS bands of
+# LSH_ROWS values, and only records sharing a band are compared. Pairs with an
+# estimated similarity of LOCALITY_THRESHOLD or more (0 to 1) are duplicates.
+# Up to LOCALITY_MAX_RECORDS records are kept in memory to be compared with
+# later ones. Past that, records are only compared with those, and the report
+# gets a warning
+LSH_BANDS = 10
+LSH_ROWS = 3
+LOCALITY_THRESHOLD = 0.7
+LOCALITY_MAX_RECORDS = 200000
+
+# Uploads of up to SYNC_MAX_SIZE bytes (uncompressed) are de-duplicated while
+# the request waits, and the results are returned in the response
+SYNC_MAX_SIZE = 1024 * 1024
+
+# Tasks save their progress every CHECKPOINT_INTERVAL seconds. When the task
+# has been running for TASK_DEADLINE seconds, it saves a checkpoint and
+# enqueues a new task to continue (push tasks are stopped after 600 seconds)
+CHECKPOINT_INTERVAL = 120
+TASK_DEADLINE = 540
+
+# Tasks store their progress every PROGRESS_INTERVAL seconds, for the status
+# endpoint. Jobs with no progress for STALLED_AFTER seconds are shown as
+# stalled
+PROGRESS_INTERVAL = 10
+STALLED_AFTER = 900
+
+# Files in the bucket are deleted by its lifecycle BUCKET_LIFETIME seconds
+# after they are written (the "age" of sh/lifecycle.json, in days, which must
+# match). Results of identical uploads with the same options are reused for
+# RESULT_CACHE_TTL seconds, while they are still there: they are copied to the
+# folder of the new request, so the links sent last as long as for a new job
+BUCKET_LIFETIME = 24 * 3600
+RESULT_CACHE_TTL = BUCKET_LIFETIME
+
+# Keys of the records of a collection are looked up in its persistent index
+# (see collection.py) in batches of COLLECTION_BATCH_SIZE keys, and added to it
+# in transactions of COLLECTION_TRANSACTION_SIZE keys (at most 25, the limit of
+# cross-group transactions).
+# Collection ids may have up to 64 letters, digits, dots, dashes or underscores
+COLLECTION_BATCH_SIZE = 500
+COLLECTION_TRANSACTION_SIZE = 25
+COLLECTION_PATTERN = r"^[0-9A-Za-z._-]{1,64}$"
+
+# Files are split in one shard per SHARD_SIZE bytes, up to MAX_SHARDS shards,
+# each parsed by a different task
+SHARD_SIZE = 64 * 1024 * 1024
+MAX_SHARDS = 32
+
+# Local runs with several processes split files in chunks of about
+# PARALLEL_CHUNK_SIZE bytes, each fingerprinted by a worker process
+PARALLEL_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Local runs in external-memory mode sort duplicate keys on disk, in runs of
+# EXTERNAL_RUN_SIZE keys. Each key takes about 70 bytes in memory, and strict
+# and partial keys are sorted at the same time
+EXTERNAL_RUN_SIZE = 1000000
 
 # Other configuration variables
 TASKURL = "/service/v0/dedupe"
+SPLITURL = "/service/v0/dedupe/split"
+SHARDURL = "/service/v0/dedupe/shard"
+MERGEURL = "/service/v0/dedupe/merge"
 BUCKET = "vn-dedupe"
 
-# Email variables
+# Email variables. The email holds a summary of the report, with a link to the
+# full report in GCS
 ACTION_FLAG = """
 Since you selected the "flag" option, the system has added some new fields to
 the dataset you provided. <field explanation here>.
@@ -61,13 +184,14 @@ EMAIL_ERROR_SUBJECT = "Something went wrong with the de-duplication process"
 EMAIL_SUCCESS_BODY = """Hello,
 
 This is a notification email to inform you that the file you sent to the
-VertNet de-duplication API is ready and available for download here (link
-available for 24h):
+VertNet de-duplication API is ready. The results are available for download
+here (links available for 24h):
 
 {}
 {}
-
-Finally, this is what the system has gathered from the de-duplication system:
+The full report lists each record with duplicates, and the positions and ids
+of its duplicates, one group per line. This is a summary of what the system
+has found:
 
 {}
 
@@ -19,7 +19,9 @@ import webapp2
 
 # API methods
 from Dedupe.DedupeAPI import DedupeApi
+from Dedupe.DedupeStatus import DedupeStatus
 from Dedupe.DedupeTask import DedupeTask
+from Dedupe.DedupeShard import DedupeSplit, DedupeShardTask, DedupeMergeTask
 from Dedupe.DedupeLog import DedupeLog
 
 LAST_UPDATED = ''
@@ -28,10 +30,17 @@ routes = [
 
     # API methods
     webapp2.Route(r'/api/v0/dedupe', handler=DedupeApi),
+    webapp2.Route(r'/api/v0/dedupe/<request_namespace:[0-9a-f-]+>',
+                  handler=DedupeStatus),
 
     # Background service
     webapp2.Route(r'/service/v0/dedupe', handler=DedupeTask),
 
+    # Sharded background services
+    webapp2.Route(r'/service/v0/dedupe/split', handler=DedupeSplit),
+    webapp2.Route(r'/service/v0/dedupe/shard', handler=DedupeShardTask),
+    webapp2.Route(r'/service/v0/dedupe/merge', handler=DedupeMergeTask),
+
     # Logging service
     webapp2.Route(r'/service/v0/log', handler=DedupeLog)
 
@@ -0,0 +1,138 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Command-line de-duplication of local files.
+
+Runs the same engine as the API on local CSV or TSV files, optionally
+gzip-compressed (.gz). The report is printed in JSON format.
+
+Usage:
+    python dedupe_cli.py [options] input [output]
+
+Examples:
+    python dedupe_cli.py occurrences.txt
+    python dedupe_cli.py --action flag occurrences.csv.gz flagged.csv.gz
+    python dedupe_cli.py --processes 8 --action remove big.txt clean.txt
+    python dedupe_cli.py --external --action flag huge.txt.gz flagged.txt
+
+"""
+
+import sys
+import gzip
+import json
+import logging
+import argparse
+
+from config import *
+from Dedupe.engine import dedupe
+from Dedupe.parallel import dedupe_parallel
+from Dedupe.external import dedupe_external
+
+
+def open_file(name, mode):
+    """Open a local file, gzip-compressed if the name ends in .gz."""
+    if name == "-":
+        return sys.stdin if mode.startswith("r") else sys.stdout
+    if name.endswith(".gz"):
+        return gzip.open(name, mode)
+    return open(name, mode)
+
+
+def guess_delimiter(name):
+    """Tab for .txt and .tsv files, comma otherwise."""
+    if name.endswith(".gz"):
+        name = name[:-3]
+    return "\t" if name.endswith((".txt", ".tsv")) else ","
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Look for duplicate records in a CSV or TSV file.")
+    parser.add_argument("input", help="file to parse (- for stdin)")
+    parser.add_argument("output", nargs="?",
+                        help="result file, for flag and remove actions"
+                             " (- for stdout)")
+    parser.add_argument("--action", default="report", choices=ALLOWED_ACTIONS)
+    parser.add_argument("--duplicates", default="all",
+                        choices=ALLOWED_DUPLICATES)
+    parser.add_argument("--delimiter",
+                        help="field delimiter (from the input file"
+                             " extension by default)")
+    parser.add_argument("--id", dest="id_field",
+                        help="field used as record id (id or occurrenceID"
+                             " by default)")
+    parser.add_argument("--partial-fields",
+                        help="fields of partial duplicate keys, as"
+                             " field:normalizer items separated by commas")
+    parser.add_argument("--external", action="store_true",
+                        help="sort keys on disk, for files larger than memory"
+                             " (strict and partial duplicates only)")
+    parser.add_argument("--performance", action="store_true",
+                        help="add stage times to the report")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="number of processes (0 for one per CPU). Only"
+                             " for uncompressed input files, and strict and"
+                             " partial duplicates")
+    parser.add_argument("--report", help="write the report to this file")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.action != "report" and args.output is None:
+        parser.error("an output file is needed for the %s action" %
+                     args.action)
+    logging.basicConfig(level=logging.INFO if args.verbose else
+                        logging.WARNING)
+
+    options = {
+        "action": args.action,
+        "duplicates": args.duplicates,
+        "delimiter": args.delimiter or guess_delimiter(args.input),
+        "id_field": args.id_field,
+        "partial_fields": args.partial_fields,
+        "performance": args.performance
+    }
+    parallel = args.processes != 1
+    if parallel and (args.input == "-" or args.input.endswith(".gz")):
+        parser.error("parallel runs need an uncompressed input file")
+    if args.external and (parallel or args.input == "-"):
+        parser.error("external runs need an input file, and one process")
+
+    f = None if parallel else open_file(args.input, "rb")
+    output = open_file(args.output, "wb") if args.output else None
+    try:
+        if parallel:
+            report = dedupe_parallel(args.input, output, options,
+                                     args.processes or None)
+        elif args.external:
+            report = dedupe_external(f, output, options)
+        else:
+            report = dedupe(f, output, options)
+    except ValueError, e:
+        parser.error(str(e))
+    finally:
+        for x in [f, output]:
+            if x not in [None, sys.stdin, sys.stdout]:
+                x.close()
+
+    report = json.dumps(report, sort_keys=True, indent=4)
+    if args.report:
+        with open(args.report, "w") as r:
+            r.write(report + "\n")
+    elif args.output != "-":
+        print report
+
+
+if __name__ == "__main__":
+    main()
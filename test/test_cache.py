@@ -0,0 +1,102 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Unit tests of the result cache keys and expiry."""
+
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from Dedupe import cache
+from Dedupe.cache import CACHE_OPTIONS, cache_key, find_result
+
+OPTIONS = {
+    "content_type": "text/csv",
+    "action": "flag",
+    "duplicates": "all",
+    "id_field": None,
+    "partial_fields": None,
+    "compress": False
+}
+
+
+class FakeCachedResult(object):
+    """CachedResult entities by id, as stored in the Datastore."""
+
+    entities = {}
+
+    def __init__(self, created_at):
+        self.created_at = created_at
+
+    @classmethod
+    def get_by_id(cls, key, namespace=None):
+        return cls.entities.get(key)
+
+
+class CacheKeyTest(unittest.TestCase):
+
+    def test_same_request(self):
+        self.assertEqual(cache_key("ab12", OPTIONS),
+                         cache_key("ab12", dict(OPTIONS)))
+        self.assertEqual(len(cache_key("ab12", OPTIONS)), 64)
+
+    def test_other_upload(self):
+        self.assertNotEqual(cache_key("ab12", OPTIONS),
+                            cache_key("ab13", OPTIONS))
+
+    def test_other_options(self):
+        key = cache_key("ab12", OPTIONS)
+        for name, value in [("content_type", "text/tab-separated-values"),
+                            ("action", "remove"), ("duplicates", "strict"),
+                            ("id_field", "occurrenceID"),
+                            ("partial_fields", "locality:text"),
+                            ("compress", True)]:
+            self.assertNotEqual(cache_key("ab12", dict(OPTIONS,
+                                                       **{name: value})),
+                                key, name)
+
+    def test_other_request_options(self):
+        # Options the results don't depend on are left out of the key
+        self.assertEqual(cache_key("ab12", dict(OPTIONS, email="a@b.c")),
+                         cache_key("ab12", OPTIONS))
+        self.assertEqual(set(CACHE_OPTIONS), set(OPTIONS))
+
+
+class FindResultTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model = cache.CachedResult
+        cache.CachedResult = FakeCachedResult
+
+    def tearDown(self):
+        cache.CachedResult = self.model
+        FakeCachedResult.entities.clear()
+
+    def test_find(self):
+        now = datetime.now()
+        FakeCachedResult.entities["new"] = FakeCachedResult(now)
+        FakeCachedResult.entities["old"] = FakeCachedResult(
+            now - timedelta(seconds=cache.RESULT_CACHE_TTL + 1))
+        self.assertIs(find_result("new"), FakeCachedResult.entities["new"])
+        # Files of old results may have been deleted by the bucket lifecycle
+        self.assertIsNone(find_result("old"))
+        self.assertIsNone(find_result("missing"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Unit tests of Darwin Core Archive reading."""
+
+import os
+import sys
+import zipfile
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from Dedupe.dwca import DarwinCoreArchive, open_member, local_name
+from Dedupe.engine import dedupe
+
+TERMS = "http://rs.tdwg.org/dwc/terms/"
+
+META = """<?xml version="1.0" encoding="UTF-8"?>
+<archive xmlns="http://rs.tdwg.org/dwc/text/">
+  <core encoding="UTF-8" fieldsTerminatedBy="\\t" linesTerminatedBy="\\n"
+        fieldsEnclosedBy="%(quote)s" ignoreHeaderLines="1"
+        rowType="http://rs.tdwg.org/dwc/terms/Occurrence">
+    <files><location>occurrence.txt</location></files>
+    <id index="0"/>
+    <field index="1" term="%(terms)slocality"/>
+    <field index="2" term="%(terms)sscientificName"/>
+    <field index="3" term="%(terms)seventDate"/>
+    <field index="4" term="%(terms)srecordedBy"/>
+  </core>
+</archive>
+"""
+
+CORE = """id\tlocality\tscientificName\teventDate\trecordedBy
+1\t"Lawrence\tPuma concolor\t2001\tSmith
+2\t"Lawrence\tPuma concolor\t2001\tSmith
+"""
+
+
+def archive(meta=None, core=CORE, folder="", quote=""):
+    """Build a zip archive with a meta.xml and a core file."""
+    if meta is None:
+        meta = META % {"quote": quote, "terms": TERMS}
+    f = StringIO()
+    z = zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED)
+    z.writestr(folder + "meta.xml", meta)
+    z.writestr(folder + "occurrence.txt", core)
+    z.close()
+    f.seek(0)
+    return f
+
+
+class DarwinCoreArchiveTest(unittest.TestCase):
+
+    def test_local_name(self):
+        self.assertEqual(local_name(TERMS + "locality"), "locality")
+        self.assertEqual(local_name("{http://rs.tdwg.org/dwc/text/}core"),
+                         "core")
+
+    def test_meta(self):
+        dwca = DarwinCoreArchive(archive())
+        self.assertEqual(dwca.core, "occurrence.txt")
+        self.assertEqual(dwca.delimiter, "\t")
+        self.assertEqual(dwca.quotechar, "")
+        self.assertEqual(dwca.ignore_header_lines, 1)
+        self.assertEqual(dwca.headers, ["id", "locality", "scientificName",
+                                        "eventDate", "recordedBy"])
+        self.assertEqual(dwca.size, len(CORE))
+        self.assertEqual(dwca.open().read(), CORE)
+
+    def test_folder(self):
+        dwca = DarwinCoreArchive(archive(folder="dwca/"))
+        self.assertEqual(dwca.core, "dwca/occurrence.txt")
+        self.assertEqual(open_member(archive(folder="dwca/"),
+                                     dwca.core).read(), CORE)
+
+    def test_quotechar(self):
+        self.assertEqual(DarwinCoreArchive(archive(quote="'")).quotechar,
+                         "'")
+        meta = META.replace('fieldsEnclosedBy="%(quote)s"', "")
+        meta = meta % {"terms": TERMS}
+        self.assertEqual(DarwinCoreArchive(archive(meta)).quotechar, '"')
+
+    def test_no_quotechar(self):
+        # Quotes of tab-delimited core files with an empty fieldsEnclosedBy
+        # are part of the values
+        dwca = DarwinCoreArchive(archive())
+        report = dedupe(dwca.open(), options={"delimiter": dwca.delimiter,
+                                              "quotechar": dwca.quotechar})
+        self.assertEqual(report["records"], 2)
+        self.assertEqual(report["partial_duplicates"]["count"], 1)
+
+    def test_rejected(self):
+        meta = META % {"quote": "", "terms": TERMS}
+        for wrong in [meta.replace('core encoding="UTF-8"',
+                                   'core encoding="UTF-16"'),
+                      meta.replace('linesTerminatedBy="\\n"',
+                                   'linesTerminatedBy="\\r"'),
+                      meta.replace('fieldsTerminatedBy="\\t"',
+                                   'fieldsTerminatedBy="ab"'),
+                      meta.replace('fieldsEnclosedBy=""',
+                                   'fieldsEnclosedBy="ab"'),
+                      meta.replace("<location>occurrence.txt</location>", ""),
+                      meta.replace("core", "extension"),
+                      "\n".join(x for x in meta.split("\n")
+                                if "index=" not in x)]:
+            self.assertRaises(ValueError, DarwinCoreArchive, archive(wrong))
+
+    def test_missing_files(self):
+        f = StringIO()
+        z = zipfile.ZipFile(f, "w")
+        z.writestr("occurrence.txt", CORE)
+        z.close()
+        self.assertRaises(ValueError, DarwinCoreArchive, f)
+        meta = META % {"quote": "", "terms": TERMS}
+        meta = meta.replace("occurrence.txt", "other.txt")
+        self.assertRaises(KeyError, DarwinCoreArchive, archive(meta))
+        self.assertRaises(zipfile.BadZipfile, DarwinCoreArchive,
+                          StringIO(CORE))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Unit tests of the de-duplication engine, run on local files."""
+
+import os
+import sys
+import csv
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from Dedupe.engine import dedupe
+
+# Record 3 is a strict duplicate of 1, record 2 a partial duplicate of 1 and
+# record 6 a partial duplicate of 5, with quoted fields
+DATA = """id,locality,scientificName,eventDate,recordedBy
+1,Lawrence,Puma concolor,2001-03-12,Smith
+2,Lawrence,Puma concolor,2001-03-12,Smith
+1,Lawrence,Puma concolor,2001-03-12,Smith
+4,Topeka,Lynx rufus,1999,Doe
+5,"Lawrence, KS",Puma concolor,2001,"Smith, J."
+6,"Lawrence, KS","Puma concolor",2001,"Smith, J."
+"""
+
+
+def run(data=DATA, **options):
+    """Return the report and the result rows of a run."""
+    output = StringIO()
+    report = dedupe(StringIO(data), output, options)
+    return report, list(csv.reader(StringIO(output.getvalue())))
+
+
+class DedupeTest(unittest.TestCase):
+
+    def test_report(self):
+        report, rows = run()
+        self.assertEqual(rows, [])
+        self.assertEqual(report["records"], 6)
+        self.assertEqual(report["fields"], 5)
+        self.assertEqual(report["strict_duplicates"], {
+            "count": 1,
+            "originals": 1,
+            "clusters": [{"original": 1, "duplicates": [3], "ids": ["1"]}]
+        })
+        self.assertEqual(report["partial_duplicates"], {
+            "count": 2,
+            "originals": 2,
+            "clusters": [{"original": 1, "duplicates": [2], "ids": ["2"]},
+                         {"original": 5, "duplicates": [6], "ids": ["6"]}]
+        })
+        self.assertNotIn("fuzzy_duplicates", report)
+        self.assertNotIn("warnings", report)
+
+    def test_flag(self):
+        report, rows = run(action="flag")
+        self.assertEqual(rows[0], ["id", "locality", "scientificName",
+                                   "eventDate", "recordedBy", "isDuplicate",
+                                   "duplicateType", "duplicateOf"])
+        self.assertEqual([x[-3:] for x in rows[1:]],
+                         [["False", "", ""], ["True", "2", "1"],
+                          ["True", "1", "1"], ["False", "", ""],
+                          ["False", "", ""], ["True", "2", "5"]])
+        self.assertEqual(rows[5][:5], ["5", "Lawrence, KS", "Puma concolor",
+                                       "2001", "Smith, J."])
+
+    def test_remove(self):
+        report, rows = run(action="remove")
+        self.assertEqual([x[0] for x in rows], ["id", "1", "4", "5"])
+        self.assertEqual(report["strict_duplicates"]["count"], 1)
+        self.assertEqual(report["partial_duplicates"]["count"], 2)
+
+    def test_single_types(self):
+        # Strict-only reports hash raw records, partial-only reports only
+        # parse the key fields: same results as full runs
+        for duplicates in ["strict", "partial"]:
+            report, rows = run(duplicates=duplicates)
+            flagged, rows = run(duplicates=duplicates, action="flag")
+            self.assertEqual(report[duplicates + "_duplicates"],
+                             flagged[duplicates + "_duplicates"])
+        report, rows = run(duplicates="partial")
+        self.assertEqual(report["partial_duplicates"]["count"], 3)
+        self.assertEqual(report["strict_duplicates"]["count"], 0)
+
+    def test_tab_delimited(self):
+        data = DATA.replace(",", "\t").replace('"Lawrence\t KS"',
+                                               "Lawrence, KS")
+        data = data.replace('"Smith\t J."', "Smith, J.")
+        report, rows = run(data, delimiter="\t", quotechar="")
+        self.assertEqual(report["records"], 6)
+        # With no quote character, quotes are part of the values
+        self.assertEqual(report["partial_duplicates"]["count"], 1)
+        report, rows = run(data.replace('"', ""), delimiter="\t",
+                           quotechar="")
+        self.assertEqual(report["partial_duplicates"]["count"], 2)
+
+    def test_partial_fields(self):
+        report, rows = run(partial_fields="scientificName:text,"
+                                          "eventDate:date")
+        self.assertEqual(report["partial_duplicates"]["count"], 2)
+        self.assertEqual(report["strict_duplicates"]["count"], 1)
+
+    def test_id_field(self):
+        report, rows = run(id_field="recordedBy")
+        self.assertEqual(report["strict_duplicates"]["clusters"][0]["ids"],
+                         ["Smith"])
+
+    def test_errors(self):
+        self.assertRaises(ValueError, run, action="delete")
+        self.assertRaises(ValueError, run, duplicates="some")
+        self.assertRaises(ValueError, run, id_field="catalogNumber")
+        self.assertRaises(ValueError, run, partial_fields="county")
+        # Partial duplicates need the default fields, unless others are given
+        data = "id,locality,eventDate\n1,a,2001\n1,a,2001\n"
+        self.assertRaises(ValueError, run, data)
+        report, rows = run(data, partial_fields="locality")
+        self.assertEqual(report["partial_duplicates"]["count"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
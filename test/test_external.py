@@ -0,0 +1,90 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Unit tests of external-memory de-duplication of local files."""
+
+import os
+import sys
+import random
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from Dedupe.engine import dedupe
+from Dedupe.external import ExternalSort, by_record, dedupe_external
+
+HEADER = "id,locality,scientificName,eventDate,recordedBy\n"
+
+
+def records(n, seed=1):
+    """Build n records with strict and partial duplicates, some quoted."""
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(n):
+        locality = rnd.choice(["Lawrence", '"Lawrence, KS"', '"a\nb"'])
+        lines.append("%s,%s,Puma concolor,%s,Smith\n" % (
+            rnd.randint(0, 5), locality, rnd.randint(2000, 2010)))
+    return "".join(lines)
+
+
+class ExternalSortTest(unittest.TestCase):
+
+    def test_items(self):
+        rnd = random.Random(1)
+        items = [("%02d" % rnd.randint(0, 20), i) for i in range(1000)]
+        for run_size in [1, 7, 5000]:
+            ordered = ExternalSort(run_size)
+            for key, records in items:
+                ordered.add(key, records)
+            self.assertEqual(list(ordered.items()), sorted(items))
+            self.assertEqual(ordered.runs, [])
+
+    def test_duplicates(self):
+        ordered = ExternalSort(2)
+        for key, records in [("b", 1), ("a", 2), ("b", 300), ("a", 4),
+                             ("b", 5), ("c", 6)]:
+            ordered.add(key, records)
+        self.assertEqual(list(ordered.duplicates()),
+                         [(2, 4), (1, 5), (1, 300)])
+
+    def test_by_record(self):
+        pairs = [(1, 300), (2, 4), (1, 5)]
+        self.assertEqual(list(by_record(pairs, 2)),
+                         [(4, 2), (5, 1), (300, 1)])
+
+
+class DedupeExternalTest(unittest.TestCase):
+
+    def test_same_as_serial(self):
+        data = HEADER + records(2000)
+        for action in ["report", "flag", "remove"]:
+            for duplicates in ["all", "strict", "partial"]:
+                options = {"action": action, "duplicates": duplicates}
+                serial = StringIO()
+                expected = dedupe(StringIO(data), serial, options)
+                output = StringIO()
+                report = dedupe_external(StringIO(data), output, options,
+                                         run_size=100)
+                self.assertEqual(report, expected)
+                self.assertEqual(output.getvalue(), serial.getvalue())
+
+    def test_not_external(self):
+        self.assertRaises(ValueError, dedupe_external, StringIO(HEADER),
+                          options={"duplicates": "locality"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Unit tests of the record fingerprints."""
+
+import os
+import sys
+import hashlib
+import logging
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from Dedupe.fingerprint import Fingerprinter, HASHES, SEPARATOR
+
+
+def short_hash(data):
+    """One-byte digest, so that different records collide."""
+    return hashlib.md5(data).digest()[:1]
+
+
+class FingerprinterTest(unittest.TestCase):
+
+    def setUp(self):
+        # Collisions are logged as warnings
+        logging.disable(logging.WARNING)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_fields(self):
+        fingerprint = Fingerprinter(verify=False)
+        self.assertEqual(fingerprint(["a", "b"]),
+                         fingerprint.data("a%sb" % SEPARATOR))
+        self.assertEqual(len(fingerprint(["a", "b"])), 16)
+        # Fields are never merged by the separator
+        self.assertNotEqual(fingerprint(["ab", ""]), fingerprint(["a", "b"]))
+        self.assertNotEqual(fingerprint(["a", "b"]), fingerprint(["b", "a"]))
+
+    def test_hashes(self):
+        for algorithm in HASHES:
+            fingerprint = Fingerprinter(algorithm, verify=False)
+            self.assertEqual(fingerprint.algorithm, algorithm)
+            self.assertEqual(fingerprint(["a", "b"]), fingerprint(["a", "b"]))
+
+    def test_unknown_hash(self):
+        fingerprint = Fingerprinter("nope", verify=False)
+        self.assertEqual(fingerprint.algorithm, "md5")
+
+    def test_not_verified(self):
+        fingerprint = Fingerprinter(verify=False)
+        fingerprint(["a", "b"])
+        self.assertEqual(fingerprint.exact, {})
+
+    def test_collisions(self):
+        fingerprint = Fingerprinter(verify=True)
+        fingerprint.hash = short_hash
+        records = [["record", str(i)] for i in range(200)]
+        keys = [fingerprint(x) for x in records]
+        # Different records get different fingerprints, copies the same one
+        self.assertEqual(len(set(keys)), len(records))
+        self.assertEqual([fingerprint(x) for x in records], keys)
+
+    def test_dump_load(self):
+        fingerprint = Fingerprinter(verify=True, track_added=True)
+        fingerprint.hash = short_hash
+        first = StringIO()
+        keys = [fingerprint(["record", str(i)]) for i in range(100)]
+        fingerprint.dump(first)
+        self.assertEqual(fingerprint.added, [])
+        second = StringIO()
+        keys += [fingerprint(["record", str(i)]) for i in range(200)][100:]
+        fingerprint.dump(second)
+
+        # Restored records keep the same fingerprints after collisions
+        restored = Fingerprinter(verify=True)
+        restored.hash = short_hash
+        for f in [first, second]:
+            f.seek(0)
+            restored.load(f)
+        self.assertEqual(restored.exact, fingerprint.exact)
+        self.assertEqual([restored(["record", str(i)]) for i in range(200)],
+                         keys)
+
+    def test_added_not_tracked(self):
+        fingerprint = Fingerprinter(verify=True)
+        fingerprint(["a", "b"])
+        self.assertEqual(fingerprint.added, [])
+        self.assertEqual(len(fingerprint.exact), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
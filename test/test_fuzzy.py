@@ -0,0 +1,115 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Unit tests of fuzzy duplicate detection."""
+
+import os
+import sys
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from Dedupe.fuzzy import FuzzyIndex, bigrams, similarity
+
+# loc, sci, col, dat of a record
+RECORD = ["3 km N of Springfield", "Puma concolor", "Smith, J.", "2001-03-12"]
+
+
+class SimilarityTest(unittest.TestCase):
+
+    def test_bigrams(self):
+        self.assertEqual(bigrams("ab"), frozenset([" a", "ab", "b "]))
+        self.assertEqual(bigrams(""), frozenset(["  "]))
+
+    def test_similarity(self):
+        self.assertEqual(similarity(bigrams("abc"), bigrams("abc")), 1.0)
+        self.assertEqual(similarity(bigrams("abc"), bigrams("xyz")), 0.0)
+        score = similarity(bigrams("springfield"), bigrams("springfeld"))
+        self.assertTrue(0.8 < score < 1.0)
+
+
+class FuzzyIndexTest(unittest.TestCase):
+
+    def test_block_key(self):
+        self.assertEqual(FuzzyIndex.block_key("puma concolor", "2001-03-12"),
+                         "puma concolor|2001")
+        self.assertIsNone(FuzzyIndex.block_key("", "2001"))
+
+    def test_similar(self):
+        index = FuzzyIndex()
+        self.assertIsNone(index.check(*RECORD + [1]))
+        # Typos, case, punctuation and date format
+        ref, score = index.check("3 km N of Springfeld", "PUMA CONCOLOR",
+                                 "smith j", "12 Mar 2001", 2)
+        self.assertEqual(ref, 1)
+        self.assertTrue(0.85 <= score <= 1.0)
+        self.assertEqual(index.check(*RECORD + [3]), (1, 1.0))
+
+    def test_different(self):
+        index = FuzzyIndex()
+        index.check(*RECORD + [1])
+        # Other locality, other year, other species, no species
+        self.assertIsNone(index.check("Shelbyville", "Puma concolor",
+                                      "Smith, J.", "2001-03-12", 2))
+        self.assertIsNone(index.check("3 km N of Springfield",
+                                      "Puma concolor", "Smith, J.",
+                                      "2002-03-12", 3))
+        self.assertIsNone(index.check("3 km N of Springfield", "Lynx rufus",
+                                      "Smith, J.", "2001-03-12", 4))
+        self.assertIsNone(index.check("3 km N of Springfield", "",
+                                      "Smith, J.", "2001-03-12", 5))
+        self.assertEqual(len(index.blocks), 3)
+        self.assertEqual(len(index.blocks["puma concolor|2001"]), 2)
+
+    def test_block_size(self):
+        index = FuzzyIndex(block_size=2)
+        index.check("Alpha", "Puma concolor", "A", "2001", 1)
+        index.check("Bravo", "Puma concolor", "B", "2001", 2)
+        index.check("Charlie", "Puma concolor", "C", "2001", 3)
+        self.assertEqual(len(index.blocks["puma concolor|2001"]), 2)
+        # Records past the block size are not compared
+        self.assertIsNone(index.check("Charlie", "Puma concolor", "C",
+                                      "2001", 4))
+        self.assertEqual(index.check("Bravo", "Puma concolor", "B",
+                                     "2001", 5), (2, 1.0))
+
+    def test_dump_load(self):
+        index = FuzzyIndex(track_added=True)
+        index.check(*RECORD + [1])
+        first = StringIO()
+        index.dump(first)
+        self.assertEqual(index.added, [])
+        index.check("Shelbyville", "Lynx rufus", "Doe", "1999", 2)
+        second = StringIO()
+        index.dump(second)
+
+        restored = FuzzyIndex()
+        for f in [first, second]:
+            f.seek(0)
+            restored.load(f)
+        self.assertEqual(restored.blocks, index.blocks)
+        self.assertEqual(restored.features, index.features)
+        self.assertEqual(restored.check("Shelbyvile", "Lynx rufus", "Doe",
+                                        "1999", 3)[0], 2)
+
+    def test_added_not_tracked(self):
+        index = FuzzyIndex()
+        index.check(*RECORD + [1])
+        self.assertEqual(index.added, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
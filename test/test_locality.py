@@ -0,0 +1,128 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Unit tests of locality duplicate detection."""
+
+import os
+import sys
+import logging
+import unittest
+from functools import partial
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from Dedupe import engine
+from Dedupe.locality import LocalityIndex, shingles
+
+LOCALITY = "5 km N of Lawrence, Douglas County, Kansas"
+SIMILAR = "5 km N. of Lawrence, Douglas Co., Kansas"
+
+
+class LocalityIndexTest(unittest.TestCase):
+
+    def test_shingles(self):
+        self.assertEqual(len(shingles("abcd")), 2)
+        self.assertEqual(len(shingles("ab")), 1)
+        self.assertEqual(shingles("abcabc"), shingles("abcabcabc"))
+
+    def test_signature(self):
+        index = LocalityIndex()
+        signature = index.signature("lawrence")
+        self.assertEqual(len(signature), index.bands * index.rows)
+        self.assertEqual(LocalityIndex().signature("lawrence"), signature)
+
+    def test_similar(self):
+        index = LocalityIndex()
+        self.assertIsNone(index.check(LOCALITY, "Puma concolor", "2001-03-12",
+                                      1))
+        ref, score = index.check(SIMILAR, "PUMA CONCOLOR", "12/03/2001", 2)
+        self.assertEqual(ref, 1)
+        self.assertTrue(index.threshold <= score < 1.0)
+        self.assertEqual(index.check(LOCALITY, "Puma concolor",
+                                     "2001-03-12", 3), (1, 1.0))
+
+    def test_different(self):
+        index = LocalityIndex()
+        index.check(LOCALITY, "Puma concolor", "2001-03-12", 1)
+        # Other locality, other date, other species, no locality
+        self.assertIsNone(index.check("Topeka, Shawnee County, Kansas",
+                                      "Puma concolor", "2001-03-12", 2))
+        self.assertIsNone(index.check(LOCALITY, "Puma concolor",
+                                      "2001-03-13", 3))
+        self.assertIsNone(index.check(LOCALITY, "Lynx rufus", "2001-03-12",
+                                      4))
+        self.assertIsNone(index.check("", "Puma concolor", "2001-03-12", 5))
+        self.assertEqual(len(index.signatures), 4)
+
+    def test_max_records(self):
+        index = LocalityIndex(max_records=2)
+        index.check("Alpha", "Puma concolor", "2001", 1)
+        self.assertFalse(index.is_full())
+        index.check("Bravo", "Puma concolor", "2001", 2)
+        self.assertTrue(index.is_full())
+        # Records past the cap are compared, but not indexed
+        self.assertIsNone(index.check("Charlie", "Puma concolor", "2001", 3))
+        self.assertIsNone(index.check("Charlie", "Puma concolor", "2001", 4))
+        self.assertEqual(index.check("Bravo", "Puma concolor", "2001", 5),
+                         (2, 1.0))
+        self.assertEqual(len(index.signatures), 2)
+
+    def test_dump_load(self):
+        index = LocalityIndex(track_added=True)
+        index.check(LOCALITY, "Puma concolor", "2001-03-12", 1)
+        first = StringIO()
+        index.dump(first)
+        self.assertEqual(index.added, [])
+        index.check("Topeka, Shawnee County", "Lynx rufus", "1999", 2)
+        second = StringIO()
+        index.dump(second)
+
+        restored = LocalityIndex()
+        for f in [first, second]:
+            f.seek(0)
+            restored.load(f)
+        self.assertEqual(restored.signatures, index.signatures)
+        self.assertEqual(restored.buckets, index.buckets)
+        self.assertEqual(restored.check(SIMILAR, "Puma concolor",
+                                        "2001-03-12", 3)[0], 1)
+
+    def test_added_not_tracked(self):
+        index = LocalityIndex()
+        index.check(LOCALITY, "Puma concolor", "2001-03-12", 1)
+        self.assertEqual(index.added, [])
+
+
+class MaxRecordsWarningTest(unittest.TestCase):
+
+    def setUp(self):
+        engine.LocalityIndex = partial(LocalityIndex, max_records=2)
+        logging.disable(logging.WARNING)
+
+    def tearDown(self):
+        engine.LocalityIndex = LocalityIndex
+        logging.disable(logging.NOTSET)
+
+    def test_warning(self):
+        lines = ["locality,scientificName,eventDate,recordedBy"]
+        lines += ["Town %s,Puma concolor,2001,Smith" % x for x in "ABCDE"]
+        report = engine.dedupe(StringIO("\n".join(lines)),
+                               options={"duplicates": "locality"})
+        self.assertEqual(len(report["warnings"]), 1)
+        self.assertIn("first 2 records", report["warnings"][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Unit tests of the field normalizers and partial duplicate key fields."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from Dedupe.normalize import fold_case, normalize_text, normalize_date, \
+    memoize, compile_key
+from Dedupe.engine import parse_partial_fields, find_default_fields, \
+    needs_default_fields, default_partial_fields
+
+HEADERS = ["id", "locality", "scientificName", "recordedBy", "eventDate"]
+
+
+class NormalizersTest(unittest.TestCase):
+
+    def test_fold_case(self):
+        self.assertEqual(fold_case("Mu\xc3\xb1oz"), "munoz")
+        self.assertEqual(fold_case("ABC"), "abc")
+        # Not UTF-8: only lowercased
+        self.assertEqual(fold_case("Mu\xf1oz"), "mu\xf1oz")
+
+    def test_normalize_text(self):
+        self.assertEqual(normalize_text("Smith, J."), "smith j")
+        self.assertEqual(normalize_text("  smith_j  "), "smith j")
+        self.assertEqual(normalize_text(""), "")
+
+    def test_normalize_date(self):
+        for value in ["2001-03-12", "2001/3/12", "12/03/2001", "12.3.2001",
+                      "12 Mar 2001", "12 March 2001", "March 12, 2001",
+                      "2001-03-12T10:00", "2001-03-12/2001-03-15"]:
+            self.assertEqual(normalize_date(value), "2001-03-12", value)
+        # Month first when the day can't be a month
+        self.assertEqual(normalize_date("03/25/2001"), "2001-03-25")
+        self.assertEqual(normalize_date("2001-3"), "2001-03")
+        self.assertEqual(normalize_date("Mar 2001"), "2001-03")
+        self.assertEqual(normalize_date(" 2001 "), "2001")
+        self.assertEqual(normalize_date(" spring "), "spring")
+
+
+class CompileKeyTest(unittest.TestCase):
+
+    def test_memoize(self):
+        calls = []
+
+        def double(x):
+            calls.append(x)
+            return x * 2
+
+        memoized = memoize(double, size=4)
+        for value in [1, 2, 1, 2, 3, 4, 5, 1]:
+            self.assertEqual(memoized(value), value * 2)
+        self.assertEqual(calls, [1, 2, 3, 4, 5, 1])
+
+    def test_exact(self):
+        key = compile_key([[2, "exact"], [1, "exact"]])
+        self.assertEqual(key(["a", "b", "c"]), ("c", "b"))
+        key = compile_key([[1, "exact"]])
+        self.assertEqual(key(["a", "b", "c"]), ("b",))
+
+    def test_normalized(self):
+        key = compile_key([[0, "text"], [1, "date"], [2, "case"],
+                           [3, "exact"]])
+        row = ["Smith, J.", "12 Mar 2001", "Puma CONCOLOR", "X"]
+        self.assertEqual(key(row), ["smith j", "2001-03-12", "puma concolor",
+                                    "X"])
+        self.assertEqual(key(row), key(row))
+
+    def test_no_fields(self):
+        self.assertEqual(compile_key([])(["a", "b"]), ())
+
+    def test_dictionary_rows(self):
+        # Projected records are dictionaries of the fields needed
+        key = compile_key([[3, "text"]])
+        self.assertEqual(key({3: "Smith, J."}), ["smith j"])
+
+
+class PartialFieldsTest(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(parse_partial_fields("eventdate:date, locality",
+                                              HEADERS),
+                         [[4, "date"], [1, "exact"]])
+        self.assertRaises(ValueError, parse_partial_fields, "county",
+                          HEADERS)
+        self.assertRaises(ValueError, parse_partial_fields, "locality:soundex",
+                          HEADERS)
+
+    def test_default_fields(self):
+        self.assertEqual(find_default_fields(HEADERS), [1, 2, 3, 4])
+        positions = find_default_fields(["id", "locality", "eventDate"])
+        self.assertEqual(positions, [1, None, None, 2])
+        self.assertEqual(default_partial_fields(positions), [])
+        self.assertEqual(default_partial_fields([1, 2, 3, 4]),
+                         [[1, "exact"], [2, "exact"], [3, "exact"],
+                          [4, "exact"]])
+
+    def test_needs_default_fields(self):
+        self.assertTrue(needs_default_fields(["strict", "partial"], None))
+        self.assertFalse(needs_default_fields(["strict", "partial"],
+                                              [[1, "exact"]]))
+        self.assertFalse(needs_default_fields(["strict"], None))
+        self.assertTrue(needs_default_fields(["fuzzy"], [[1, "exact"]]))
+
+
+if __name__ == "__main__":
+    unittest.main()
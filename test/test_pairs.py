@@ -0,0 +1,82 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Unit tests of the duplicate pairs."""
+
+import os
+import sys
+import json
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from Dedupe.pairs import DuplicatePairs
+
+
+class DuplicatePairsTest(unittest.TestCase):
+
+    def test_pairs(self):
+        pairs = DuplicatePairs()
+        self.assertEqual(len(pairs), 0)
+        self.assertEqual(list(pairs.clusters()), [])
+        pairs.add((1, 3))
+        pairs.add((2, 4))
+        pairs.add((1, 5))
+        self.assertEqual(len(pairs), 3)
+        self.assertEqual(list(pairs), [(1, 3), (2, 4), (1, 5)])
+        self.assertEqual(pairs.count_originals(), 2)
+
+    def test_clusters(self):
+        pairs = DuplicatePairs()
+        # Pairs from shards come in any order
+        for pair, record_id in [((7, 9), "i"), ((1, 5), "e"), ((1, 3), "c")]:
+            pairs.add(pair, record_id)
+        self.assertEqual(list(pairs.clusters()), [
+            {"original": 1, "duplicates": [3, 5], "ids": ["c", "e"]},
+            {"original": 7, "duplicates": [9], "ids": ["i"]}
+        ])
+
+    def test_scored(self):
+        pairs = DuplicatePairs(scored=True)
+        pairs.add((1, 3, 0.9))
+        pairs.add((1, 2, 0.95))
+        self.assertEqual(list(pairs), [(1, 3, 0.9), (1, 2, 0.95)])
+        self.assertEqual(list(pairs.clusters()), [
+            {"original": 1, "duplicates": [2, 3], "scores": [0.95, 0.9]}
+        ])
+
+    def test_dump_load(self):
+        for scored, items in [(False, [(1, 3), (2, 4)]),
+                              (True, [(1, 3, 0.9), (2, 4, 0.85)])]:
+            pairs = DuplicatePairs(scored)
+            for pair in items:
+                pairs.add(pair, str(pair[1]))
+            # Dumps go through JSON in checkpoints
+            loaded = DuplicatePairs.load(json.loads(json.dumps(pairs.dump())))
+            self.assertEqual(list(loaded), items)
+            self.assertEqual(list(loaded.clusters()), list(pairs.clusters()))
+
+    def test_update(self):
+        pairs = DuplicatePairs(scored=True)
+        pairs.add((1, 3, 0.9), "c")
+        other = DuplicatePairs(scored=True)
+        other.add((2, 4, 0.8), "d")
+        pairs.update(other)
+        self.assertEqual(list(pairs), [(1, 3, 0.9), (2, 4, 0.8)])
+        self.assertEqual(pairs.ids, ["c", "d"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Unit tests of parallel de-duplication of local files."""
+
+import os
+import sys
+import csv
+import random
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from Dedupe.engine import dedupe
+from Dedupe.parallel import dedupe_parallel, split_ranges, find_cut
+from Dedupe.records import LineReader, csv_options
+
+HEADER = "id,locality,scientificName,eventDate,recordedBy\n"
+
+
+def boundaries(data, delimiter=",", quotechar='"'):
+    """Positions where the records of a file end, as parsed by the csv
+module."""
+    lines = LineReader(StringIO(data))
+    ends = []
+    for row in csv.reader(lines, **csv_options(delimiter, quotechar)):
+        ends.append(lines.tell())
+    return ends
+
+
+def records(n, seed=1):
+    """Build n records, with duplicates, quoted fields spanning lines, quotes
+inside unquoted fields and long lines."""
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(n):
+        if lines and rnd.random() < 0.2:
+            lines.append(rnd.choice(lines))
+            continue
+        locality = rnd.choice(['Lawrence', '"Lawrence, KS"',
+                               '"5 km N\nof Lawrence"', 'Law"rence',
+                               '"""Lawrence"" KS"', 'L' * 300])
+        lines.append("%s,%s,Puma concolor,%s,%s\n" % (
+            rnd.randint(0, 20), locality, rnd.randint(2000, 2002),
+            rnd.choice(["Smith", '"Smith, J."', 'Sm"ith'])))
+    return "".join(lines)
+
+
+class SplitRangesTest(unittest.TestCase):
+
+    def check_ranges(self, data, chunk_size, delimiter=",", quotechar='"'):
+        ranges = split_ranges(StringIO(data), 0, chunk_size, delimiter,
+                              quotechar)
+        # Contiguous ranges covering the file, cut at record boundaries
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(data))
+        for (start, end), (next_start, next_end) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, next_start)
+        ends = set(boundaries(data, delimiter, quotechar))
+        for start, end in ranges:
+            self.assertIn(end, ends)
+        return ranges
+
+    def test_plain(self):
+        data = "a,b\n" * 100
+        ranges = self.check_ranges(data, 10)
+        self.assertEqual(ranges[0], (0, 8))
+
+    def test_quoted(self):
+        data = records(300)
+        for chunk_size in [16, 50, 100, 1000]:
+            self.check_ranges(data, chunk_size)
+
+    def test_no_quotechar(self):
+        data = records(300).replace(",", "\t")
+        for chunk_size in [16, 100]:
+            self.check_ranges(data, chunk_size, "\t", "")
+
+    def test_find_cut(self):
+        # The newline inside the quoted field is not a record boundary
+        data = 'a,"b\nc",d\ne,f\n'
+        f = StringIO(data)
+        f.seek(6)
+        self.assertEqual(find_cut(f, 0, data[:6], ","), 10)
+        # Quotes inside unquoted fields don't start quoted fields
+        data = 'a,b"c\nd,e\n'
+        f = StringIO(data)
+        f.seek(4)
+        self.assertEqual(find_cut(f, 0, data[:4], ","), 6)
+
+
+class DedupeParallelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_same_as_serial(self):
+        data = HEADER + records(2000)
+        name = os.path.join(self.path, "data.csv")
+        with open(name, "wb") as f:
+            f.write(data)
+        for action in ["report", "flag", "remove"]:
+            options = {"action": action}
+            serial = StringIO()
+            expected = dedupe(StringIO(data), serial, options)
+            output = StringIO()
+            report = dedupe_parallel(name, output, options, processes=2,
+                                     chunk_size=1000)
+            self.assertEqual(report, expected)
+            self.assertEqual(output.getvalue(), serial.getvalue())
+
+    def test_not_parallel(self):
+        name = os.path.join(self.path, "data.csv")
+        with open(name, "wb") as f:
+            f.write(HEADER)
+        self.assertRaises(ValueError, dedupe_parallel, name,
+                          options={"duplicates": "fuzzy"})
+
+
+if __name__ == "__main__":
+    unittest.main()
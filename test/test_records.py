@@ -0,0 +1,136 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Unit tests of the line and raw record readers."""
+
+import os
+import sys
+import csv
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from Dedupe.records import LineReader, RecordReader, ProjectingReader, \
+    csv_options
+
+# Records with and without quoted fields, quotes inside fields, quoted line
+# breaks and delimiters, empty fields and line terminators
+LINES = [
+    'a,b,c\n',
+    '"a",b,c\n',
+    '"a,1",b,"c\nd"\n',
+    '"say ""hi""",b,c\r\n',
+    ',,\n',
+    'a,b"c,d\n',
+    'x,y,z'
+]
+
+
+def fields(row, delimiter=","):
+    """Fields of a record, whether it comes raw or parsed."""
+    if isinstance(row, str):
+        return row.split(delimiter)
+    return row
+
+
+class LineReaderTest(unittest.TestCase):
+
+    def test_lines(self):
+        data = "a,b\nc,d\r\n\ne,f"
+        for buffer_size in [1, 2, 5, 100]:
+            lines = LineReader(StringIO(data), buffer_size=buffer_size)
+            self.assertEqual(list(lines), ["a,b\n", "c,d\r\n", "\n", "e,f"])
+            self.assertEqual(lines.tell(), len(data))
+
+    def test_tell(self):
+        lines = LineReader(StringIO("a,b\nc,d\n"), offset=10)
+        next(lines)
+        self.assertEqual(lines.tell(), 14)
+
+
+class RecordReaderTest(unittest.TestCase):
+
+    def check_equivalent(self, data, delimiter=",", quotechar='"'):
+        """Check the reader gets the same fields as a csv-reader, whatever
+the buffer size."""
+        expected = list(csv.reader(StringIO(data),
+                                   **csv_options(delimiter, quotechar)))
+        for buffer_size in [1, 3, 100]:
+            lines = LineReader(StringIO(data), buffer_size=buffer_size)
+            reader = RecordReader(lines, delimiter, quotechar)
+            self.assertEqual([fields(x, delimiter) for x in reader],
+                             expected)
+            self.assertEqual(reader.tell(), len(data))
+
+    def test_equivalent(self):
+        self.check_equivalent("".join(LINES))
+
+    def test_raw(self):
+        reader = RecordReader(LineReader(StringIO("".join(LINES))), ",")
+        rows = list(reader)
+        self.assertEqual(rows[0], "a,b,c")
+        self.assertEqual(rows[4], ",,")
+        self.assertEqual(rows[-1], "x,y,z")
+        self.assertEqual(rows[1], ["a", "b", "c"])
+        self.assertEqual(rows[2], ["a,1", "b", "c\nd"])
+
+    def test_tab_delimited(self):
+        data = "".join(x.replace(",", "\t") for x in LINES)
+        self.check_equivalent(data, "\t")
+
+    def test_no_quotechar(self):
+        data = 'a\t"b\tc\n"d"\t"\te\n'
+        self.check_equivalent(data, "\t", "")
+        reader = RecordReader(LineReader(StringIO(data)), "\t", "")
+        self.assertEqual(list(reader), ['a\t"b\tc', '"d"\t"\te'])
+
+    def test_other_quotechar(self):
+        data = "'a,b',\"c\n'd''e',f\n"
+        self.check_equivalent(data, ",", "'")
+
+    def test_rejected(self):
+        # Lines with NUL bytes or lone carriage returns are rejected as by the
+        # csv module. NUL bytes would otherwise be hashed like delimiters
+        for data in ["a\x00b,c\n", "a,b\nc\x00,d\n", "a,b\rc,d\n"]:
+            reader = RecordReader(LineReader(StringIO(data)), ",")
+            self.assertRaises(csv.Error, list, reader)
+
+
+class ProjectingReaderTest(unittest.TestCase):
+
+    def test_projected(self):
+        data = "".join(LINES)
+        expected = list(csv.reader(StringIO(data)))
+        for columns in [[0], [2, 0], [1, 1]]:
+            reader = ProjectingReader(LineReader(StringIO(data)), ",",
+                                      columns)
+            for row, full in zip(reader, expected):
+                self.assertEqual(row, dict((i, full[i]) for i in columns))
+
+    def test_last_field_not_split(self):
+        reader = ProjectingReader(LineReader(StringIO("a,b,c,d,e\n")), ",",
+                                  [1])
+        self.assertEqual(next(reader), {1: "b"})
+
+    def test_no_quotechar(self):
+        data = 'a\t"b\tc"\n'
+        reader = ProjectingReader(LineReader(StringIO(data)), "\t", [1, 2],
+                                  "")
+        self.assertEqual(next(reader), {1: '"b', 2: 'c"'})
+
+
+if __name__ == "__main__":
+    unittest.main()
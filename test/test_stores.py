@@ -0,0 +1,129 @@
+# This file is part of VertNet: https://github.com/VertNet/dedupe
+#
+# VertNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# VertNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VertNet.  If not, see: http://www.gnu.org/licenses
+
+"""Unit tests of the seen-key stores."""
+
+import os
+import sys
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from Dedupe import stores
+from Dedupe.stores import MemorySeenKeyStore, MemcacheSeenKeyStore, get_store
+
+
+class FakeMemcache(object):
+    """Dictionary with the memcache calls used by MemcacheSeenKeyStore."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get_multi(self, keys, namespace=None):
+        return dict((k, self.data[(namespace, k)])
+                    for k in keys if (namespace, k) in self.data)
+
+    def set_multi(self, mapping, namespace=None):
+        for k, v in mapping.iteritems():
+            self.data[(namespace, k)] = v
+
+
+class MemorySeenKeyStoreTest(unittest.TestCase):
+
+    def test_check(self):
+        store = MemorySeenKeyStore("strict")
+        self.assertIsNone(store.check("a" * 8, 1))
+        self.assertIsNone(store.check("b" * 8, 2))
+        self.assertEqual(store.check("a" * 8, 3), 1)
+        self.assertEqual(store.check("a" * 8, 4), 1)
+
+    def test_check_multi(self):
+        store = MemorySeenKeyStore("strict")
+        store.check("a" * 8, 1)
+        firsts = store.check_multi([("b" * 8, 2), ("a" * 8, 3),
+                                    ("b" * 8, 4), ("c" * 8, 5)])
+        self.assertEqual(firsts, [None, 1, 2, None])
+
+    def test_added_not_tracked(self):
+        store = get_store("strict", backend="memory")
+        store.check_multi([("a" * 8, 1), ("b" * 8, 2)])
+        self.assertEqual(store.added, [])
+
+    def test_dump_load(self):
+        store = get_store("strict", backend="memory", track_added=True)
+        store.check_multi([("a" * 8, 1), ("b" * 8, 2), ("a" * 8, 3)])
+        self.assertEqual(store.added, ["a" * 8, "b" * 8])
+        first = StringIO()
+        store.dump(first)
+        self.assertEqual(store.added, [])
+        store.check_multi([("c" * 8, 4), ("b" * 8, 5)])
+        second = StringIO()
+        store.dump(second)
+
+        # Loading the dumps in order restores the store
+        restored = MemorySeenKeyStore("strict")
+        for f in [first, second]:
+            f.seek(0)
+            restored.load(f)
+        self.assertEqual(restored.keys, store.keys)
+        self.assertEqual(restored.check("c" * 8, 6), 4)
+
+    def test_dump_empty(self):
+        store = MemorySeenKeyStore("strict", track_added=True)
+        f = StringIO()
+        store.dump(f)
+        f.seek(0)
+        restored = MemorySeenKeyStore("strict")
+        restored.load(f)
+        self.assertEqual(restored.keys, {})
+
+
+class MemcacheSeenKeyStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.memcache = stores.memcache
+        stores.memcache = FakeMemcache()
+
+    def tearDown(self):
+        stores.memcache = self.memcache
+
+    def test_check_multi(self):
+        store = MemcacheSeenKeyStore("strict", "ns")
+        self.assertEqual(store.check_multi([("a" * 8, 1), ("a" * 8, 2)]),
+                         [None, 1])
+        self.assertEqual(store.check_multi([("b" * 8, 3), ("a" * 8, 4)]),
+                         [None, 1])
+        self.assertEqual(store.check("b" * 8, 5), 3)
+        self.assertEqual(store.rpcs, 5)
+
+    def test_kinds_and_namespaces(self):
+        store = MemcacheSeenKeyStore("strict", "ns")
+        store.check("a" * 8, 1)
+        self.assertIsNone(MemcacheSeenKeyStore("partial", "ns").check(
+            "a" * 8, 2))
+        self.assertIsNone(MemcacheSeenKeyStore("strict", "other").check(
+            "a" * 8, 2))
+
+    def test_interrupted_run(self):
+        # Keys stored by a previous run of the same records are new
+        MemcacheSeenKeyStore("strict", "ns").check("a" * 8, 1)
+        store = MemcacheSeenKeyStore("strict", "ns")
+        self.assertEqual(store.check_multi([("a" * 8, 1), ("a" * 8, 2)]),
+                         [None, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()